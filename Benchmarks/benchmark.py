@@ -0,0 +1,240 @@
+#region IMPORTS
+import argparse
+import importlib.util
+import json
+import os
+import pathlib
+import random
+import sys
+import tempfile
+import threading
+import time
+from configparser import ConfigParser
+#endregion
+
+# get parent directory and dependencies
+parentDir = str(pathlib.Path(__file__).parent.parent.absolute())
+parentDir = parentDir.replace("\\",'/')
+
+spec = importlib.util.spec_from_file_location('benchmarks', parentDir + '/Benchmarks/fakefirebase.py')
+fakefirebase = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(fakefirebase)
+
+API_PREFIX = "/RecipesPlusPlus"
+
+def parseArguments():
+    parser = argparse.ArgumentParser(description = "Benchmark the RecipesPlusPlus API endpoints against a local Firebase stand-in.")
+    parser.add_argument("--backend", choices = ["firebase", "sqlite"], default = "firebase", help = "storage backend the API is configured with")
+    parser.add_argument("--ingredients", type = int, default = 200, help = "number of synthetic ingredients")
+    parser.add_argument("--units", type = int, default = 20, help = "number of synthetic units")
+    parser.add_argument("--recipes", type = int, default = 500, help = "number of synthetic recipes")
+    parser.add_argument("--users", type = int, default = 200, help = "number of synthetic users")
+    parser.add_argument("--ingredients-per-recipe", type = int, default = 8)
+    parser.add_argument("--recipes-per-user", type = int, default = 10)
+    parser.add_argument("--items-per-user", type = int, default = 5)
+    parser.add_argument("--requests", type = int, default = 200, help = "requests issued per scenario")
+    parser.add_argument("--concurrency", type = int, default = 4, help = "number of concurrent clients")
+    parser.add_argument("--warmup", type = int, default = 10, help = "requests issued per scenario before measuring")
+    parser.add_argument("--write-consistency", choices = ["verify", "trust"], default = "verify", help = "whether writes are re-read before returning")
+    parser.add_argument("--accept", default = "application/json", help = "Accept header sent with every request (e.g. application/msgpack)")
+    parser.add_argument("--accept-encoding", default = "identity", help = "Accept-Encoding header sent with every request (e.g. gzip or br)")
+    parser.add_argument("--read-replica", action = "store_true", help = "serve reads from the in memory replica kept current through the stand-in's change streams (firebase backend only)")
+    parser.add_argument("--upstream-latency-ms", type = float, default = 0, help = "latency added to every Firebase stand-in call")
+    parser.add_argument("--scenarios", default = "", help = "comma separated scenario names to run (default: all)")
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--json", default = "", help = "also write the results to this JSON file")
+    return parser.parse_args()
+
+def buildDataset(args):
+    rng = random.Random(args.seed)
+    ingredients = [{"id": id, "image_url": f"https://example.com/ingredients/{id}.png", "name": f"Ingredient {id}"} for id in range(args.ingredients)]
+    units = [{"id": id, "name": f"Unit {id}"} for id in range(args.units)]
+
+    def quantities(count):
+        return [{"ingredientId": rng.randrange(args.ingredients), "unitId": rng.randrange(args.units), "quantity": rng.randint(1, 5)} for _ in range(count)]
+
+    recipes = [{
+        "calories": rng.randint(100, 1500),
+        "id": id,
+        "image_url": f"https://example.com/recipes/{id}.png",
+        "ingredients": quantities(args.ingredients_per_recipe),
+        "instructions": [f"Step {step} of recipe {id}." for step in range(rng.randint(3, 10))],
+        "name": f"Recipe {id}",
+        "time": rng.randint(5, 120)
+    } for id in range(args.recipes)]
+    users = [{
+        "email": f"user{id}@example.com",
+        "id": id,
+        "items": quantities(args.items_per_user),
+        "name": f"User {id}",
+        "recipes": rng.sample(range(args.recipes), min(args.recipes_per_user, args.recipes))
+    } for id in range(args.users)]
+    return {"ingredients": ingredients, "recipes": recipes, "units": units, "users": users}
+
+def buildScenarios(args, data):
+    rng = random.Random(args.seed + 1)
+    randomId = lambda collection: rng.randrange(len(data[collection]))
+    def recipeBody():
+        return json.dumps({"ingredients": [{"ingredientId": randomId("ingredients"), "unitId": randomId("units"), "quantity": 1}], "instructions": ["Mix."], "name": "Benchmark recipe"})
+    def userBody():
+        return json.dumps({"email": "benchmark@example.com", "items": [{"ingredientId": randomId("ingredients"), "unitId": randomId("units"), "quantity": 1}], "name": "Benchmark user", "recipes": [randomId("recipes")]})
+
+    # (name, method, path factory, body factory)
+    return [
+        ("GET /ingredients", "GET", lambda: f"{API_PREFIX}/ingredients/", None),
+        ("GET /ingredients/<id>", "GET", lambda: f"{API_PREFIX}/ingredients/{randomId('ingredients')}/", None),
+        ("GET /recipes", "GET", lambda: f"{API_PREFIX}/recipes/", None),
+        ("GET /recipes/<id>", "GET", lambda: f"{API_PREFIX}/recipes/{randomId('recipes')}/", None),
+        ("GET /users", "GET", lambda: f"{API_PREFIX}/users/", None),
+        ("GET /users/<id>", "GET", lambda: f"{API_PREFIX}/users/{randomId('users')}/", None),
+        ("GET /units", "GET", lambda: f"{API_PREFIX}/units/", None),
+        ("GET /users/<id>/grocery", "GET", lambda: f"{API_PREFIX}/users/{randomId('users')}/grocery", None),
+        ("GET /users/<id>/cookable", "GET", lambda: f"{API_PREFIX}/users/{randomId('users')}/cookable", None),
+        ("GET /users/<id>/cookable?missing=2", "GET", lambda: f"{API_PREFIX}/users/{randomId('users')}/cookable?missing=2", None),
+        ("PUT /recipes/<id>", "PUT", lambda: f"{API_PREFIX}/recipes/{randomId('recipes')}/", recipeBody),
+        ("PUT /users/<id>", "PUT", lambda: f"{API_PREFIX}/users/{randomId('users')}/", userBody),
+        ("POST /ingredients", "POST", lambda: f"{API_PREFIX}/ingredients/", lambda: json.dumps({"name": "Benchmark ingredient"}))
+    ]
+
+def writeSharedConfig(args, server, data, directory):
+    sharedConfig = ConfigParser()
+    sharedConfig.optionxform = str
+    sharedConfig['properties'] = {
+        "firebaseConfigJson": json.dumps({"apiKey": "benchmark", "authDomain": "benchmark", "databaseURL": server.url, "storageBucket": "benchmark"}),
+        "firebaseAuthEmail": "",
+        "firebaseAuthPassword": "",
+        "storageBackend": args.backend,
+        "sqlitePath": ":memory:",
+        "sqliteSeedJson": ""
+    }
+    if args.backend == "sqlite":
+        seedPath = directory + "/seed.json"
+        with open(seedPath, "w") as seedFile:
+            json.dump(data, seedFile)
+        sharedConfig['properties']["sqliteSeedJson"] = seedPath
+
+    configPath = directory + "/shared.ini"
+    with open(configPath, "w") as configFile:
+        sharedConfig.write(configFile)
+    return configPath
+
+def loadApi():
+    # the API module reads its configuration relative to the repository root
+    os.chdir(parentDir)
+    spec = importlib.util.spec_from_file_location('api', parentDir + '/RecipesPlusPlusApi/api.py')
+    api = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(api)
+    return api
+
+def percentile(sortedValues, fraction):
+    if not sortedValues:
+        return 0.0
+    index = min(len(sortedValues) - 1, max(0, int(round(fraction * len(sortedValues) + 0.5)) - 1))
+    return sortedValues[index]
+
+def runScenario(app, server, scenario, args):
+    name, method, pathFactory, bodyFactory = scenario
+    factoryLock = threading.Lock()
+
+    def nextRequest():
+        with factoryLock:
+            return pathFactory(), bodyFactory() if bodyFactory else None
+
+    headers = {"Accept": args.accept, "Accept-Encoding": args.accept_encoding}
+
+    def issue(client):
+        path, body = nextRequest()
+        # the test client runs the request in this thread, so its thread CPU time is the API's (the stand-in runs elsewhere)
+        start = time.perf_counter()
+        cpuStart = time.thread_time()
+        response = client.open(path, method = method, data = body, headers = headers)
+        size = len(response.get_data())
+        cpu = (time.thread_time() - cpuStart) * 1000
+        elapsed = (time.perf_counter() - start) * 1000
+        return elapsed, cpu, response.status_code, size
+
+    client = app.test_client()
+    for _ in range(args.warmup):
+        issue(client)
+
+    latencies = []
+    errors = 0
+    responseBytes = 0
+    cpuMs = 0.0
+    resultsLock = threading.Lock()
+    remaining = iter(range(args.requests))
+
+    def worker():
+        nonlocal errors, responseBytes, cpuMs
+        client = app.test_client()
+        while True:
+            with resultsLock:
+                if next(remaining, None) == None:
+                    return
+            elapsed, cpu, status, size = issue(client)
+            with resultsLock:
+                latencies.append(elapsed)
+                responseBytes += size
+                cpuMs += cpu
+                if status >= 400:
+                    errors += 1
+
+    callsBefore = server.database.callCount()
+    start = time.perf_counter()
+    workers = [threading.Thread(target = worker) for _ in range(args.concurrency)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    duration = time.perf_counter() - start
+    upstreamCalls = server.database.callCount() - callsBefore
+
+    latencies.sort()
+    return {
+        "scenario": name,
+        "requests": len(latencies),
+        "errors": errors,
+        "p50Ms": percentile(latencies, 0.50),
+        "p95Ms": percentile(latencies, 0.95),
+        "p99Ms": percentile(latencies, 0.99),
+        "throughputRps": len(latencies) / duration if duration > 0 else 0.0,
+        "upstreamCallsPerRequest": upstreamCalls / len(latencies) if latencies else 0.0,
+        "bytesPerResponse": responseBytes / len(latencies) if latencies else 0.0,
+        "cpuMsPerRequest": cpuMs / len(latencies) if latencies else 0.0
+    }
+
+def printReport(args, results):
+    print(f"backend={args.backend} readReplica={args.read_replica} writeConsistency={args.write_consistency} accept={args.accept} acceptEncoding={args.accept_encoding} ingredients={args.ingredients} recipes={args.recipes} users={args.users} units={args.units} requests={args.requests} concurrency={args.concurrency} upstreamLatencyMs={args.upstream_latency_ms}")
+    header = f"{'scenario':<36}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}{'upstream/req':>14}{'bytes/resp':>12}{'cpu ms/req':>12}{'errors':>8}"
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        print(f"{result['scenario']:<36}{result['p50Ms']:>10.2f}{result['p95Ms']:>10.2f}{result['p99Ms']:>10.2f}{result['throughputRps']:>10.1f}{result['upstreamCallsPerRequest']:>14.2f}{result['bytesPerResponse']:>12.0f}{result['cpuMsPerRequest']:>12.2f}{result['errors']:>8}")
+
+def main():
+    args = parseArguments()
+    data = buildDataset(args)
+    server = fakefirebase.startServer(data, args.upstream_latency_ms)
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ['RECIPESPLUSPLUS_SHARED_CONFIG'] = writeSharedConfig(args, server, data, directory)
+        api = loadApi()
+        api.queries.configureConsistency(args.write_consistency)
+        if args.read_replica and args.backend == "firebase":
+            api.startReadReplica()
+
+        scenarios = buildScenarios(args, data)
+        if args.scenarios:
+            selected = [name.strip() for name in args.scenarios.split(",")]
+            scenarios = [scenario for scenario in scenarios if scenario[0] in selected]
+        results = [runScenario(api.app, server, scenario, args) for scenario in scenarios]
+
+    printReport(args, results)
+    if args.json:
+        with open(args.json, "w") as jsonFile:
+            json.dump({"arguments": vars(args), "results": results}, jsonFile, indent = 4)
+    server.shutdown()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,312 @@
+import hashlib
+import itertools
+import json
+import queue
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+# local stand-in for the Firebase Realtime Database REST API (enough of it for pyrebase and the benchmarks)
+class FakeFirebase:
+    def __init__(self, data = {}, latencyMs = 0, keepAliveSeconds = 30):
+        self.root = normalize(data) or {}
+        self.latencyMs = latencyMs
+        self.keepAliveSeconds = keepAliveSeconds
+        self.lock = threading.Lock()
+        self.keyCounter = itertools.count()
+        self.calls = Counter()
+        self.bytesSent = 0
+        # (path parts, event queue) of every open event stream
+        self.listeners = []
+
+    def get(self, path):
+        node = self.root
+        for part in splitPath(path):
+            if not isinstance(node, dict) or part not in node:
+                return None
+            node = node[part]
+        return node
+
+    def set(self, path, value, notify = True):
+        if notify:
+            self.notify({path: value}, "put")
+        parts = splitPath(path)
+        value = normalize(value)
+        if not parts:
+            self.root = value if isinstance(value, dict) else {}
+            return
+        node = self.root
+        for part in parts[:-1]:
+            if not isinstance(node.get(part), dict):
+                node[part] = {}
+            node = node[part]
+        if value == None:
+            node.pop(parts[-1], None)
+        else:
+            node[parts[-1]] = value
+        # like Firebase, parents left without children disappear
+        for depth in range(len(parts) - 1, 0, -1):
+            parent = self.get("/".join(parts[:depth - 1]))
+            if parent.get(parts[depth - 1]) == {}:
+                del parent[parts[depth - 1]]
+
+    def update(self, path, values):
+        # keys may be nested paths, giving multi-location updates that streams receive as a single patch
+        self.notify({path.rstrip("/") + "/" + childPath: value for childPath, value in values.items()}, "patch")
+        for childPath, value in values.items():
+            self.set(path.rstrip("/") + "/" + childPath, value, notify = False)
+
+    def notify(self, changes, event):
+        # called with the lock held before the changes are applied, so streams above a change get the resulting node afterwards
+        changes = [(splitPath(path), render(normalize(value))) for path, value in changes.items()]
+        for listenerParts, events in self.listeners:
+            relevant = {"/".join(parts[len(listenerParts):]): value for parts, value in changes if parts[:len(listenerParts)] == listenerParts}
+            if any(listenerParts[:len(parts)] == parts for parts, value in changes if len(parts) <= len(listenerParts)):
+                # a write at or above the streamed location replaces it
+                events.put(("put", lambda listenerParts = listenerParts: {"path": "/", "data": render(self.get("/".join(listenerParts)))}))
+            elif event == "patch" and relevant:
+                events.put(("patch", {"path": "/", "data": relevant}))
+            else:
+                for childPath, value in relevant.items():
+                    events.put(("put", {"path": "/" + childPath, "data": value}))
+
+    def listen(self, path):
+        events = queue.Queue()
+        with self.lock:
+            self.listeners.append((splitPath(path), events))
+            initial = render(self.get(path))
+        return events, initial
+
+    def unlisten(self, events):
+        with self.lock:
+            self.listeners = [listener for listener in self.listeners if listener[1] != events]
+
+    def dropStreams(self):
+        # closes every open event stream, like a network interruption
+        with self.lock:
+            for listenerParts, events in self.listeners:
+                events.put(None)
+
+    def generateKey(self):
+        return "-Fake%015d" % next(self.keyCounter)
+
+    def recordCall(self, method, path, bytesSent):
+        with self.lock:
+            collection = splitPath(path)[0] if splitPath(path) else "/"
+            self.calls[(method, collection)] += 1
+            self.bytesSent += bytesSent
+
+    def callCount(self):
+        with self.lock:
+            return sum(self.calls.values())
+
+    def stats(self):
+        with self.lock:
+            return {"calls": dict(self.calls), "bytesSent": self.bytesSent}
+
+def splitPath(path):
+    return [part for part in path.strip("/").split("/") if part]
+
+def normalize(value):
+    # store everything as nested dicts with string keys, dropping nulls and empty containers like Firebase does
+    if isinstance(value, list):
+        value = dict(enumerate(value))
+    if isinstance(value, dict):
+        children = {}
+        for key, child in value.items():
+            child = normalize(child)
+            if child != None:
+                children[str(key)] = child
+        return children or None
+    return value
+
+def render(value):
+    # nodes whose keys are mostly sequential integers are returned as JSON arrays
+    if isinstance(value, dict):
+        keys = list(value.keys())
+        if keys and all(key.isdigit() for key in keys):
+            maxKey = max(int(key) for key in keys)
+            if len(keys) * 2 > maxKey + 1:
+                return [render(value.get(str(index))) for index in range(maxKey + 1)]
+        return {key: render(child) for key, child in value.items()}
+    return value
+
+def etag(value):
+    return hashlib.sha1(json.dumps(value, sort_keys = True).encode()).hexdigest()
+
+# children with an ".indexOn" rule, the REST API rejects queries ordered by any other child
+INDEXED_CHILDREN = ["id"]
+
+def isIndexed(parameters):
+    return "orderBy" not in parameters or json.loads(parameters["orderBy"]) in INDEXED_CHILDREN + ["$key", "$value"]
+
+def query(node, parameters):
+    if not isinstance(node, dict):
+        return render(node)
+    if parameters.get("shallow") == "true":
+        return {key: True for key in node}
+    if "orderBy" not in parameters:
+        return render(node)
+
+    orderBy = json.loads(parameters["orderBy"])
+    def sortValue(item):
+        if orderBy == "$key":
+            return item[0]
+        if orderBy == "$value":
+            return item[1]
+        return item[1].get(orderBy) if isinstance(item[1], dict) else None
+
+    items = [item for item in node.items()]
+    if "equalTo" in parameters:
+        equalTo = json.loads(parameters["equalTo"])
+        items = [item for item in items if sortValue(item) == equalTo]
+    if "startAt" in parameters:
+        startAt = json.loads(parameters["startAt"])
+        items = [item for item in items if sortValue(item) != None and sortValue(item) >= startAt]
+    if "endAt" in parameters:
+        endAt = json.loads(parameters["endAt"])
+        items = [item for item in items if sortValue(item) != None and sortValue(item) <= endAt]
+    # children missing the ordered value come first, as in Firebase
+    items.sort(key = lambda item: (sortValue(item) != None, sortValue(item) if sortValue(item) != None else 0))
+    if "limitToFirst" in parameters:
+        items = items[:int(parameters["limitToFirst"])]
+    if "limitToLast" in parameters:
+        items = items[-int(parameters["limitToLast"]):]
+    # queries always return an object keyed by child key
+    return {key: render(child) for key, child in items}
+
+class FakeFirebaseHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # avoid delayed ACK stalls between the header and body writes on keep-alive connections
+    disable_nagle_algorithm = True
+    database = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def parseRequest(self):
+        url = urlsplit(self.path)
+        path = unquote(url.path)
+        if path.endswith(".json"):
+            path = path[:-len(".json")]
+        parameters = {key: values[0] for key, values in parse_qs(url.query).items()}
+        return path, parameters
+
+    def readBody(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"null")
+
+    def respond(self, status, value, headers = {}):
+        body = json.dumps(value).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, headerValue in headers.items():
+            self.send_header(name, headerValue)
+        self.end_headers()
+        self.wfile.write(body)
+        self.database.recordCall(self.command, self.parseRequest()[0], len(body))
+
+    def simulateLatency(self):
+        if self.database.latencyMs > 0:
+            time.sleep(self.database.latencyMs / 1000)
+
+    def streamEvents(self, path):
+        # server-sent events: the current value as a put at "/", then a put or patch for every change below the path
+        events, initial = self.database.listen(path)
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        try:
+            self.database.recordCall("STREAM", path, self.writeEvent("put", {"path": "/", "data": initial}))
+            while True:
+                try:
+                    event = events.get(timeout = self.database.keepAliveSeconds)
+                except queue.Empty:
+                    event = ("keep-alive", None)
+                if event == None:
+                    return
+                name, data = event
+                # values replacing the whole location are read once the write has been applied
+                if callable(data):
+                    with self.database.lock:
+                        data = data()
+                self.writeEvent(name, data)
+        except OSError:
+            pass
+        finally:
+            self.database.unlisten(events)
+
+    def writeEvent(self, name, data):
+        body = f"event: {name}\ndata: {json.dumps(data)}\n\n".encode()
+        self.wfile.write(body)
+        self.wfile.flush()
+        return len(body)
+
+    def do_GET(self):
+        self.simulateLatency()
+        path, parameters = self.parseRequest()
+        if "text/event-stream" in self.headers.get("Accept", ""):
+            self.streamEvents(path)
+            return
+        if not isIndexed(parameters):
+            self.respond(400, {"error": f"Index not defined, add \".indexOn\": \"{json.loads(parameters['orderBy'])}\", for path \"{path}\", to the rules"})
+            return
+        with self.database.lock:
+            value = query(self.database.get(path), parameters)
+        headers = {"ETag": etag(value)} if self.headers.get("X-Firebase-ETag") else {}
+        self.respond(200, value, headers)
+
+    def do_POST(self):
+        self.simulateLatency()
+        path, parameters = self.parseRequest()
+        value = self.readBody()
+        with self.database.lock:
+            key = self.database.generateKey()
+            self.database.set(path + "/" + key, value)
+        self.respond(200, {"name": key})
+
+    def do_PUT(self):
+        self.simulateLatency()
+        path, parameters = self.parseRequest()
+        value = self.readBody()
+        with self.database.lock:
+            # conditional writes compare the ETag of the current value
+            current = render(self.database.get(path))
+            conflict = self.headers.get("if-match") and etag(current) != self.headers["if-match"]
+            if not conflict:
+                self.database.set(path, value)
+        if conflict:
+            self.respond(412, current, {"ETag": etag(current)})
+        else:
+            self.respond(200, value)
+
+    def do_PATCH(self):
+        self.simulateLatency()
+        path, parameters = self.parseRequest()
+        value = self.readBody()
+        with self.database.lock:
+            self.database.update(path, value)
+        self.respond(200, value)
+
+    def do_DELETE(self):
+        self.simulateLatency()
+        path, parameters = self.parseRequest()
+        with self.database.lock:
+            self.database.set(path, None)
+        self.respond(200, None)
+
+def startServer(data, latencyMs = 0, port = 0, keepAliveSeconds = 30):
+    database = FakeFirebase(data, latencyMs, keepAliveSeconds)
+    handler = type("Handler", (FakeFirebaseHandler,), {"database": database})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    server.database = database
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    return server
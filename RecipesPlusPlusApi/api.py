@@ -4,13 +4,14 @@ import pyrebase
 import logging
 import importlib.util
 import pathlib
-import threading
 import os
+import time
 from configparser import ConfigParser
 from apscheduler.schedulers.background import BackgroundScheduler
-from flask import Flask, abort, request
-from flask_restful import Api, Resource
+from flask import Flask, Response, abort, after_this_request, request
+from flask_restful import Api, Resource, abort as restfulAbort
 from flask_cors import CORS
+from werkzeug.http import http_date
 #endregion
 
 # get parent directory and dependencies
@@ -25,10 +26,44 @@ spec = importlib.util.spec_from_file_location('shared', parentDir + '/Shared/que
 queries = importlib.util.module_from_spec(spec)
 spec.loader.exec_module(queries)
 
+spec = importlib.util.spec_from_file_location('shared', parentDir + '/Shared/locks.py')
+locks = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(locks)
+
+spec = importlib.util.spec_from_file_location('shared', parentDir + '/Shared/storage.py')
+storage = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(storage)
+
+spec = importlib.util.spec_from_file_location('shared', parentDir + '/Shared/tokenbroker.py')
+tokenbroker = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(tokenbroker)
+
+spec = importlib.util.spec_from_file_location('shared', parentDir + '/Shared/validation.py')
+validation = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(validation)
+
+spec = importlib.util.spec_from_file_location('shared', parentDir + '/Shared/representations.py')
+representations = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(representations)
+
+spec = importlib.util.spec_from_file_location('shared', parentDir + '/Shared/metrics.py')
+metrics = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(metrics)
+
+spec = importlib.util.spec_from_file_location('shared', parentDir + '/Shared/profiling.py')
+profiling = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(profiling)
+
+spec = importlib.util.spec_from_file_location('shared', parentDir + '/Shared/grocerybatch.py')
+grocerybatch = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(grocerybatch)
+
 # get configuration variables
 apiConfig = ConfigParser()
-apiConfig.read('RecipesPlusPlusApi/api.ini')
+# the API configuration file can be overridden (e.g. by tests) through an environment variable
+apiConfig.read(os.environ.get('RECIPESPLUSPLUS_API_CONFIG', 'RecipesPlusPlusApi/api.ini'))
 sharedConfig = functions.buildSharedConfig(parentDir)
+tokenBrokerUrl, tokenBrokerSecret = functions.getTokenBroker()
 
 # create and configure logger
 if not os.path.exists('Logs'):
@@ -36,45 +71,351 @@ if not os.path.exists('Logs'):
 LOG_FORMAT = "%(levelname)s %(asctime)s - %(message)s"
 logging.basicConfig(filename = parentDir + '/Logs/RecipesPlusPlusApi.log', level = logging.INFO, format = LOG_FORMAT)
 
-# initialize firebase and database
-firebaseConfig = json.loads(sharedConfig['properties']['firebaseConfigJson'])
-firebase = pyrebase.initialize_app(firebaseConfig)
-db = firebase.database()
-auth = firebase.auth()
-user = auth.sign_in_with_email_and_password(sharedConfig['properties']['firebaseAuthEmail'], sharedConfig['properties']['firebaseAuthPassword'])
+# request metrics, Firebase calls made while handling a request are attributed to its endpoint
+apiMetrics = metrics.Metrics("recipesplusplus_api", "Firebase Realtime Database")
+apiMetrics.define("lock_wait_seconds", "histogram", "Time spent waiting for collection locks by lock name.", metrics.LATENCY_BUCKETS)
+
+# initialize the storage backend selected in the shared configuration
+auth = None
+user = {'idToken': None}
+asyncDb = None
+if sharedConfig['properties'].get('storageBackend', 'firebase') == 'sqlite':
+    db = storage.SqliteBackend(sharedConfig['properties'].get('sqlitePath', ':memory:'))
+    # optionally seed an empty database from a Firebase JSON export
+    sqliteSeedJson = sharedConfig['properties'].get('sqliteSeedJson', '')
+    if sqliteSeedJson and db.isEmpty():
+        with open(sqliteSeedJson) as seedFile:
+            db.importData(json.load(seedFile))
+else:
+    # initialize firebase and database
+    firebaseConfig = json.loads(sharedConfig['properties']['firebaseConfigJson'])
+    firebase = pyrebase.initialize_app(firebaseConfig)
+    firebase.requests.hooks["response"].append(apiMetrics.recordUpstreamResponse)
+    db = storage.FirebaseBackend(firebase)
+    # run independent reads concurrently through the async REST backend when aiohttp is available
+    if apiConfig.getboolean('properties', 'asyncQueries', fallback = True):
+        try:
+            spec = importlib.util.spec_from_file_location('shared', parentDir + '/Shared/asyncstorage.py')
+            asyncstorage = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(asyncstorage)
+            asyncDb = asyncstorage.AsyncFirebaseBackend(firebaseConfig['databaseURL'], apiConfig.getint('properties', 'asyncQueryConcurrency', fallback = 8), onResponse = apiMetrics.recordUpstream)
+        except ImportError:
+            logging.warning("aiohttp is not installed, falling back to sequential queries")
+    # take the service account token from the token broker when started by serve.py
+    if tokenBrokerUrl:
+        user = tokenbroker.fetchToken(tokenBrokerUrl, tokenBrokerSecret)
+    # otherwise sign into service account (left unauthenticated when no account is configured, e.g. for local emulators)
+    elif sharedConfig['properties'].get('firebaseAuthEmail', ''):
+        auth = firebase.auth()
+        user = auth.sign_in_with_email_and_password(sharedConfig['properties']['firebaseAuthEmail'], sharedConfig['properties']['firebaseAuthPassword'])
+
+# build the reference index behind the in-use checks if the database predates it
+db.indexReferences(user['idToken'])
+
+# optionally serve reads from an in memory replica kept current through the database's change streams
+readReplica = None
+def applyReplicaChanges(collection, ids):
+    # changes made outside this process arrive through the replica's change streams and are applied like this API's own writes
+    lock = apiLocks.lock("ReadReplica.change", read = ["recipes"] if collection == "users" else [], write = [collection])
+    lock.acquire()
+    try:
+        queries.applyExternalChanges(db, user['idToken'], collection, ids)
+    finally:
+        lock.release()
+    logging.info(f"Applied changes to {collection} {ids} from the read replica")
+
+def startReadReplica():
+    global db, asyncDb, readReplica
+    spec = importlib.util.spec_from_file_location('shared', parentDir + '/Shared/replica.py')
+    replica = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(replica)
+    readReplica = replica.ReplicaBackend(db, firebaseConfig['databaseURL'], lambda: user['idToken'], maxStalenessSeconds = apiConfig.getfloat('properties', 'replicaMaxStalenessSeconds', fallback = 75), resyncDelaySeconds = apiConfig.getfloat('properties', 'replicaResyncDelaySeconds', fallback = 1), onChange = applyReplicaChanges)
+    # reads fall back to the database until the replica has loaded
+    if not readReplica.waitUntilSynced(apiConfig.getfloat('properties', 'replicaSyncTimeoutSeconds', fallback = 30)):
+        logging.warning("Read replica is not synced yet, reading from the database until it is")
+    db = readReplica
+    # the replica answers the grocery list reads from memory so there is nothing left to fan out
+    asyncDb = None
 
 # create event scheduler for refreshing auth token
 def refreshToken():
     global user
-    user = auth.refresh(user['refreshToken'])
+    if tokenBrokerUrl:
+        user = tokenbroker.fetchToken(tokenBrokerUrl, tokenBrokerSecret)
+    else:
+        user = auth.refresh(user['refreshToken'])
+
+# configure the reference data cache and write consistency, and periodically log cache hit/miss counters and lock wait times
+queries.configureCache(apiConfig.getint('properties', 'cacheTtlSeconds', fallback = 300), apiConfig.getint('properties', 'cacheMaxEntries', fallback = 1024))
+queries.configureConsistency(apiConfig.get('properties', 'writeConsistency', fallback = 'verify'))
+queries.configureGroceryViews(apiConfig.getboolean('properties', 'groceryViews', fallback = True))
+
+def logStats():
+    logging.info(f"Cache stats: {queries.getCacheStats()}")
+    logging.info(f"Lock wait stats: {apiLocks.stats()}")
+    if readReplica != None:
+        logging.info(f"Read replica stats: {readReplica.stats()}")
+    logging.info(f"Grocery view stats: {queries.getGroceryViewStats()}")
+    logging.info(f"Search index stats: {queries.getSearchIndexStats()}")
+    logging.info(f"Cookable index stats: {queries.getCookableIndexStats()}")
+
+def checkGroceryViews():
+    # compare the grocery views with a full recompute while no user or recipe writes are in progress
+    lock = apiLocks.lock("GroceryViews.check", read = ["users", "recipes"])
+    lock.acquire()
+    try:
+        result = queries.checkGroceryViews(db, user['idToken'])
+    finally:
+        lock.release()
+    if result["mismatched"]:
+        logging.warning(f"Grocery views of users {result['mismatched']} didn't match a full recompute and were repaired")
+    logging.info(f"Checked {result['checked']} grocery views")
+
+def rebuildRecipeIndexes():
+    # recipes and ingredients written outside this process are picked up by rebuilding the search and cookable indexes from the database
+    lock = apiLocks.lock("RecipeIndexes.rebuild", read = ["recipes", "ingredients"])
+    lock.acquire()
+    try:
+        queries.buildRecipeIndexes(db, user['idToken'])
+    finally:
+        lock.release()
+    logging.info(f"Rebuilt search index: {queries.getSearchIndexStats()}")
+    logging.info(f"Rebuilt cookable index: {queries.getCookableIndexStats()}")
+
+GROCERY_EXPORT_FORMATS = {"jsonl": "application/x-ndjson", "csv": "text/csv"}
+groceryExportPageSize = apiConfig.getint('properties', 'groceryExportPageSize', fallback = 1000)
+
+def getGroceryExport(format):
+    # every recipe is encoded once while no recipe writes are in progress, users are then read and totalled a page at a time as the export is written
+    lock = apiLocks.lock("GroceryExport.get", read = ["users", "recipes", "ingredients", "units"])
+    lock.acquire()
+    try:
+        try:
+            recipes = queries.getAllRecipes(db, user['idToken'])
+        except:
+            # users' own items are still exported when there are no recipes
+            recipes = []
+        recipeMatrix = grocerybatch.RecipeMatrix(recipes)
+        ingredients = queries.getReferenceRecords(db, user['idToken'], "ingredients")
+        units = queries.getReferenceRecords(db, user['idToken'], "units")
+        users = queries.iterRecords(db, user['idToken'], "users", groceryExportPageSize)
+    finally:
+        lock.release()
+    rows = recipeMatrix.iterTotals(users, groceryExportPageSize)
+    if format == "csv":
+        return grocerybatch.iterCsv(rows, ingredients, units)
+    return grocerybatch.iterJsonLines(rows, ingredients, units)
+
+def exportGroceryLists():
+    # scheduled batch export of every user's grocery list, written to a temporary file first so readers never see a partial export
+    format = apiConfig.get('properties', 'groceryExportFormat', fallback = 'jsonl')
+    directory = parentDir + '/' + apiConfig.get('properties', 'groceryExportDirectory', fallback = 'Exports/Grocery')
+    os.makedirs(directory, exist_ok = True)
+    path = f"{directory}/grocery-{time.strftime('%Y%m%d-%H%M%S')}.{format}"
+    start = time.perf_counter()
+    with open(path + ".tmp", "wb") as exportFile:
+        exportFile.writelines(getGroceryExport(format))
+    os.replace(path + ".tmp", path)
+    logging.info(f"Exported grocery lists to {path} in {time.perf_counter() - start:.1f} s")
+
+def collectCacheMetrics():
+    stats = queries.getCacheStats()
+    return [
+        ("cache_hits_total", "counter", "Reference data cache hits.", {(): stats["hits"]}),
+        ("cache_misses_total", "counter", "Reference data cache misses.", {(): stats["misses"]}),
+        ("cache_evictions_total", "counter", "Reference data cache evictions.", {(): stats["evictions"]}),
+        ("cache_entries", "gauge", "Reference data cache entries.", {(): stats["entries"]})
+    ]
+
+def collectGroceryViewMetrics():
+    stats = queries.getGroceryViewStats()
+    return [
+        ("grocery_views", "gauge", "Users with a materialized grocery view.", {(): stats["views"]}),
+        ("grocery_view_hits_total", "counter", "Grocery lists read from a materialized view.", {(): stats["hits"]}),
+        ("grocery_view_misses_total", "counter", "Grocery lists computed because the user had no view.", {(): stats["misses"]}),
+        ("grocery_view_updates_total", "counter", "Incremental grocery view updates.", {(): stats["updates"]}),
+        ("grocery_view_mismatches_total", "counter", "Grocery views repaired by the consistency check.", {(): stats["repairs"]})
+    ]
+
+def collectSearchMetrics():
+    stats = queries.getSearchIndexStats()
+    return [
+        ("search_index_recipes", "gauge", "Recipes in the search index.", {(): stats["recipes"]}),
+        ("search_index_terms", "gauge", "Distinct terms in the search index.", {(): stats["terms"]}),
+        ("search_index_updates_total", "counter", "Incremental search index updates.", {(): stats["updates"]}),
+        ("search_index_rebuilds_total", "counter", "Full search index builds.", {(): stats["rebuilds"]})
+    ]
+
+def collectCookableMetrics():
+    stats = queries.getCookableIndexStats()
+    return [
+        ("cookable_index_recipes", "gauge", "Recipes in the cookable index.", {(): stats["recipes"]}),
+        ("cookable_index_matches_total", "counter", "Pantries matched against the cookable index.", {(): stats["matches"]}),
+        ("cookable_index_updates_total", "counter", "Incremental cookable index updates.", {(): stats["updates"]}),
+        ("cookable_index_rebuilds_total", "counter", "Full cookable index builds.", {(): stats["rebuilds"]})
+    ]
+
+def collectReplicaMetrics():
+    if readReplica == None:
+        return []
+    stats = readReplica.stats()
+    collections = stats["collections"]
+    return [
+        ("replica_synced", "gauge", "Whether the read replica of a collection is loaded and following its change stream.", {(("collection", collection),): int(collectionStats["synced"]) for collection, collectionStats in collections.items()}),
+        ("replica_records", "gauge", "Records held by the read replica.", {(("collection", collection),): collectionStats["records"] for collection, collectionStats in collections.items()}),
+        ("replica_staleness_seconds", "gauge", "Time since the last change stream event of a collection.", {(("collection", collection),): collectionStats["stalenessSeconds"] for collection, collectionStats in collections.items() if collectionStats["stalenessSeconds"] != None}),
+        ("replica_fallback_reads_total", "counter", "Reads sent to the database because the replica was not synced or too stale.", {(): stats["fallbackReads"]}),
+        ("replica_resyncs_total", "counter", "Change streams lost and reloaded.", {(): stats["resyncs"]})
+    ]
 
 sched = BackgroundScheduler(daemon=True)
-sched.add_job(refreshToken, 'interval', minutes = 30)
+if tokenBrokerUrl and sharedConfig['properties'].get('storageBackend', 'firebase') != 'sqlite':
+    # the broker refreshes the token itself, workers pick up the current one well before it expires
+    sched.add_job(refreshToken, 'interval', minutes = 5)
+elif auth != None:
+    sched.add_job(refreshToken, 'interval', minutes = 30)
+sched.add_job(logStats, 'interval', minutes = apiConfig.getint('properties', 'statsLogIntervalMinutes', fallback = 15))
+if apiConfig.getint('properties', 'groceryViewCheckIntervalMinutes', fallback = 60) > 0:
+    sched.add_job(checkGroceryViews, 'interval', minutes = apiConfig.getint('properties', 'groceryViewCheckIntervalMinutes', fallback = 60))
+if apiConfig.getint('properties', 'recipeIndexRebuildIntervalMinutes', fallback = 60) > 0:
+    sched.add_job(rebuildRecipeIndexes, 'interval', minutes = apiConfig.getint('properties', 'recipeIndexRebuildIntervalMinutes', fallback = 60))
+if apiConfig.getint('properties', 'groceryExportIntervalHours', fallback = 0) > 0:
+    sched.add_job(exportGroceryLists, 'interval', hours = apiConfig.getint('properties', 'groceryExportIntervalHours', fallback = 0))
 sched.start()
 
 # Flask REST API
 app = Flask(__name__)
-cors = CORS(app, resources={r"*": {"origins": "*"}})
+cors = CORS(app, resources={r"*": {"origins": "*"}}, expose_headers = ["ETag", "X-Next-After"])
 api = Api(app)
-apiQueryLock = threading.Lock()
+# metrics are registered first so their after request hook runs last and counts the compressed bytes
+apiMetrics.instrument(app)
+apiMetrics.addCollector(collectCacheMetrics)
+apiMetrics.addCollector(collectReplicaMetrics)
+apiMetrics.addCollector(collectGroceryViewMetrics)
+apiMetrics.addCollector(collectSearchMetrics)
+apiMetrics.addCollector(collectCookableMetrics)
+# sampled requests and requests sent with the admin profiling header are profiled to disk
+profiling.RequestProfiler(parentDir + '/' + apiConfig.get('properties', 'profileDirectory', fallback = 'Logs/Profiles/Api'), apiConfig.getfloat('properties', 'profileSampleRate', fallback = 0), apiConfig.get('properties', 'profileAdminSecret', fallback = ''), apiConfig.getfloat('properties', 'profileSampleIntervalMs', fallback = 5), apiConfig.getint('properties', 'profileMaxDumps', fallback = 100)).instrument(app)
+# responses use the fastest available encoders and are compressed when large enough
+representations.registerRepresentations(api)
+compressionMinBytes = apiConfig.getint('properties', 'compressionMinBytes', fallback = 1024)
+app.after_request(lambda response: representations.compressResponse(response, compressionMinBytes))
+apiLocks = locks.CollectionLocks(["ingredients", "recipes", "units", "users"], apiConfig.getfloat('properties', 'lockWaitLogThresholdMs', fallback = 100), apiMetrics.recordLockWait)
+
+# the replica reports changes from its first event on, so it only starts once the collection locks its callback takes exist
+if sharedConfig['properties'].get('storageBackend', 'firebase') != 'sqlite' and apiConfig.getboolean('properties', 'readReplica', fallback = False):
+    startReadReplica()
+
+# fields of each collection that GET requests can project and filter on (filters only apply to int and str fields)
+COLLECTION_FIELDS = {
+    "ingredients": {"id": int, "image_url": str, "name": str},
+    "recipes": {"calories": int, "id": int, "image_url": str, "ingredients": list, "instructions": list, "name": str, "time": int},
+    "users": {"email": str, "id": int, "items": list, "name": str, "recipes": list}
+}
+
+def parseCollectionQuery(collection):
+    # ?limit=&after= for cursor pagination, ?fields=a,b for projection and ?<field>=<value> for equality filters
+    fieldTypes = COLLECTION_FIELDS[collection]
+    query = {"after": None, "limit": None, "filters": {}, "fields": None}
+    for name, value in request.args.items():
+        if name in ["after", "limit"]:
+            query[name] = int(value)
+        elif name == "fields":
+            query["fields"] = value.split(",")
+            if any(field not in fieldTypes for field in query["fields"]):
+                raise Exception
+        elif fieldTypes.get(name) in [int, str]:
+            query["filters"][name] = fieldTypes[name](value)
+        else:
+            raise Exception
+    if query["limit"] != None and query["limit"] < 1:
+        raise Exception
+    return query
+
+def buildPageResponse(records, nextAfter):
+    # the cursor for the next page is returned in a header so the body stays a plain list
+    if nextAfter == None:
+        return records
+    return records, 200, {"X-Next-After": str(nextAfter)}
+
+def notModifiedResponse(collections):
+    # validators come from the in-process version stamps, so a matching If-None-Match is answered without a storage read
+    version, lastModified = queries.getVersionStamp(collections)
+    headers = {"ETag": f'"{version}"', "Last-Modified": http_date(lastModified), "Cache-Control": "no-cache"}
+    if request.if_none_match.contains_weak(version):
+        return Response(status = 304, headers = headers)
+
+    @after_this_request
+    def addValidators(response):
+        if response.status_code == 200:
+            response.headers.update(headers)
+        return response
+    return None
+
+def getMissingIds(references):
+    # looked up concurrently when the async backend is enabled
+    if asyncDb != None:
+        return asyncDb.run(queries.getMissingIdsAsync(asyncDb, user['idToken'], references))
+    return queries.getMissingIds(db, user['idToken'], references)
+
+def validateBody(validate, body):
+    value, errors, references = validate(body)
+    # ids referenced by the body are checked with one lookup per collection
+    if references:
+        missing = getMissingIds({collection: [id for path, id in ids] for collection, ids in references.items()})
+        errors += [{"field": path, "error": "ID not valid"} for collection, ids in references.items() for path, id in ids if id in missing[collection]]
+    return value, errors
+
+def abortInvalid(errorMsg, errors):
+    # validation failures also list every problem found as {"field", "error"} entries
+    if errors:
+        restfulAbort(400, message = errorMsg, errors = errors)
+    abort(400, errorMsg)
+
+streamPageSize = apiConfig.getint('properties', 'streamPageSize', fallback = 500)
+
+def streamJsonArray(records):
+    # MessagePack needs the array length up front so those clients get a buffered response
+    if representations.wantsMsgpack():
+        return list(records)
+
+    # the array is written element by element as the records are read, in the same format as the json representation
+    def generate():
+        yield b"["
+        for index, record in enumerate(records):
+            yield (b"," if index else b"") + representations.encodeJson(record)
+        yield b"]\n"
+    return Response(generate(), mimetype = "application/json")
 
 class Ingredients(Resource):
     def get(self, id=None):
-        apiQueryLock.acquire()
+        lock = apiLocks.lock("Ingredients.get", read = ["ingredients"])
+        lock.acquire()
         try:
-            if id == None:
+            notModified = notModifiedResponse(["ingredients"])
+            if notModified != None:
+                return notModified
+            errorMsg = "No ingredient exists."
+            if id == None and request.args:
+                # get a page of ingredients
+                errorMsg = "Invalid query parameters."
+                query = parseCollectionQuery("ingredients")
+                errorMsg = "No ingredient exists."
+                return buildPageResponse(*queries.getPage(db, user['idToken'], "ingredients", **query))
+            elif id == None:
                 # get all ingredients
                 return queries.getAllIngredients(db, user['idToken'])
             else:
                 # get specific ingredient
                 return queries.getIngredient(db, user['idToken'], id)               
         except:
-            abort(400, "No ingredient exists.")
+            abort(400, errorMsg)
         finally:
-            apiQueryLock.release()
+            lock.release()
 
     def delete(self, id):
-        apiQueryLock.acquire()
+        lock = apiLocks.lock("Ingredients.delete", read = ["recipes"], write = ["ingredients"])
+        lock.acquire()
         try: 
             errorMsg = "No ingredient deleted."
 
@@ -87,93 +428,122 @@ class Ingredients(Resource):
         except:
             abort(400, errorMsg)
         finally:
-            apiQueryLock.release()
+            lock.release()
 
     def post(self):
-        apiQueryLock.acquire()
-        value = request.get_data()
-
+        lock = apiLocks.lock("Ingredients.post", write = ["ingredients"])
+        lock.acquire()
         try:
+            errors = []
             errorMsg = "Invalid JSON"
-            value = json.loads(value)
-
-            # validate there is a field for name (str) (optional: image_url (str))
-            isInvalid = False
-            errorMsg = "Please fix the following values: "
-
-            if "name" not in value or value["name"] == None or value["name"] == "" or type(value["name"]) != str:
-                isInvalid = True
-                errorMsg += "name (str) "
-            if "image_url" in value:
-                image_url = value["image_url"]
-                if type(image_url) != str:
-                    isInvalid = True
-                    errorMsg += "image_url (str) "
-            else:
-                image_url = ""
-            errorMsg += "(optional: image_url (str))"
+            value = json.loads(request.get_data())
+            errorMsg = "Could not validate values."
 
-            if isInvalid:
+            # validate the body against the ingredient schema
+            value, errors = validateBody(validation.validateIngredient, value)
+            if errors:
+                errorMsg = validation.formatErrors(errors)
                 raise Exception
             errorMsg = "No ingredient added."
-            queries.addIngredient(db, user['idToken'], value["name"], image_url)
-            return True
+            return queries.addIngredient(db, user['idToken'], value["name"], value["image_url"])
         except:
-            abort(400, errorMsg)
+            abortInvalid(errorMsg, errors)
         finally:
-            apiQueryLock.release()
+            lock.release()
 
     def put(self, id):
-        apiQueryLock.acquire()
-        value = request.get_data()
-
+        lock = apiLocks.lock("Ingredients.put", write = ["ingredients"])
+        lock.acquire()
         try:
+            errors = []
             errorMsg = "Invalid JSON"
-            value = json.loads(value)
-
-            # validate there is a field for name (str) (optional: image_url (str))
-            isInvalid = False
-            errorMsg = "Please fix the following values: "
-
-            if "name" not in value or value["name"] == None or value["name"] == "" or type(value["name"]) != str:
-                isInvalid = True
-                errorMsg += "name (str) "
-            if "image_url" in value:
-                image_url = value["image_url"]
-                if type(image_url) != str:
-                    isInvalid = True
-                    errorMsg += "image_url (str) "
-            else:
-                image_url = ""
-            errorMsg += "(optional: image_url (str))"
+            value = json.loads(request.get_data())
+            errorMsg = "Could not validate values."
 
-            if isInvalid:
+            # validate the body against the ingredient schema
+            value, errors = validateBody(validation.validateIngredient, value)
+            if errors:
+                errorMsg = validation.formatErrors(errors)
                 raise Exception
             errorMsg = "No ingredient updated."
-            queries.updateIngredient(db, user['idToken'], id, value["name"], image_url)
-            return True
+            return queries.updateIngredient(db, user['idToken'], id, value["name"], value["image_url"])
+        except:
+            abortInvalid(errorMsg, errors)
+        finally:
+            lock.release()
+
+class IngredientRecipes(Resource):
+    def get(self, id):
+        lock = apiLocks.lock("IngredientRecipes.get", read = ["ingredients", "recipes"])
+        lock.acquire()
+        try:
+            notModified = notModifiedResponse(["ingredients", "recipes"])
+            if notModified != None:
+                return notModified
+            # get recipes that use a specific ingredient
+            return queries.getRecipesUsingIngredient(db, user['idToken'], id)
+        except:
+            abort(400, "No ingredient exists.")
+        finally:
+            lock.release()
+
+searchDefaultLimit = apiConfig.getint('properties', 'searchDefaultLimit', fallback = 20)
+searchMaxLimit = apiConfig.getint('properties', 'searchMaxLimit', fallback = 100)
+
+class RecipeSearch(Resource):
+    def get(self):
+        lock = apiLocks.lock("RecipeSearch.get", read = ["recipes", "ingredients"])
+        lock.acquire()
+        try:
+            errorMsg = "Invalid query parameters."
+            # ?q= words to find (the last characters of each word may be left off) and ?limit= for the number of results
+            query = request.args.get("q", "")
+            limit = int(request.args.get("limit", searchDefaultLimit))
+            if not query.strip() or limit < 1 or limit > searchMaxLimit:
+                raise Exception
+            errorMsg = "No recipe exists."
+            notModified = notModifiedResponse(["recipes", "ingredients"])
+            if notModified != None:
+                return notModified
+            # recipes best matching the query first
+            return queries.searchRecipes(db, user['idToken'], query, limit)
         except:
             abort(400, errorMsg)
         finally:
-            apiQueryLock.release()
+            lock.release()
 
 class Recipes(Resource):
     def get(self, id=None):
-        apiQueryLock.acquire()
+        lock = apiLocks.lock("Recipes.get", read = ["recipes"])
+        lock.acquire()
         try:
-            if id == None:
+            notModified = notModifiedResponse(["recipes"])
+            if notModified != None:
+                return notModified
+            errorMsg = "No recipe exists."
+            if id == None and request.args:
+                # get a page of recipes
+                errorMsg = "Invalid query parameters."
+                query = parseCollectionQuery("recipes")
+                errorMsg = "No recipe exists."
+                return buildPageResponse(*queries.getPage(db, user['idToken'], "recipes", **query))
+            elif id == None and streamPageSize > 0:
+                # stream all recipes (pages read after the lock is released may include later writes)
+                return streamJsonArray(queries.iterRecords(db, user['idToken'], "recipes", streamPageSize))
+            elif id == None:
                 # get all recipes
                 return queries.getAllRecipes(db, user['idToken'])
             else:
                 # get specific recipe
                 return queries.getRecipe(db, user['idToken'], id) 
         except:
-            abort(400, "No recipe exists.")
+            abort(400, errorMsg)
         finally:
-            apiQueryLock.release()
+            lock.release()
     
     def delete(self, id):
-        apiQueryLock.acquire()
+        lock = apiLocks.lock("Recipes.delete", read = ["users"], write = ["recipes"])
+        lock.acquire()
         try:
             errorMsg = "No recipe deleted."
 
@@ -186,475 +556,225 @@ class Recipes(Resource):
         except:
             abort(400, errorMsg)
         finally:
-            apiQueryLock.release()
+            lock.release()
     
     def post(self):
-        apiQueryLock.acquire()
-        value = request.get_data()
-
+        lock = apiLocks.lock("Recipes.post", read = ["ingredients", "units"], write = ["recipes"])
+        lock.acquire()
         try:
+            errors = []
             errorMsg = "Invalid JSON"
-            value = json.loads(value)
-
-            # validate there are fields for ingredients (list), instructions (list), name (str) (optional: calories (int) image_url (str) time (int))
-            isInvalid = False
-            errorMsg = "Please fix the following values: "
+            value = json.loads(request.get_data())
+            errorMsg = "Could not validate values."
 
-            if "ingredients" not in value or value["ingredients"] == None or not value["ingredients"] or type(value["ingredients"]) != list:
-                isInvalid = True
-                errorMsg += "ingredients (list of dict { ingredientId (int), unitId (int), quantity (int) }) "
-            else:
-                existingIngredients = queries.getAllIngredients(db, user['idToken'])
-                existingIngredientIds = [ingredient["id"] for ingredient in existingIngredients]
-                existingUnits = queries.getAllUnits(db, user['idToken'])
-                existingUnitIds = [unit["id"] for unit in existingUnits]
-
-                for ingredient in value["ingredients"]:
-                    if type(ingredient) != dict:
-                        isInvalid = True
-                        errorMsg += "ingredients (list of dict { ingredientId (int), unitId (int), quantity (int) }) "
-                        break
-                    # validate list of objects each given an ingredientId, unitId, and quantity
-                    else:
-                        isInvalidIngredient = False
-                        isNonExistientIngredient = False
-                        isInvalidUnit = False
-                        isNonExistientUnit = False
-                        isInvalidQuantity = False
-
-                        if "ingredientId" not in ingredient or ingredient["ingredientId"] == None or type(ingredient["ingredientId"]) != int:
-                            isInvalid = True
-                            isInvalidIngredient = True
-                        # validate all given ingredients exist
-                        elif ingredient["ingredientId"] not in existingIngredientIds:
-                            isInvalid = True
-                            isNonExistientIngredient = True
-                        if "unitId" not in ingredient or ingredient["unitId"] == None or type(ingredient["unitId"]) != int:
-                            isInvalid = True
-                            isInvalidUnit = True
-                        # validate all given units exist
-                        elif ingredient["unitId"] not in existingUnitIds:
-                            isInvalid = True
-                            isNonExistientUnit = True
-                        if "quantity" not in ingredient or ingredient["quantity"] == None or type(ingredient["quantity"]) != int:
-                            isInvalid = True
-                            isInvalidQuantity = True
-                        if isInvalid:
-                            errorMsg += "ingredients (list of dict { "
-                            if isInvalidIngredient:
-                                errorMsg += "ingredientId (int) "
-                            elif isNonExistientIngredient:
-                                errorMsg += "ingredientId (ID not valid) "
-                            if isInvalidUnit:
-                                errorMsg += "unitId (int) "
-                            elif isNonExistientUnit:
-                                errorMsg += "unitId (ID not valid) "
-                            if isInvalidQuantity:
-                                errorMsg += "quantity (int) "
-                            errorMsg += "}) "
-                            break
-            if "instructions" not in value or value["instructions"] == None or type(value["instructions"]) != list:
-                isInvalid = True
-                errorMsg += "instructions (list) "
-            else:
-                for instruction in value["instructions"]:
-                    if type(instruction) != str:
-                        isInvalid = True
-                        errorMsg += "instructions (list of str) "
-                        break
-            if "name" not in value or value["name"] == None or value["name"] == "" or type(value["name"]) != str:
-                isInvalid = True
-                errorMsg += "name (str) "
-            if "calories" in value:
-                calories = value["calories"]
-                if type(calories) != int:
-                    isInvalid = True
-                    errorMsg += "calories (int) "
-            else:
-                calories = -1
-            if "image_url" in value:
-                image_url = value["image_url"]
-                if type(image_url) != str:
-                    isInvalid = True
-                    errorMsg += "image_url (str) "
-            else:
-                image_url = ""
-            if "time" in value:
-                time = value["time"]
-                if type(time) != int:
-                    isInvalid = True
-                    errorMsg += "time (int) "
-            else:
-                time = -1
-            errorMsg += "(optional: calories (int) image_url (str) time (int))"
-
-            if isInvalid:
+            # validate the body against the recipe schema
+            value, errors = validateBody(validation.validateRecipe, value)
+            if errors:
+                errorMsg = validation.formatErrors(errors)
                 raise Exception
             errorMsg = "No recipe added."
-            queries.addRecipe(db, user['idToken'], calories, image_url, value["ingredients"], value["instructions"], value["name"], time)
-            return True
+            return queries.addRecipe(db, user['idToken'], value["calories"], value["image_url"], value["ingredients"], value["instructions"], value["name"], value["time"])
         except:
-            abort(400, errorMsg)
+            abortInvalid(errorMsg, errors)
         finally:
-            apiQueryLock.release()
+            lock.release()
 
     def put(self, id):
-        apiQueryLock.acquire()
-        value = request.get_data()
-
+        lock = apiLocks.lock("Recipes.put", read = ["ingredients", "units"], write = ["recipes"])
+        lock.acquire()
         try:
+            errors = []
             errorMsg = "Invalid JSON"
-            value = json.loads(value)
-
-            # validate there are fields for ingredients (list), instructions (list), name (str) (optional: calories (int) image_url (str) time (int))
-            isInvalid = False
-            errorMsg = "Please fix the following values: "
-
-            if "ingredients" not in value or value["ingredients"] == None or not value["ingredients"] or type(value["ingredients"]) != list:
-                isInvalid = True
-                errorMsg += "ingredients (list of dict { ingredientId (int), unitId (int), quantity (int) }) "
-            else:
-                existingIngredients = queries.getAllIngredients(db, user['idToken'])
-                existingIngredientIds = [ingredient["id"] for ingredient in existingIngredients]
-                existingUnits = queries.getAllUnits(db, user['idToken'])
-                existingUnitIds = [unit["id"] for unit in existingUnits]
-
-                for ingredient in value["ingredients"]:
-                    if type(ingredient) != dict:
-                        isInvalid = True
-                        errorMsg += "ingredients (list of dict { ingredientId (int), unitId (int), quantity (int) }) "
-                        break
-                    # validate list of objects each given an ingredientId, unitId, and quantity
-                    else:
-                        isInvalidIngredient = False
-                        isNonExistientIngredient = False
-                        isInvalidUnit = False
-                        isNonExistientUnit = False
-                        isInvalidQuantity = False
-
-                        if "ingredientId" not in ingredient or ingredient["ingredientId"] == None or type(ingredient["ingredientId"]) != int:
-                            isInvalid = True
-                            isInvalidIngredient = True
-                        # validate all given ingredients exist
-                        elif ingredient["ingredientId"] not in existingIngredientIds:
-                            isInvalid = True
-                            isNonExistientIngredient = True
-                        if "unitId" not in ingredient or ingredient["unitId"] == None or type(ingredient["unitId"]) != int:
-                            isInvalid = True
-                            isInvalidUnit = True
-                        # validate all given units exist
-                        elif ingredient["unitId"] not in existingUnitIds:
-                            isInvalid = True
-                            isNonExistientUnit = True
-                        if "quantity" not in ingredient or ingredient["quantity"] == None or type(ingredient["quantity"]) != int:
-                            isInvalid = True
-                            isInvalidQuantity = True
-                        if isInvalid:
-                            errorMsg += "ingredients (list of dict { "
-                            if isInvalidIngredient:
-                                errorMsg += "ingredientId (int) "
-                            elif isNonExistientIngredient:
-                                errorMsg += "ingredientId (ID not valid) "
-                            if isInvalidUnit:
-                                errorMsg += "unitId (int) "
-                            elif isNonExistientUnit:
-                                errorMsg += "unitId (ID not valid) "
-                            if isInvalidQuantity:
-                                errorMsg += "quantity (int) "
-                            errorMsg += "}) "
-                            break
-            if "instructions" not in value or value["instructions"] == None or type(value["instructions"]) != list:
-                isInvalid = True
-                errorMsg += "instructions (list) "
-            else:
-                for instruction in value["instructions"]:
-                    if type(instruction) != str:
-                        isInvalid = True
-                        errorMsg += "instructions (list of str) "
-                        break
-            if "name" not in value or value["name"] == None or value["name"] == "" or type(value["name"]) != str:
-                isInvalid = True
-                errorMsg += "name (str) "
-            if "calories" in value:
-                calories = value["calories"]
-                if type(calories) != int:
-                    isInvalid = True
-                    errorMsg += "calories (int) "
-            else:
-                calories = -1
-            if "image_url" in value:
-                image_url = value["image_url"]
-                if type(image_url) != str:
-                    isInvalid = True
-                    errorMsg += "image_url (str) "
-            else:
-                image_url = ""
-            if "time" in value:
-                time = value["time"]
-                if type(time) != int:
-                    isInvalid = True
-                    errorMsg += "time (int) "
-            else:
-                time = -1
-            errorMsg += "(optional: calories (int) image_url (str) time (int))"
+            value = json.loads(request.get_data())
+            errorMsg = "Could not validate values."
 
-            if isInvalid:
+            # validate the body against the recipe schema
+            value, errors = validateBody(validation.validateRecipe, value)
+            if errors:
+                errorMsg = validation.formatErrors(errors)
                 raise Exception
             errorMsg = "No recipe updated."
-            queries.updateRecipe(db, user['idToken'], id, calories, image_url, value["ingredients"], value["instructions"], value["name"], time)
-            return True
+            return queries.updateRecipe(db, user['idToken'], id, value["calories"], value["image_url"], value["ingredients"], value["instructions"], value["name"], value["time"])
         except:
-            abort(400, errorMsg)
+            abortInvalid(errorMsg, errors)
         finally:
-            apiQueryLock.release()
+            lock.release()
 
 class Users(Resource):
     def get(self, id=None):
-        apiQueryLock.acquire()
+        lock = apiLocks.lock("Users.get", read = ["users"])
+        lock.acquire()
         try:
-            if id == None:
+            notModified = notModifiedResponse(["users"])
+            if notModified != None:
+                return notModified
+            errorMsg = "No user exists."
+            if id == None and request.args:
+                # get a page of users
+                errorMsg = "Invalid query parameters."
+                query = parseCollectionQuery("users")
+                errorMsg = "No user exists."
+                return buildPageResponse(*queries.getPage(db, user['idToken'], "users", **query))
+            elif id == None and streamPageSize > 0:
+                # stream all users (pages read after the lock is released may include later writes)
+                return streamJsonArray(queries.iterRecords(db, user['idToken'], "users", streamPageSize))
+            elif id == None:
                 # get all users
                 return queries.getAllUsers(db, user['idToken'])
             else:
                 # get specific user
                 return queries.getUser(db, user['idToken'], id)            
         except:
-            abort(400, "No user exists.")
+            abort(400, errorMsg)
         finally:
-            apiQueryLock.release()
+            lock.release()
     
     def delete(self, id):
-        apiQueryLock.acquire()
+        lock = apiLocks.lock("Users.delete", write = ["users"])
+        lock.acquire()
         try:
             queries.removeUser(db, user['idToken'], id)
             return True
         except:
             abort(400, "No user deleted.")
         finally:
-            apiQueryLock.release()
+            lock.release()
     
     def post(self):
-        apiQueryLock.acquire()
-        value = request.get_data()
-
+        lock = apiLocks.lock("Users.post", read = ["ingredients", "units", "recipes"], write = ["users"])
+        lock.acquire()
         try:
+            errors = []
             errorMsg = "Invalid JSON"
-            value = json.loads(value)
+            value = json.loads(request.get_data())
+            errorMsg = "Could not validate values."
 
-            # validate there is a field for email (str) name (str) (optional: items (list) recipes (list))
-            isInvalid = False
-            errorMsg = "Please fix the following values: "
-
-            if "email" not in value or value["email"] == None or value["email"] == "" or type(value["email"]) != str:
-                isInvalid = True
-                errorMsg += "email (str) "
-            if "items" in value:
-                items = value["items"]
-
-                if type(items) != list:
-                    isInvalid = True
-                    errorMsg += "items (list) "
-                else:
-                    # validate given items exist
-                    existingIngredients = queries.getAllIngredients(db, user['idToken'])
-                    existingIngredientIds = [ingredient["id"] for ingredient in existingIngredients]
-                    existingUnits = queries.getAllUnits(db, user['idToken'])
-                    existingUnitIds = [unit["id"] for unit in existingUnits]
-
-                    for item in value["items"]:
-                        if type(item) != dict:
-                            isInvalid = True
-                            errorMsg += "items (list of dict { ingredientId (int), unitId (int), quantity (int) }) "
-                            break
-                        # validate list of objects each given an ingredientId, unitId, and quantity
-                        else:
-                            isInvalidIngredient = False
-                            isNonExistientIngredient = False
-                            isInvalidUnit = False
-                            isNonExistientUnit = False
-                            isInvalidQuantity = False
-
-                            if "ingredientId" not in item or item["ingredientId"] == None or type(item["ingredientId"]) != int:
-                                isInvalid = True
-                                isInvalidIngredient = True
-                            # validate all given ingredients exist
-                            elif item["ingredientId"] not in existingIngredientIds:
-                                isInvalid = True
-                                isNonExistientIngredient = True
-                            if "unitId" not in item or item["unitId"] == None or type(item["unitId"]) != int:
-                                isInvalid = True
-                                isInvalidUnit = True
-                            # validate all given units exist
-                            elif item["unitId"] not in existingUnitIds:
-                                isInvalid = True
-                                isNonExistientUnit = True
-                            if "quantity" not in item or item["quantity"] == None or type(item["quantity"]) != int:
-                                isInvalid = True
-                                isInvalidQuantity = True
-                            if isInvalid:
-                                errorMsg += "items (list of dict { "
-                                if isInvalidIngredient:
-                                    errorMsg += "ingredientId (int) "
-                                elif isNonExistientIngredient:
-                                    errorMsg += "ingredientId (ID not valid) "
-                                if isInvalidUnit:
-                                    errorMsg += "unitId (int) "
-                                elif isNonExistientUnit:
-                                    errorMsg += "unitId (ID not valid) "
-                                if isInvalidQuantity:
-                                    errorMsg += "quantity (int) "
-                                errorMsg += "}) "
-                                break
-            else:
-                items = []
-            if "name" not in value or value["name"] == None or value["name"] == "" or type(value["name"]) != str:
-                isInvalid = True
-                errorMsg += "name (str) "
-            if "recipes" in value:
-                recipes = value["recipes"]
-                if type(recipes) != list:
-                    isInvalid = True
-                    errorMsg += "recipes (list) "
-                else:
-                    # validate given recipes exist
-                    existingRecipes = queries.getAllRecipes(db, user['idToken'])
-                    existingRecipeIds = [recipe["id"] for recipe in existingRecipes]
-                    for recipeId in recipes:
-                        if type(recipeId) != int:
-                            isInvalid = True
-                            errorMsg += "recipes (list of int) "
-                            break
-                        if recipeId not in existingRecipeIds:
-                            isInvalid = True
-                            errorMsg += "recipes (recipe ID not valid) "
-                            break
-            else:
-                recipes = []
-            errorMsg += "(optional: items (list) recipes (list))"
-
-            if isInvalid:
+            # validate the body against the user schema
+            value, errors = validateBody(validation.validateUser, value)
+            if errors:
+                errorMsg = validation.formatErrors(errors)
                 raise Exception
             errorMsg = "No user added."
-            queries.addUser(db, user['idToken'], value["email"], items, value["name"], recipes)
-            return True
+            return queries.addUser(db, user['idToken'], value["email"], value["items"], value["name"], value["recipes"])
         except:
-            abort(400, errorMsg)
+            abortInvalid(errorMsg, errors)
         finally:
-            apiQueryLock.release()
+            lock.release()
 
     def put(self, id):
-        apiQueryLock.acquire()
-        value = request.get_data()
-
+        lock = apiLocks.lock("Users.put", read = ["ingredients", "units", "recipes"], write = ["users"])
+        lock.acquire()
         try:
+            errors = []
             errorMsg = "Invalid JSON"
-            value = json.loads(value)
+            value = json.loads(request.get_data())
+            errorMsg = "Could not validate values."
 
-            # validate there is a field for email (str) name (str) (optional: recipes (list))
-            isInvalid = False
-            errorMsg = "Please fix the following values: "
+            # validate the body against the user schema
+            value, errors = validateBody(validation.validateUser, value)
+            if errors:
+                errorMsg = validation.formatErrors(errors)
+                raise Exception
+            errorMsg = "No user updated."
+            return queries.updateUser(db, user['idToken'], id, value["email"], value["items"], value["name"], value["recipes"])
+        except:
+            abortInvalid(errorMsg, errors)
+        finally:
+            lock.release()
 
-            if "email" not in value or value["email"] == None or value["email"] == "" or type(value["email"]) != str:
-                isInvalid = True
-                errorMsg += "email (str) "
-            if "items" in value:
-                items = value["items"]
+# collection: (item validator, record name used in messages, collections read while applying a batch)
+BATCH_COLLECTIONS = {
+    "ingredients": (validation.validateIngredient, "ingredient", ["recipes"]),
+    "recipes": (validation.validateRecipe, "recipe", ["ingredients", "units", "users"]),
+    "users": (validation.validateUser, "user", ["ingredients", "units", "recipes"])
+}
+BATCH_IN_USE_CHECKS = {"ingredients": queries.isIngredientBeingUsed, "recipes": queries.isRecipeBeingUsed}
+batchMaxItems = apiConfig.getint('properties', 'batchMaxItems', fallback = 500)
 
-                if type(items) != list:
-                    isInvalid = True
-                    errorMsg += "items (list) "
-                else:
-                    # validate given items exist
-                    existingIngredients = queries.getAllIngredients(db, user['idToken'])
-                    existingIngredientIds = [ingredient["id"] for ingredient in existingIngredients]
-                    existingUnits = queries.getAllUnits(db, user['idToken'])
-                    existingUnitIds = [unit["id"] for unit in existingUnits]
-
-                    for item in value["items"]:
-                        if type(item) != dict:
-                            isInvalid = True
-                            errorMsg += "items (list of dict { ingredientId (int), unitId (int), quantity (int) }) "
-                            break
-                        # validate list of objects each given an ingredientId, unitId, and quantity
-                        else:
-                            isInvalidIngredient = False
-                            isNonExistientIngredient = False
-                            isInvalidUnit = False
-                            isNonExistientUnit = False
-                            isInvalidQuantity = False
-
-                            if "ingredientId" not in item or item["ingredientId"] == None or type(item["ingredientId"]) != int:
-                                isInvalid = True
-                                isInvalidIngredient = True
-                            # validate all given ingredients exist
-                            elif item["ingredientId"] not in existingIngredientIds:
-                                isInvalid = True
-                                isNonExistientIngredient = True
-                            if "unitId" not in item or item["unitId"] == None or type(item["unitId"]) != int:
-                                isInvalid = True
-                                isInvalidUnit = True
-                            # validate all given units exist
-                            elif item["unitId"] not in existingUnitIds:
-                                isInvalid = True
-                                isNonExistientUnit = True
-                            if "quantity" not in item or item["quantity"] == None or type(item["quantity"]) != int:
-                                isInvalid = True
-                                isInvalidQuantity = True
-                            if isInvalid:
-                                errorMsg += "items (list of dict { "
-                                if isInvalidIngredient:
-                                    errorMsg += "ingredientId (int) "
-                                elif isNonExistientIngredient:
-                                    errorMsg += "ingredientId (ID not valid) "
-                                if isInvalidUnit:
-                                    errorMsg += "unitId (int) "
-                                elif isNonExistientUnit:
-                                    errorMsg += "unitId (ID not valid) "
-                                if isInvalidQuantity:
-                                    errorMsg += "quantity (int) "
-                                errorMsg += "}) "
-                                break
-            else:
-                items = []
-            if "name" not in value or value["name"] == None or value["name"] == "" or type(value["name"]) != str:
-                isInvalid = True
-                errorMsg += "name (str) "
-            if "recipes" in value:
-                recipes = value["recipes"]
-                if type(recipes) != list:
-                    isInvalid = True
-                    errorMsg += "recipes (list) "
-                else:
-                    # validate given recipes exist
-                    existingRecipes = queries.getAllRecipes(db, user['idToken'])
-                    existingRecipeIds = [recipe["id"] for recipe in existingRecipes]
-                    for recipeId in recipes:
-                        if type(recipeId) != int:
-                            isInvalid = True
-                            errorMsg += "recipes (list of int) "
-                            break
-                        if recipeId not in existingRecipeIds:
-                            isInvalid = True
-                            errorMsg += "recipes (recipe ID not valid) "
-                            break
-            else:
-                recipes = []
-            errorMsg += "(optional: items (list) recipes (list))"
+class Batch(Resource):
+    def __init__(self, collection):
+        self.collection = collection
 
-            if isInvalid:
+    def post(self):
+        validate, name, read = BATCH_COLLECTIONS[self.collection]
+        lock = apiLocks.lock(f"Batch.{self.collection}", read = read, write = [self.collection])
+        lock.acquire()
+        try:
+            errorMsg = "Invalid JSON"
+            value = json.loads(request.get_data())
+
+            # validate there are fields for create (list of dict), update (list of dict with id (int)) and delete (list of int)
+            errorMsg = "Please fix the following values: (optional: create (list of dict) update (list of dict with id (int)) delete (list of int))"
+            creates = value.get("create", [])
+            updates = value.get("update", [])
+            deletes = value.get("delete", [])
+            if type(creates) != list or any(type(item) != dict for item in creates):
                 raise Exception
-            errorMsg = "No user updated."
-            queries.updateUser(db, user['idToken'], id, value["email"], items, value["name"], recipes)
-            return True
+            if type(updates) != list or any(type(item) != dict or type(item.get("id")) != int for item in updates):
+                raise Exception
+            if type(deletes) != list or any(type(id) != int for id in deletes):
+                raise Exception
+            if len(creates) + len(updates) + len(deletes) > batchMaxItems:
+                errorMsg = f"Batches are limited to {batchMaxItems} items."
+                raise Exception
+
+            # validate every item, then check the ids referenced anywhere in the batch with one lookup per collection
+            errorMsg = "Could not validate values."
+            createResults = [{} for item in creates]
+            updateResults = [{"id": item["id"]} for item in updates]
+            deleteResults = [{"id": id} for id in deletes]
+            validated = [(result, *validate(item)) for result, item in zip(createResults + updateResults, creates + updates)]
+            references = {}
+            for result, values, errors, itemReferences in validated:
+                for collection, ids in itemReferences.items():
+                    references.setdefault(collection, set()).update(id for path, id in ids)
+            missing = getMissingIds({collection: sorted(ids) for collection, ids in references.items()}) if references else {}
+            for result, values, errors, itemReferences in validated:
+                errors += [{"field": path, "error": "ID not valid"} for collection, ids in itemReferences.items() for path, id in ids if id in missing[collection]]
+                if errors:
+                    result.update({"status": 400, "message": validation.formatErrors(errors), "errors": errors})
+                else:
+                    result["values"] = values
+
+            # each record can only be updated or deleted once per batch, and records in use can't be deleted
+            seenIds = set()
+            for result in updateResults + deleteResults:
+                if result["id"] in seenIds:
+                    result.pop("values", None)
+                    result.update({"status": 400, "message": f"Duplicate {name} in batch."})
+                seenIds.add(result["id"])
+            isInUse = BATCH_IN_USE_CHECKS.get(self.collection)
+            for result in deleteResults:
+                if "status" not in result and isInUse != None and isInUse(db, user['idToken'], result["id"]):
+                    result.update({"status": 400, "message": f"Can't delete {name} in use."})
+
+            # apply every valid item together
+            errorMsg = f"No {name} batch applied."
+            createItems = [result for result in createResults if "status" not in result]
+            updateItems = [result for result in updateResults if "status" not in result]
+            deleteItems = [result for result in deleteResults if "status" not in result]
+            created, updated, missingIds = queries.applyBatch(db, user['idToken'], self.collection, [result.pop("values") for result in createItems], {result["id"]: result.pop("values") for result in updateItems}, [result["id"] for result in deleteItems])
+
+            for result, record in zip(createItems, created):
+                result.update({"status": 200, "record": record})
+            for result in updateItems:
+                result.update({"status": 400, "message": f"No {name} exists."} if result["id"] in missingIds else {"status": 200, "record": updated[result["id"]]})
+            for result in deleteItems:
+                result.update({"status": 400, "message": f"No {name} exists."} if result["id"] in missingIds else {"status": 200})
+            return {"create": createResults, "update": updateResults, "delete": deleteResults}
         except:
             abort(400, errorMsg)
         finally:
-            apiQueryLock.release()
+            lock.release()
 
 class Units(Resource):
     def get(self, id=None):
-        apiQueryLock.acquire()
+        lock = apiLocks.lock("Units.get", read = ["units"])
+        lock.acquire()
         try:
+            notModified = notModifiedResponse(["units"])
+            if notModified != None:
+                return notModified
             if id == None:
                 # get all unit
                 return queries.getAllUnits(db, user['idToken'])
@@ -664,23 +784,74 @@ class Units(Resource):
         except:
             abort(400, "No unit exists.")
         finally:
-            apiQueryLock.release()
+            lock.release()
+
+cookableDefaultLimit = apiConfig.getint('properties', 'cookableDefaultLimit', fallback = 20)
+cookableMaxLimit = apiConfig.getint('properties', 'cookableMaxLimit', fallback = 100)
+cookableMaxMissing = apiConfig.getint('properties', 'cookableMaxMissing', fallback = 5)
+
+class Cookable(Resource):
+    def get(self, id):
+        lock = apiLocks.lock("Cookable.get", read = ["users", "recipes", "ingredients"])
+        lock.acquire()
+        try:
+            errorMsg = "Invalid query parameters."
+            # ?missing= ingredients a recipe may lack (0 for recipes fully covered by the user's items) and ?limit= for the number of results
+            maxMissing = int(request.args.get("missing", 0))
+            limit = int(request.args.get("limit", cookableDefaultLimit))
+            if maxMissing < 0 or maxMissing > cookableMaxMissing or limit < 1 or limit > cookableMaxLimit:
+                raise Exception
+            errorMsg = "No user exists."
+            notModified = notModifiedResponse(["users", "recipes", "ingredients"])
+            if notModified != None:
+                return notModified
+            # get recipes a specific user can cook from their items
+            return queries.getCookableRecipes(db, user['idToken'], id, maxMissing, limit)
+        except:
+            abort(400, errorMsg)
+        finally:
+            lock.release()
 
 class Grocery(Resource):
     def get(self, id):
-        apiQueryLock.acquire()
+        lock = apiLocks.lock("Grocery.get", read = ["users", "recipes", "ingredients", "units"])
+        lock.acquire()
         try:
+            notModified = notModifiedResponse(["users", "recipes", "ingredients", "units"])
+            if notModified != None:
+                return notModified
             # get specific user's grocery list
+            if asyncDb != None:
+                return asyncDb.run(queries.getUserGroceryListAsync(asyncDb, user['idToken'], id))
             return queries.getUserGroceryList(db, user['idToken'], id)            
         except:
             abort(400, "No user exists.")
         finally:
-            apiQueryLock.release()
+            lock.release()
+
+class GroceryExport(Resource):
+    def get(self):
+        # every user's grocery list as JSON Lines (?format=jsonl, the default) or CSV (?format=csv)
+        format = request.args.get("format", "jsonl")
+        if format not in GROCERY_EXPORT_FORMATS:
+            abort(400, "Invalid query parameters.")
+        try:
+            return Response(getGroceryExport(format), mimetype = GROCERY_EXPORT_FORMATS[format])
+        except:
+            abort(400, "No user exists.")
 
 api.add_resource(Ingredients, '/RecipesPlusPlus/ingredients/', '/RecipesPlusPlus/ingredients/<int:id>/')
+api.add_resource(IngredientRecipes, '/RecipesPlusPlus/ingredients/<int:id>/recipes')
 api.add_resource(Recipes, '/RecipesPlusPlus/recipes/', '/RecipesPlusPlus/recipes/<int:id>/')
+api.add_resource(RecipeSearch, '/RecipesPlusPlus/recipes/search')
 api.add_resource(Users, '/RecipesPlusPlus/users/', '/RecipesPlusPlus/users/<int:id>/')
+for collection in BATCH_COLLECTIONS:
+    api.add_resource(Batch, f'/RecipesPlusPlus/{collection}/batch', endpoint = f'{collection}Batch', resource_class_kwargs = {"collection": collection})
 api.add_resource(Units, '/RecipesPlusPlus/units/', '/RecipesPlusPlus/units/<int:id>/')
 api.add_resource(Grocery, '/RecipesPlusPlus/users/<int:id>/grocery')
+api.add_resource(GroceryExport, '/RecipesPlusPlus/users/grocery')
+api.add_resource(Cookable, '/RecipesPlusPlus/users/<int:id>/cookable')
 app.add_url_rule('/favicon.ico', view_func = lambda: functions.favicon(parentDir))
-app.run(host='0.0.0.0', port=5001)
\ No newline at end of file
+
+if __name__ == "__main__":
+    app.run(host='0.0.0.0', port=5001)
\ No newline at end of file
@@ -0,0 +1,55 @@
+import logging
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# shared client for the web app's calls to the RecipesPlusPlus API
+class ApiClient:
+    def __init__(self, host, timeoutSeconds = 5, retries = 3, backoffSeconds = 0.2, poolSize = 10, responseHooks = []):
+        self.host = host.rstrip("/")
+        self.timeoutSeconds = timeoutSeconds
+        self.retries = retries
+        self.backoffSeconds = backoffSeconds
+        self.poolSize = poolSize
+        # requests response hooks added to every session, e.g. to count API calls
+        self.responseHooks = responseHooks
+        # sessions aren't safe to share between request threads, so each thread keeps its own pooled keep-alive session
+        self.local = threading.local()
+
+    def session(self):
+        session = getattr(self.local, "session", None)
+        if session == None:
+            # only idempotent methods are retried, with exponential backoff on connection errors and gateway failures
+            retry = Retry(total = self.retries, backoff_factor = self.backoffSeconds, status_forcelist = [502, 503, 504], allowed_methods = ["GET", "HEAD", "PUT", "DELETE", "OPTIONS"], raise_on_status = False)
+            adapter = HTTPAdapter(pool_connections = self.poolSize, pool_maxsize = self.poolSize, max_retries = retry)
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.hooks["response"].extend(self.responseHooks)
+            self.local.session = session
+        return session
+
+    def request(self, method, path, **kwargs):
+        kwargs.setdefault("timeout", self.timeoutSeconds)
+        start = time.perf_counter()
+        status = "error"
+        try:
+            response = self.session().request(method, self.host + path, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            logging.info(f"API {method} {path} {status} in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request("PUT", path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request("DELETE", path, **kwargs)
@@ -1,9 +1,10 @@
 #region IMPORTS
+import importlib.util
 import logging
 import os
 from apscheduler.schedulers.background import BackgroundScheduler
 from flask import Flask
-from views import views, parentDir, sharedConfig, appConfig, auth, functions
+from views import views, parentDir, sharedConfig, appConfig, auth, functions, appMetrics
 #endregion
 
 # create and configure logger
@@ -12,20 +13,49 @@ if not os.path.exists('Logs'):
 LOG_FORMAT = "%(levelname)s %(asctime)s - %(message)s"
 logging.basicConfig(filename = parentDir + '/Logs/RecipesPlusPlusWebApp.log', level = logging.INFO, format = LOG_FORMAT)
 
-# sign into service account
-user = auth.sign_in_with_email_and_password(sharedConfig['properties']['firebaseAuthEmail'], sharedConfig['properties']['firebaseAuthPassword'])
+spec = importlib.util.spec_from_file_location('shared', parentDir + '/Shared/tokenbroker.py')
+tokenbroker = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(tokenbroker)
+
+spec = importlib.util.spec_from_file_location('shared', parentDir + '/Shared/profiling.py')
+profiling = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(profiling)
+
+# take the service account token from the token broker when started by serve.py
+tokenBrokerUrl, tokenBrokerSecret = functions.getTokenBroker()
+signedIn = False
+if tokenBrokerUrl:
+    user = tokenbroker.fetchToken(tokenBrokerUrl, tokenBrokerSecret)
+# otherwise sign into service account (left unauthenticated when no account is configured, e.g. for local emulators)
+elif sharedConfig['properties'].get('firebaseAuthEmail', ''):
+    user = auth.sign_in_with_email_and_password(sharedConfig['properties']['firebaseAuthEmail'], sharedConfig['properties']['firebaseAuthPassword'])
+    signedIn = True
+else:
+    user = {'idToken': None}
 
 # create event scheduler for refreshing auth token
 def refreshToken():
     global user
-    user = auth.refresh(user['refreshToken'])
+    if tokenBrokerUrl:
+        user = tokenbroker.fetchToken(tokenBrokerUrl, tokenBrokerSecret)
+    else:
+        user = auth.refresh(user['refreshToken'])
 
 sched = BackgroundScheduler(daemon=True)
-sched.add_job(refreshToken, 'interval', minutes = 30)
+if tokenBrokerUrl:
+    # the broker refreshes the token itself, workers pick up the current one well before it expires
+    sched.add_job(refreshToken, 'interval', minutes = 5)
+elif signedIn:
+    sched.add_job(refreshToken, 'interval', minutes = 30)
 sched.start()
 
 app = Flask(__name__)
 app.secret_key = appConfig['properties']['secretKey']
 app.register_blueprint(views, url_prefix="/RecipesPlusPlus/")
+appMetrics.instrument(app)
+# sampled requests and requests sent with the admin profiling header are profiled to disk
+profiling.RequestProfiler(parentDir + '/' + appConfig.get('properties', 'profileDirectory', fallback = 'Logs/Profiles/WebApp'), appConfig.getfloat('properties', 'profileSampleRate', fallback = 0), appConfig.get('properties', 'profileAdminSecret', fallback = ''), appConfig.getfloat('properties', 'profileSampleIntervalMs', fallback = 5), appConfig.getint('properties', 'profileMaxDumps', fallback = 100)).instrument(app)
 app.add_url_rule('/favicon.ico', view_func = lambda: functions.favicon(parentDir))
-app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
+
+if __name__ == "__main__":
+    app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -2,7 +2,6 @@ import json
 import pyrebase
 import importlib.util
 import pathlib
-import requests
 from configparser import ConfigParser
 from flask import Blueprint, session, render_template, request, redirect, url_for
 
@@ -16,6 +15,14 @@ spec = importlib.util.spec_from_file_location('shared', parentDir + '/Shared/fun
 functions = importlib.util.module_from_spec(spec)
 spec.loader.exec_module(functions)
 
+spec = importlib.util.spec_from_file_location('webapp', parentDir + '/RecipesPlusPlusWebApp/apiclient.py')
+apiclient = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(apiclient)
+
+spec = importlib.util.spec_from_file_location('shared', parentDir + '/Shared/metrics.py')
+metrics = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(metrics)
+
 # get configuration variables
 appConfig = ConfigParser()
 appConfig.read('RecipesPlusPlusWebApp/app.ini')
@@ -27,6 +34,12 @@ firebase = pyrebase.initialize_app(firebaseConfig)
 db = firebase.database()
 auth = firebase.auth()
 
+# request metrics, API calls made while rendering a page are attributed to its view
+appMetrics = metrics.Metrics("recipesplusplus_webapp", "RecipesPlusPlus API")
+
+# pooled client for API calls
+apiClient = apiclient.ApiClient(appConfig['properties']['apiHost'], appConfig.getfloat('properties', 'apiTimeoutSeconds', fallback = 5), appConfig.getint('properties', 'apiRetries', fallback = 3), appConfig.getfloat('properties', 'apiRetryBackoffSeconds', fallback = 0.2), appConfig.getint('properties', 'apiPoolSize', fallback = 10), [appMetrics.recordUpstreamResponse])
+
 @views.route("/")
 @views.route("/home/")
 def home():
@@ -74,9 +87,10 @@ def login():
         try:
             user = auth.sign_in_with_email_and_password(email, password)
 
-            response = requests.get(f"{appConfig['properties']['apiHost']}/users")
+            # look up the profile by email instead of scanning every user
+            response = apiClient.get("/users/", params = {"email": email})
             profiles = json.loads(response.content)
-            profile = next((profile for profile in profiles if profile["email"] == email), None)
+            profile = profiles[0] if profiles else None
 
             sessionData = {"user": user, "profile": profile}
 
@@ -97,15 +111,15 @@ def signup():
         name = request.form['name']
 
         try:
-            response = requests.get(f"{appConfig['properties']['apiHost']}/users")
+            response = apiClient.get("/users/", params = {"email": email})
             profiles = json.loads(response.content)
-            profile = next((profile for profile in profiles if profile["email"] == email), None)
 
-            if profile == None:
-                response = requests.post(f"{appConfig['properties']['apiHost']}/users", data = json.dumps({"email": email, "name": name}))
-                response = requests.get(f"{appConfig['properties']['apiHost']}/users")
-                profiles = json.loads(response.content)
-                profile = next((profile for profile in profiles if profile["email"] == email), None)
+            if not profiles:
+                # the API returns the created profile so it doesn't need to be looked up again
+                response = apiClient.post("/users/", data = json.dumps({"email": email, "name": name}))
+                if response.status_code != 200:
+                    raise Exception
+                profile = json.loads(response.content)
 
                 user = auth.create_user_with_email_and_password(email, password)
 
@@ -0,0 +1,86 @@
+import asyncio
+import contextvars
+import json
+import threading
+import aiohttp
+
+# async read access to the Firebase Realtime Database REST API for running independent fetches concurrently
+class AsyncFirebaseBackend:
+    def __init__(self, databaseUrl, concurrency = 8, timeoutSeconds = 30, onResponse = None):
+        self.databaseUrl = databaseUrl.rstrip("/")
+        self.concurrency = concurrency
+        self.timeoutSeconds = timeoutSeconds
+        # optionally called with the size of every response body, e.g. to count upstream calls
+        self.onResponse = onResponse
+        # the backend runs its own event loop so synchronous callers such as Flask resources can wait on it
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target = self.loop.run_forever, daemon = True).start()
+        self.run(self.open())
+
+    async def open(self):
+        # the session and semaphore belong to the backend's loop, which is the only place they are used
+        self.session = aiohttp.ClientSession(timeout = aiohttp.ClientTimeout(total = self.timeoutSeconds), connector = aiohttp.TCPConnector(limit = self.concurrency))
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+
+    def run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(runInContext(coroutine, contextvars.copy_context()), self.loop).result()
+
+    def close(self):
+        self.run(self.session.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    async def get(self, path, token, parameters = {}):
+        # query parameters are JSON encoded as the REST API expects
+        parameters = {name: json.dumps(value) for name, value in parameters.items()}
+        if token:
+            parameters["auth"] = token
+        # at most `concurrency` requests are in flight at once
+        async with self.semaphore:
+            async with self.session.get(f"{self.databaseUrl}/{path}.json", params = parameters) as response:
+                response.raise_for_status()
+                body = await response.read()
+        if self.onResponse != None:
+            self.onResponse(len(body))
+        return json.loads(body)
+
+    async def getAll(self, collection, token):
+        records = await self.get(collection, token)
+        if records == None:
+            return None
+        if isinstance(records, dict):
+            return list(records.values())
+        # list backed collections leave empty slots behind deleted records
+        return [record for record in records if record != None]
+
+    async def getById(self, collection, token, id):
+        records = await self.get(collection, token, {"orderBy": "id", "equalTo": id})
+        if not records:
+            return None
+        return next(iter(records.values()))
+
+    async def getByIdRange(self, collection, token, startId, endId):
+        records = await self.get(collection, token, {"orderBy": "id", "startAt": startId, "endAt": endId})
+        return list((records or {}).values())
+
+    async def getByIds(self, collection, token, ids):
+        # one range query when the ids are dense, otherwise an indexed query per id, all in flight at once (same choice as FirebaseBackend.getEntries)
+        if not ids:
+            return []
+        if max(ids) - min(ids) < 2 * len(ids):
+            records = await self.getByIdRange(collection, token, min(ids), max(ids))
+        else:
+            uniqueIds = sorted(set(ids))
+            records = [record for record in await asyncio.gather(*[self.getById(collection, token, id) for id in uniqueIds]) if record != None]
+        wanted = set(ids)
+        return [record for record in records if record["id"] in wanted]
+
+    async def getExistingIds(self, collection, token, ids):
+        # one indexed query per id, all in flight at once
+        records = await asyncio.gather(*[self.getById(collection, token, id) for id in ids])
+        return set(id for id, record in zip(ids, records) if record != None)
+
+async def runInContext(coroutine, context):
+    # the caller's context variables (e.g. per request metrics) are carried over to the loop thread, tasks started from here inherit them
+    for variable, value in context.items():
+        variable.set(value)
+    return await coroutine
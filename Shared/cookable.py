@@ -0,0 +1,119 @@
+import heapq
+import threading
+
+# recipe matching by ingredient coverage ("what can I cook"), units and quantities are not compared
+# each recipe's distinct ingredient ids are a bitset (an int with bit n set for ingredient n), so what a recipe is missing from a pantry is recipe & ~pantry
+
+countBits = int.bit_count if hasattr(int, "bit_count") else lambda value: bin(value).count("1")
+
+def toBitset(ingredientIds):
+    bitset = 0
+    for ingredientId in ingredientIds:
+        bitset |= 1 << ingredientId
+    return bitset
+
+def fromBitset(bitset):
+    # set bits lowest first
+    ingredientIds = []
+    while bitset:
+        lowest = bitset & -bitset
+        ingredientIds.append(lowest.bit_length() - 1)
+        bitset ^= lowest
+    return ingredientIds
+
+class CookableIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.built = False
+        # recipe records and ingredient bitsets by id, plus the recipes using each ingredient and the recipes by number of ingredients
+        self.recipes = {}
+        self.bitsets = {}
+        self.ingredientRecipes = {}
+        self.sizeRecipes = {}
+        self.matches = 0
+        self.updates = 0
+        self.rebuilds = 0
+
+    def isBuilt(self):
+        with self.lock:
+            return self.built
+
+    def build(self, recipes):
+        with self.lock:
+            self.recipes, self.bitsets, self.ingredientRecipes, self.sizeRecipes = {}, {}, {}, {}
+            for recipe in recipes:
+                self.indexRecipe(recipe)
+            self.built = True
+            self.rebuilds += 1
+
+    def updateRecipe(self, recipe):
+        # adds or replaces a recipe, writes made before the index is built are picked up when it is
+        with self.lock:
+            if not self.built:
+                return
+            self.unindexRecipe(recipe["id"])
+            self.indexRecipe(recipe)
+            self.updates += 1
+
+    def removeRecipe(self, recipeId):
+        with self.lock:
+            if not self.built:
+                return
+            self.unindexRecipe(recipeId)
+            self.updates += 1
+
+    def indexRecipe(self, recipe):
+        # callers hold the lock
+        ingredientIds = set(quantity["ingredientId"] for quantity in recipe.get("ingredients", []))
+        for ingredientId in ingredientIds:
+            self.ingredientRecipes.setdefault(ingredientId, set()).add(recipe["id"])
+        self.sizeRecipes.setdefault(len(ingredientIds), set()).add(recipe["id"])
+        self.recipes[recipe["id"]] = recipe
+        self.bitsets[recipe["id"]] = toBitset(ingredientIds)
+
+    def unindexRecipe(self, recipeId):
+        # callers hold the lock
+        if recipeId not in self.recipes:
+            return
+        del self.recipes[recipeId]
+        ingredientIds = fromBitset(self.bitsets.pop(recipeId))
+        for ingredientId in ingredientIds:
+            self.discard(self.ingredientRecipes, ingredientId, recipeId)
+        self.discard(self.sizeRecipes, len(ingredientIds), recipeId)
+
+    def discard(self, index, key, recipeId):
+        # callers hold the lock
+        recipeIds = index.get(key, set())
+        recipeIds.discard(recipeId)
+        if not recipeIds:
+            index.pop(key, None)
+
+    def match(self, ingredientIds, maxMissing, limit):
+        # (recipe, missing ingredient ids) of the recipes missing at most maxMissing ingredients, fewest missing first then by id
+        ingredientIds = set(ingredientIds)
+        missingMask = ~toBitset(ingredientIds)
+        with self.lock:
+            self.matches += 1
+            # a recipe sharing no ingredient with the pantry misses all of its ingredients, so only recipes sharing one or with at most
+            # maxMissing ingredients can match, unless those are most recipes anyway and checking all of them is cheaper
+            candidateSets = [self.ingredientRecipes[ingredientId] for ingredientId in ingredientIds if ingredientId in self.ingredientRecipes]
+            candidateSets += [self.sizeRecipes[size] for size in range(maxMissing + 1) if size in self.sizeRecipes]
+            if sum(len(recipeIds) for recipeIds in candidateSets) < len(self.recipes) // 2:
+                candidates = set().union(*candidateSets)
+            else:
+                candidates = self.bitsets
+
+            matches = []
+            for recipeId in candidates:
+                missing = self.bitsets[recipeId] & missingMask
+                if missing == 0:
+                    matches.append((0, recipeId, 0))
+                elif maxMissing > 0:
+                    count = countBits(missing)
+                    if count <= maxMissing:
+                        matches.append((count, recipeId, missing))
+            return [(self.recipes[recipeId], fromBitset(missing)) for count, recipeId, missing in heapq.nsmallest(limit, matches)]
+
+    def stats(self):
+        with self.lock:
+            return {"built": self.built, "recipes": len(self.recipes), "ingredients": len(self.ingredientRecipes), "matches": self.matches, "updates": self.updates, "rebuilds": self.rebuilds}
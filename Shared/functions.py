@@ -1,5 +1,6 @@
 import configparser
 import json
+import os
 import pyrebase
 from flask import send_from_directory
 
@@ -8,9 +9,14 @@ def favicon(parentDir):
 
 def buildSharedConfig(parentDir):
     sharedConfig = configparser.ConfigParser()
-    sharedConfig.read(parentDir + '/Shared/shared.ini')
+    # the shared configuration file can be overridden (e.g. by benchmarks) through an environment variable
+    sharedConfig.read(os.environ.get('RECIPESPLUSPLUS_SHARED_CONFIG', parentDir + '/Shared/shared.ini'))
     return sharedConfig
 
+def getTokenBroker():
+    # workers started by serve.py get the token broker's address and secret through the environment
+    return os.environ.get('RECIPESPLUSPLUS_TOKEN_BROKER_URL', ''), os.environ.get('RECIPESPLUSPLUS_TOKEN_BROKER_SECRET', '')
+
 def buildFirebase(sharedConfig):
     firebaseConfig = json.loads(sharedConfig['shared']['firebaseConfigJson'])
     return pyrebase.initialize_app(firebaseConfig)
\ No newline at end of file
@@ -0,0 +1,129 @@
+import csv
+import io
+import itertools
+import json
+
+# grocery totals for many users at once: recipes are encoded once as sparse (ingredientId, unitId) -> quantity vectors
+# and a page of users is multiplied through them in one pass, with NumPy/SciPy when installed and plain python otherwise
+try:
+    import numpy
+    from scipy import sparse
+except ImportError:
+    numpy = None
+    sparse = None
+
+class RecipeMatrix:
+    def __init__(self, recipes):
+        # columns are the (ingredientId, unitId) keys used by any recipe, users' items may add more per page
+        self.recipeRows = {recipe["id"]: row for row, recipe in enumerate(recipes)}
+        self.keys = sorted(set((quantity["ingredientId"], quantity["unitId"]) for recipe in recipes for quantity in recipe.get("ingredients", [])))
+        self.columns = {key: column for column, key in enumerate(self.keys)}
+
+        # each recipe's total quantity and number of quantities per key (a key with a count is listed even if its quantity is 0)
+        entries = {}
+        for recipe in recipes:
+            for quantity in recipe.get("ingredients", []):
+                entry = entries.setdefault((self.recipeRows[recipe["id"]], self.columns[(quantity["ingredientId"], quantity["unitId"])]), [0, 0])
+                entry[0] += quantity["quantity"]
+                entry[1] += 1
+        if numpy != None:
+            rows, columns = zip(*entries) if entries else ((), ())
+            shape = (len(recipes), len(self.keys))
+            self.quantities = sparse.csr_matrix((numpy.array([quantity for quantity, count in entries.values()], dtype = numpy.int64), (rows, columns)), shape = shape)
+            self.counts = sparse.csr_matrix((numpy.array([count for quantity, count in entries.values()], dtype = numpy.int64), (rows, columns)), shape = shape)
+        else:
+            self.recipeTotals = {}
+            for (row, column), total in entries.items():
+                self.recipeTotals.setdefault(row, {})[column] = total
+
+    def iterTotals(self, users, pageSize = 500):
+        # yields (user, [(ingredientId, unitId, quantity)] sorted by key), users listing a recipe that doesn't exist get None
+        users = iter(users)
+        while True:
+            page = list(itertools.islice(users, pageSize))
+            if not page:
+                return
+            yield from zip(page, self.computePage(page) if numpy != None else [self.computeUser(user) for user in page])
+
+    def computePage(self, users):
+        # user x recipe matrix of how often each user lists each recipe, and user x key matrices of their items
+        keys = list(self.keys)
+        columns = dict(self.columns)
+        recipeRows, recipeColumns, recipeTimes = [], [], []
+        itemRows, itemColumns, itemQuantities = [], [], []
+        invalid = set()
+        for row, user in enumerate(users):
+            for recipeId in user.get("recipes", []):
+                if recipeId not in self.recipeRows:
+                    invalid.add(row)
+                    continue
+                recipeRows.append(row)
+                recipeColumns.append(self.recipeRows[recipeId])
+                recipeTimes.append(1)
+            for item in user.get("items", []):
+                key = (item["ingredientId"], item["unitId"])
+                if key not in columns:
+                    columns[key] = len(keys)
+                    keys.append(key)
+                itemRows.append(row)
+                itemColumns.append(columns[key])
+                itemQuantities.append(item["quantity"])
+
+        # duplicate coordinates are summed when the matrices are built
+        listed = sparse.csr_matrix((numpy.array(recipeTimes, dtype = numpy.int64), (recipeRows, recipeColumns)), shape = (len(users), len(self.recipeRows)))
+        shape = (len(users), len(keys))
+        quantities = padColumns(listed @ self.quantities, len(keys)) + sparse.csr_matrix((numpy.array(itemQuantities, dtype = numpy.int64), (itemRows, itemColumns)), shape = shape)
+        counts = padColumns(listed @ self.counts, len(keys)) + sparse.csr_matrix((numpy.ones(len(itemRows), dtype = numpy.int64), (itemRows, itemColumns)), shape = shape)
+
+        # keys with a count are listed, with the quantity at the same position, ordered by user and then key
+        counts = counts.tocoo()
+        present = counts.data > 0
+        rows, keyColumns = counts.row[present], counts.col[present]
+        totals = numpy.asarray(quantities[rows, keyColumns]).ravel()
+        keyArray = numpy.array(keys, dtype = numpy.int64).reshape(-1, 2)
+        order = numpy.lexsort((keyArray[keyColumns, 1], keyArray[keyColumns, 0], rows))
+        rows, keyColumns = rows[order], keyColumns[order]
+        entries = list(zip(keyArray[keyColumns, 0].tolist(), keyArray[keyColumns, 1].tolist(), totals[order].tolist()))
+        bounds = numpy.searchsorted(rows, numpy.arange(len(users) + 1)).tolist()
+        return [None if row in invalid else entries[bounds[row]:bounds[row + 1]] for row in range(len(users))]
+
+    def computeUser(self, user):
+        if any(recipeId not in self.recipeRows for recipeId in user.get("recipes", [])):
+            return None
+        totals = {}
+        for recipeId in user.get("recipes", []):
+            for column, (quantity, count) in self.recipeTotals.get(self.recipeRows[recipeId], {}).items():
+                total = totals.setdefault(self.keys[column], [0, 0])
+                total[0] += quantity
+                total[1] += count
+        for item in user.get("items", []):
+            total = totals.setdefault((item["ingredientId"], item["unitId"]), [0, 0])
+            total[0] += item["quantity"]
+            total[1] += 1
+        return sorted((ingredientId, unitId, quantity) for (ingredientId, unitId), (quantity, count) in totals.items() if count > 0)
+
+def padColumns(matrix, width):
+    # recipe totals only have the recipe keys, the item keys added for the page come after them
+    return sparse.hstack([matrix, sparse.csr_matrix((matrix.shape[0], width - matrix.shape[1]), dtype = matrix.dtype)], format = "csr")
+
+def iterJsonLines(rows, ingredients, units):
+    # one JSON object per user with the same grocery items as /users/<id>/grocery
+    for user, totals in rows:
+        line = {"user": {"id": user["id"], "email": user.get("email", ""), "name": user.get("name", "")}}
+        if totals == None:
+            line["error"] = "No recipe exists."
+        else:
+            line["groceryList"] = [{"ingredient": ingredients.get(ingredientId), "unit": units.get(unitId), "quantity": quantity} for ingredientId, unitId, quantity in totals]
+        yield (json.dumps(line) + "\n").encode("utf-8")
+
+def iterCsv(rows, ingredients, units):
+    # one row per user and grocery item, users whose list can't be built are left out
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["userId", "email", "ingredientId", "ingredient", "unitId", "unit", "quantity"])
+    for user, totals in rows:
+        for ingredientId, unitId, quantity in totals or []:
+            writer.writerow([user["id"], user.get("email", ""), ingredientId, ingredients.get(ingredientId, {}).get("name", ""), unitId, units.get(unitId, {}).get("name", ""), quantity])
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
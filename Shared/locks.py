@@ -0,0 +1,96 @@
+import logging
+import threading
+import time
+
+# writer-preferring reader/writer lock: readers run in parallel, writers are exclusive
+class ReadWriteLock:
+    def __init__(self):
+        self.condition = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.writer = False
+        self.waitingWriters = 0
+
+    def acquireRead(self):
+        with self.condition:
+            # new readers wait behind queued writers so writes are not starved
+            while self.writer or self.waitingWriters > 0:
+                self.condition.wait()
+            self.readers += 1
+
+    def releaseRead(self):
+        with self.condition:
+            self.readers -= 1
+            if self.readers == 0:
+                self.condition.notify_all()
+
+    def acquireWrite(self):
+        with self.condition:
+            self.waitingWriters += 1
+            try:
+                while self.writer or self.readers > 0:
+                    self.condition.wait()
+            finally:
+                self.waitingWriters -= 1
+            self.writer = True
+
+    def releaseWrite(self):
+        with self.condition:
+            self.writer = False
+            self.condition.notify_all()
+
+# one reader/writer lock per database collection along with lock wait time statistics
+class CollectionLocks:
+    def __init__(self, collections, waitLogThresholdMs = 100, onWait = None):
+        self.locks = {collection: ReadWriteLock() for collection in collections}
+        self.waitLogThresholdMs = waitLogThresholdMs
+        # optionally called with every lock name and wait time, e.g. to record a wait time histogram
+        self.onWait = onWait
+        self.statsLock = threading.Lock()
+        self.waitStats = {}
+
+    def lock(self, name, read = [], write = []):
+        return CollectionLock(self, name, read, write)
+
+    def recordWait(self, name, waitMs):
+        with self.statsLock:
+            stats = self.waitStats.setdefault(name, {"acquisitions": 0, "totalWaitMs": 0.0, "maxWaitMs": 0.0})
+            stats["acquisitions"] += 1
+            stats["totalWaitMs"] += waitMs
+            stats["maxWaitMs"] = max(stats["maxWaitMs"], waitMs)
+        if self.onWait != None:
+            self.onWait(name, waitMs)
+        if waitMs >= self.waitLogThresholdMs:
+            logging.warning(f"{name} waited {waitMs:.1f} ms for collection locks")
+
+    def stats(self):
+        with self.statsLock:
+            return {name: dict(stats, averageWaitMs = stats["totalWaitMs"] / stats["acquisitions"]) for name, stats in self.waitStats.items()}
+
+# the set of collection locks needed by a single request
+class CollectionLock:
+    def __init__(self, collectionLocks, name, read, write):
+        self.collectionLocks = collectionLocks
+        self.name = name
+        # a collection that is both read and written only needs the write lock
+        modes = {collection: "read" for collection in read}
+        modes.update({collection: "write" for collection in write})
+        # always acquire in the same order to avoid deadlocks between requests
+        self.modes = sorted(modes.items())
+        self.waitMs = 0.0
+
+    def acquire(self):
+        start = time.perf_counter()
+        for collection, mode in self.modes:
+            if mode == "write":
+                self.collectionLocks.locks[collection].acquireWrite()
+            else:
+                self.collectionLocks.locks[collection].acquireRead()
+        self.waitMs = (time.perf_counter() - start) * 1000
+        self.collectionLocks.recordWait(self.name, self.waitMs)
+
+    def release(self):
+        for collection, mode in reversed(self.modes):
+            if mode == "write":
+                self.collectionLocks.locks[collection].releaseWrite()
+            else:
+                self.collectionLocks.locks[collection].releaseRead()
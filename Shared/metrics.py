@@ -0,0 +1,161 @@
+import bisect
+import contextvars
+import threading
+import time
+from flask import Response, current_app, request
+
+# in process request metrics exposed in the Prometheus text format
+
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+CALL_BUCKETS = [0, 1, 2, 3, 5, 8, 13, 21, 50, 100]
+
+# per request counters, carried by the request's context so calls made on other threads for it (e.g. async queries) are attributed to it
+requestStats = contextvars.ContextVar("requestStats", default = None)
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Metrics:
+    def __init__(self, prefix, upstreamName):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        # name: (type, help text, buckets for histograms, {label values: counter value or histogram})
+        self.families = {}
+        self.collectors = []
+        self.define("requests_total", "counter", "Requests handled by endpoint and status code.")
+        self.define("request_errors_total", "counter", "Requests answered with a 4xx or 5xx status by endpoint.")
+        self.define("request_duration_seconds", "histogram", "Time from receiving a request until its response body was sent.", LATENCY_BUCKETS)
+        self.define("request_bytes_total", "counter", "Request body bytes received by endpoint.")
+        self.define("response_bytes_total", "counter", "Response body bytes sent by endpoint, after compression.")
+        self.define("upstream_calls_total", "counter", f"Calls made to the {upstreamName} by endpoint.")
+        self.define("upstream_calls_per_request", "histogram", f"Calls made to the {upstreamName} per request by endpoint.", CALL_BUCKETS)
+        self.define("upstream_bytes_total", "counter", f"Response bytes received from the {upstreamName} by endpoint.")
+        self.define("upstream_calls_unattributed_total", "counter", f"Calls made to the {upstreamName} outside of a request, e.g. by scheduled jobs.")
+
+    def define(self, name, type, help, buckets = None):
+        self.families[name] = (type, help, buckets, {})
+
+    def increment(self, name, labels, amount = 1):
+        with self.lock:
+            series = self.families[name][3]
+            series[labels] = series.get(labels, 0) + amount
+
+    def observe(self, name, labels, value):
+        with self.lock:
+            type, help, buckets, series = self.families[name]
+            if labels not in series:
+                series[labels] = Histogram(buckets)
+            series[labels].observe(value)
+
+    def addCollector(self, collect):
+        # collectors return [(name, type, help, {label values: value})] read at scrape time, e.g. cache counters
+        self.collectors.append(collect)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            families = [(name, type, help, buckets, dict(series)) for name, (type, help, buckets, series) in self.families.items()]
+            for name, type, help, buckets, series in families:
+                lines += [f"# HELP {self.prefix}_{name} {help}", f"# TYPE {self.prefix}_{name} {type}"]
+                for labels, value in sorted(series.items()):
+                    if type != "histogram":
+                        lines.append(f"{self.prefix}_{name}{formatLabels(labels)} {formatValue(value)}")
+                        continue
+                    # histogram buckets are cumulative and end with +Inf
+                    cumulative = 0
+                    for bound, count in zip(buckets + ["+Inf"], value.counts):
+                        cumulative += count
+                        lines.append(f"{self.prefix}_{name}_bucket{formatLabels(labels + (('le', formatValue(bound)),))} {cumulative}")
+                    lines.append(f"{self.prefix}_{name}_sum{formatLabels(labels)} {formatValue(value.sum)}")
+                    lines.append(f"{self.prefix}_{name}_count{formatLabels(labels)} {value.count}")
+        for collect in self.collectors:
+            for name, type, help, series in collect():
+                lines += [f"# HELP {self.prefix}_{name} {help}", f"# TYPE {self.prefix}_{name} {type}"]
+                lines += [f"{self.prefix}_{name}{formatLabels(labels)} {formatValue(value)}" for labels, value in sorted(series.items())]
+        return "\n".join(lines) + "\n"
+
+    def instrument(self, app):
+        # record latency, status, bytes and upstream calls for every request handled by the app and serve them at /metrics
+        app.before_request(self.startRequest)
+        app.after_request(self.finishRequest)
+        app.add_url_rule('/metrics', 'metrics', lambda: Response(self.render(), mimetype = "text/plain; version=0.0.4"))
+
+    def startRequest(self):
+        requestStats.set({"start": time.perf_counter(), "upstreamCalls": 0, "upstreamBytes": 0, "responseBytes": 0})
+
+    def finishRequest(self, response):
+        stats = requestStats.get()
+        if stats == None or request.endpoint == "metrics":
+            return response
+        labels = (("endpoint", getEndpointName()),)
+
+        # streamed bodies are counted as they are sent and every request is recorded once its response is closed
+        if response.is_streamed:
+            response.response = countBytes(response.iter_encoded(), stats)
+        else:
+            stats["responseBytes"] = len(response.get_data())
+        status = response.status_code
+        requestBytes = request.content_length or 0
+
+        def record():
+            self.increment("requests_total", labels + (("status", str(status)),))
+            if status >= 400:
+                self.increment("request_errors_total", labels)
+            self.observe("request_duration_seconds", labels, time.perf_counter() - stats["start"])
+            self.increment("request_bytes_total", labels, requestBytes)
+            self.increment("response_bytes_total", labels, stats["responseBytes"])
+            self.increment("upstream_calls_total", labels, stats["upstreamCalls"])
+            self.observe("upstream_calls_per_request", labels, stats["upstreamCalls"])
+            self.increment("upstream_bytes_total", labels, stats["upstreamBytes"])
+        response.call_on_close(record)
+        return response
+
+    def recordUpstream(self, bytes):
+        stats = requestStats.get()
+        if stats == None:
+            self.increment("upstream_calls_unattributed_total", ())
+            return
+        stats["upstreamCalls"] += 1
+        stats["upstreamBytes"] += bytes
+
+    def recordUpstreamResponse(self, response, *args, **kwargs):
+        # usable as a requests response hook, streamed responses (e.g. event streams) are counted without reading their body
+        self.recordUpstream(0 if kwargs.get("stream") else len(response.content))
+
+    def recordLockWait(self, name, waitMs):
+        self.observe("lock_wait_seconds", (("lock", name),), waitMs / 1000)
+
+def getEndpointName():
+    # Flask-RESTful resources are named after their class and method (e.g. Ingredients.get), plain views after their endpoint
+    view = current_app.view_functions.get(request.endpoint)
+    viewClass = getattr(view, "view_class", None)
+    if viewClass != None:
+        return f"{viewClass.__name__}.{request.method.lower()}"
+    return request.endpoint or "unmatched"
+
+def countBytes(chunks, stats):
+    for chunk in chunks:
+        stats["responseBytes"] += len(chunk)
+        yield chunk
+
+def formatLabels(labels):
+    if not labels:
+        return ""
+    escaped = [(name, str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")) for name, value in labels]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+def formatValue(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return repr(value)
@@ -0,0 +1,111 @@
+import cProfile
+import collections
+import hmac
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from flask import g, request
+
+# opt-in request profiling: a sampled fraction of requests, or any request carrying the admin header, is profiled and written to disk
+# each profiled request produces <name>.prof (cProfile stats for pstats/snakeviz) and <name>.folded (collapsed stacks for flamegraph.pl/speedscope)
+
+PROFILE_HEADER = "X-Profile-Request"
+
+class StackSampler:
+    def __init__(self, threadId, intervalSeconds):
+        self.threadId = threadId
+        self.intervalSeconds = intervalSeconds
+        self.stacks = collections.Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target = self.run, daemon = True)
+        self.thread.start()
+
+    def run(self):
+        # sample the request thread's stack, labelled by file and function so query layer calls show up as e.g. queries.py:getUserGroceryList
+        while not self.stopped.wait(self.intervalSeconds):
+            frame = sys._current_frames().get(self.threadId)
+            names = []
+            while frame != None:
+                names.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+class RequestProfiler:
+    def __init__(self, directory, sampleRate = 0.0, adminSecret = "", sampleIntervalMs = 5, maxDumps = 100):
+        self.directory = directory
+        self.sampleRate = sampleRate
+        self.adminSecret = adminSecret
+        self.sampleIntervalSeconds = sampleIntervalMs / 1000
+        self.maxDumps = maxDumps
+        self.lock = threading.Lock()
+        self.dumps = collections.deque()
+
+    def instrument(self, app):
+        app.before_request(self.startRequest)
+        app.after_request(self.finishRequest)
+
+    def shouldProfile(self):
+        # the admin header only works when a secret is configured
+        header = request.headers.get(PROFILE_HEADER, "")
+        if self.adminSecret and header and hmac.compare_digest(header, self.adminSecret):
+            return True
+        return self.sampleRate > 0 and random.random() < self.sampleRate
+
+    def startRequest(self):
+        g.profile = None
+        if not self.shouldProfile():
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # from Python 3.12 only one profiler can be active at a time, so a request arriving while another is profiled isn't
+            logging.info(f"Skipped profiling {request.method} {request.path}, another profiler is active")
+            return
+        sampler = StackSampler(threading.get_ident(), self.sampleIntervalSeconds)
+        g.profile = (profile, sampler, time.perf_counter())
+
+    def finishRequest(self, response):
+        state = g.get("profile")
+        if state == None:
+            return response
+        profile, sampler, start = state
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{request.endpoint or 'unmatched'}-{request.method.lower()}-{uuid.uuid4().hex[:8]}"
+        method = request.method
+        path = request.path
+
+        # profiling stops once the response is closed so streamed bodies are included
+        def finish():
+            profile.disable()
+            sampler.stop()
+            self.writeDump(name, profile, sampler)
+            logging.info(f"Profiled {method} {path} in {(time.perf_counter() - start) * 1000:.1f} ms: {self.directory}/{name}")
+        response.call_on_close(finish)
+        response.headers["X-Profile-Id"] = name
+        return response
+
+    def writeDump(self, name, profile, sampler):
+        os.makedirs(self.directory, exist_ok = True)
+        profile.dump_stats(f"{self.directory}/{name}.prof")
+        with open(f"{self.directory}/{name}.folded", "w") as foldedFile:
+            foldedFile.writelines(f"{stack} {count}\n" for stack, count in sampler.stacks.items())
+
+        # only the newest dumps are kept
+        with self.lock:
+            self.dumps.append(name)
+            expired = [self.dumps.popleft() for i in range(len(self.dumps) - self.maxDumps)]
+        for expiredName in expired:
+            for extension in [".prof", ".folded"]:
+                try:
+                    os.remove(f"{self.directory}/{expiredName}{extension}")
+                except OSError:
+                    pass
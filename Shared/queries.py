@@ -1,261 +1,933 @@
-def getAllIngredients(db, token):
-    result = db.child("ingredients").get(token)
-    if result.val() == None:
+import asyncio
+import importlib.util
+import pathlib
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+
+spec = importlib.util.spec_from_file_location('shared', str(pathlib.Path(__file__).parent.absolute()).replace("\\",'/') + '/search.py')
+search = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(search)
+
+spec = importlib.util.spec_from_file_location('shared', str(pathlib.Path(__file__).parent.absolute()).replace("\\",'/') + '/cookable.py')
+cookable = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(cookable)
+
+# read-through cache for reference collections (ingredients and units) that rarely change
+class ReferenceCache:
+    def __init__(self, ttlSeconds = 300, maxEntries = 1024):
+        self.ttlSeconds = ttlSeconds
+        self.maxEntries = maxEntries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def configure(self, ttlSeconds, maxEntries):
+        with self.lock:
+            self.ttlSeconds = ttlSeconds
+            self.maxEntries = maxEntries
+            self.entries.clear()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry != None:
+                expires, value = entry
+                if expires > time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self.entries[key]
+            self.misses += 1
+            return False, None
+
+    def set(self, key, value):
+        with self.lock:
+            if self.maxEntries <= 0:
+                return
+            self.entries[key] = (time.monotonic() + self.ttlSeconds, value)
+            self.entries.move_to_end(key)
+            # evict least recently used entries past the size limit
+            while len(self.entries) > self.maxEntries:
+                self.entries.popitem(last = False)
+                self.evictions += 1
+
+    def invalidate(self, collection):
+        # keys are tuples starting with the collection name
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == collection]:
+                del self.entries[key]
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "entries": len(self.entries), "hitRatio": self.hits / lookups if lookups else 0.0}
+
+referenceCache = ReferenceCache()
+
+def configureCache(ttlSeconds, maxEntries):
+    referenceCache.configure(ttlSeconds, maxEntries)
+
+def getCacheStats():
+    return referenceCache.stats()
+
+# per collection version stamps bumped by every mutation so readers can tell when a collection last changed
+class CollectionVersions:
+    def __init__(self):
+        # every process (each serve.py worker, and again after a restart) counts from 0, so its stamps are prefixed with its startup time
+        # and a random part that tells apart processes started together, and validators issued by another process never match
+        self.started = time.time()
+        self.epoch = f"{int(self.started * 1000):x}.{uuid.uuid4().hex}"
+        self.versions = {}
+        self.lock = threading.Lock()
+
+    def bump(self, collection):
+        with self.lock:
+            version, lastModified = self.versions.get(collection, (0, self.started))
+            self.versions[collection] = (version + 1, time.time())
+
+    def stamp(self, collections):
+        # combined version string and last modified time of the given collections
+        with self.lock:
+            versions = {collection: self.versions.get(collection, (0, self.started)) for collection in sorted(collections)}
+        stamp = self.epoch + "-" + "-".join(f"{collection}.{version}" for collection, (version, lastModified) in versions.items())
+        return stamp, max(lastModified for version, lastModified in versions.values())
+
+collectionVersions = CollectionVersions()
+
+def getVersionStamp(collections):
+    return collectionVersions.stamp(collections)
+
+# "verify" re-reads every write from the database before returning it, "trust" returns the written entity directly
+consistencyMode = "verify"
+
+def configureConsistency(mode):
+    global consistencyMode
+    if mode not in ["verify", "trust"]:
         raise Exception
-    ingredients = result.val()
-    if isinstance(ingredients, dict):
-        return sorted(ingredients.values(), key=lambda ingredient: ingredient["id"])
-    else:
-        return sorted(ingredients, key=lambda ingredient: ingredient["id"])
+    consistencyMode = mode
+
+# grocery totals per user, adjusted by the user and recipe writes below so reading a grocery list doesn't aggregate it again
+# totals map (ingredientId, unitId) to [quantity, number of quantities summed], a key leaves the list when its count drops to 0
+class GroceryViews:
+    def __init__(self):
+        self.enabled = True
+        self.lock = threading.Lock()
+        # userId: (items, recipe ids, totals) as of the user's last write
+        self.views = {}
+        # totals of every recipe a view lists and the users listing it (userId: times listed)
+        self.recipeTotals = {}
+        self.recipeUsers = {}
+        self.hits = 0
+        self.misses = 0
+        self.updates = 0
+        self.repairs = 0
+
+    def configure(self, enabled):
+        with self.lock:
+            self.enabled = enabled
+            self.views.clear()
+            self.recipeTotals.clear()
+            self.recipeUsers.clear()
+
+    def get(self, userId):
+        # quantities by (ingredientId, unitId), or None when the user has no view yet
+        with self.lock:
+            view = self.views.get(userId)
+            if view == None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            # keys are listed in the order a full recompute first sees them: the user's items, then the ingredients of each recipe as listed
+            items, recipeIds, totals = view
+            keys = [(item["ingredientId"], item["unitId"]) for item in items] + [key for recipeId in recipeIds for key in self.recipeTotals[recipeId]]
+            return {key: totals[key][0] for key in keys if key in totals}
+
+    def build(self, user, recipes):
+        # recipes maps ids to records for every recipe the user lists
+        with self.lock:
+            if not self.enabled:
+                return {key: quantity for key, (quantity, count) in computeGroceryTotals(user, recipes).items()}
+            self.unregister(user["id"])
+            totals = sumQuantities(user.get("items", []))
+            for recipeId, times in Counter(user.get("recipes", [])).items():
+                if recipeId not in self.recipeTotals:
+                    self.recipeTotals[recipeId] = sumQuantities(recipes[recipeId]["ingredients"])
+                self.recipeUsers.setdefault(recipeId, {})[user["id"]] = times
+            # recipes are added in the order they are listed so keys keep the order they are first seen in
+            for recipeId in user.get("recipes", []):
+                addTotals(totals, self.recipeTotals[recipeId], 1)
+            self.views[user["id"]] = (user.get("items", []), user.get("recipes", []), totals)
+            return {key: quantity for key, (quantity, count) in totals.items()}
+
+    def updateUser(self, user, recipes):
+        # recipes maps ids to records for the recipes the user lists that no view listed before (see getUnlistedRecipeIds)
+        with self.lock:
+            view = self.views.get(user["id"])
+            if view == None:
+                return
+            oldItems, oldRecipeIds, totals = view
+            newItems, newRecipeIds = user.get("items", []), user.get("recipes", [])
+
+            # only the difference between the old and new items and recipes is applied
+            delta = {}
+            if oldItems != newItems:
+                addTotals(delta, sumQuantities(oldItems), -1)
+                addTotals(delta, sumQuantities(newItems), 1)
+            oldRecipeCounts, newRecipeCounts = Counter(oldRecipeIds), Counter(newRecipeIds)
+            for recipeId, times in (newRecipeCounts - oldRecipeCounts).items():
+                if recipeId not in self.recipeTotals:
+                    self.recipeTotals[recipeId] = sumQuantities(recipes[recipeId]["ingredients"])
+                addTotals(delta, self.recipeTotals[recipeId], times)
+            for recipeId, times in (oldRecipeCounts - newRecipeCounts).items():
+                addTotals(delta, self.recipeTotals[recipeId], -times)
+            applyTotals(totals, delta)
+
+            for recipeId, times in newRecipeCounts.items():
+                self.recipeUsers.setdefault(recipeId, {})[user["id"]] = times
+            for recipeId in set(oldRecipeCounts) - set(newRecipeCounts):
+                self.unlist(recipeId, user["id"])
+            self.views[user["id"]] = (newItems, newRecipeIds, totals)
+            self.updates += 1
+
+    def updateRecipe(self, recipe):
+        with self.lock:
+            if recipe["id"] not in self.recipeTotals:
+                return
+            delta = {}
+            addTotals(delta, self.recipeTotals[recipe["id"]], -1)
+            self.recipeTotals[recipe["id"]] = sumQuantities(recipe.get("ingredients", []))
+            addTotals(delta, self.recipeTotals[recipe["id"]], 1)
+            # every view listing the recipe changes by the recipe's difference times how often it is listed
+            for userId, times in self.recipeUsers[recipe["id"]].items():
+                scaled = {}
+                addTotals(scaled, delta, times)
+                applyTotals(self.views[userId][2], scaled)
+                self.updates += 1
+
+    def removeUser(self, userId):
+        with self.lock:
+            self.unregister(userId)
+
+    def removeRecipe(self, recipeId):
+        # recipes in use can't be deleted, any view still listing one is out of date and dropped
+        with self.lock:
+            for userId in list(self.recipeUsers.get(recipeId, {})):
+                self.unregister(userId)
+            self.recipeTotals.pop(recipeId, None)
+
+    def unregister(self, userId):
+        # callers hold the lock
+        view = self.views.pop(userId, None)
+        if view == None:
+            return
+        for recipeId in set(view[1]):
+            self.unlist(recipeId, userId)
+
+    def unlist(self, recipeId, userId):
+        # callers hold the lock, recipes no view lists anymore aren't tracked
+        users = self.recipeUsers.get(recipeId, {})
+        users.pop(userId, None)
+        if not users:
+            self.recipeUsers.pop(recipeId, None)
+            self.recipeTotals.pop(recipeId, None)
+
+    def getUnlistedRecipeIds(self, recipeIds):
+        with self.lock:
+            return sorted(set(recipeIds) - set(self.recipeTotals))
+
+    def hasView(self, userId):
+        with self.lock:
+            return userId in self.views
+
+    def userIds(self):
+        with self.lock:
+            return list(self.views)
+
+    def diff(self, user, recipes):
+        # recipe ids whose stored totals differ from the records, and whether the user's view differs from a full recompute
+        with self.lock:
+            staleRecipeIds = [recipeId for recipeId in set(user.get("recipes", [])) if recipeId in self.recipeTotals and self.recipeTotals[recipeId] != sumQuantities(recipes[recipeId]["ingredients"])]
+            view = self.views.get(user["id"])
+            return staleRecipeIds, view == None or view[2] != computeGroceryTotals(user, recipes)
+
+    def stats(self):
+        with self.lock:
+            return {"views": len(self.views), "recipes": len(self.recipeTotals), "hits": self.hits, "misses": self.misses, "updates": self.updates, "repairs": self.repairs}
+
+    def recordRepairs(self, count):
+        with self.lock:
+            self.repairs += count
+
+groceryViews = GroceryViews()
+
+def configureGroceryViews(enabled):
+    groceryViews.configure(enabled)
+
+def getGroceryViewStats():
+    return groceryViews.stats()
+
+# recipe search index, built on the first search and then adjusted by the recipe and ingredient writes below
+searchIndex = search.RecipeSearchIndex()
+
+def getSearchIndexStats():
+    return searchIndex.stats()
+
+def getIndexedRecipes(db, token):
+    # an empty recipe collection is indexed as no recipes
+    try:
+        return getAllRecipes(db, token)
+    except:
+        return []
 
-def getNextIngredientId(db, token):
+def buildSearchIndex(db, token, recipes = None):
     try:
         ingredients = getAllIngredients(db, token)
-        ids = [ingredient["id"] for ingredient in ingredients]
-        return min(set(range(0, max(ids) + 2)) - set(ids))
     except:
-        return 0
+        ingredients = []
+    searchIndex.build(getIndexedRecipes(db, token) if recipes == None else recipes, ingredients)
 
-def getIngredient(db, token, ingredientId):
-    result = db.child("ingredients").order_by_child("id").equal_to(ingredientId).get(token)
-    if not result.val():
+def searchRecipes(db, token, query, limit):
+    if not searchIndex.isBuilt():
+        buildSearchIndex(db, token)
+    return searchIndex.search(query, limit)
+
+# recipe ingredient bitsets for matching pantries, built on the first match and then adjusted by the recipe writes below
+cookableIndex = cookable.CookableIndex()
+
+def getCookableIndexStats():
+    return cookableIndex.stats()
+
+def buildCookableIndex(db, token, recipes = None):
+    cookableIndex.build(getIndexedRecipes(db, token) if recipes == None else recipes)
+
+def buildRecipeIndexes(db, token):
+    # both recipe indexes are rebuilt from a single read of the recipes
+    recipes = getIndexedRecipes(db, token)
+    buildSearchIndex(db, token, recipes)
+    buildCookableIndex(db, token, recipes)
+
+def getCookableRecipes(db, token, userId, maxMissing, limit):
+    # recipes the user's items cover all but at most maxMissing ingredients of, with the ingredients they are missing
+    user = getUser(db, token, userId)
+    if not cookableIndex.isBuilt():
+        buildCookableIndex(db, token)
+    matches = cookableIndex.match([item["ingredientId"] for item in user.get("items", [])], maxMissing, limit)
+    ingredients = getReferenceRecords(db, token, "ingredients") if any(missingIds for recipe, missingIds in matches) else {}
+    return [{"recipe": recipe, "missing": [ingredients[ingredientId] for ingredientId in missingIds]} for recipe, missingIds in matches]
+
+def sumQuantities(quantities):
+    totals = {}
+    for quantity in quantities:
+        total = totals.setdefault((quantity["ingredientId"], quantity["unitId"]), [0, 0])
+        total[0] += quantity["quantity"]
+        total[1] += 1
+    return totals
+
+def addTotals(totals, otherTotals, times):
+    for key, (quantity, count) in otherTotals.items():
+        total = totals.setdefault(key, [0, 0])
+        total[0] += quantity * times
+        total[1] += count * times
+
+def applyTotals(totals, delta):
+    # only the keys whose quantity or count changed are touched
+    for key, (quantity, count) in delta.items():
+        if quantity == 0 and count == 0:
+            continue
+        total = totals.setdefault(key, [0, 0])
+        total[0] += quantity
+        total[1] += count
+        if total[1] == 0:
+            del totals[key]
+
+def computeGroceryTotals(user, recipes):
+    quantities = list(user.get("items", []))
+    for recipeId in user.get("recipes", []):
+        quantities.extend(recipes[recipeId]["ingredients"])
+    return sumQuantities(quantities)
+
+# ids are handed out from a stored counter plus a free-list of released ids, updated transactionally
+def buildIdAllocator(records):
+    ids = set(record["id"] for record in records)
+    nextId = max(ids) + 1 if ids else 0
+    return {"next": nextId, "free": sorted(set(range(nextId)) - ids)}
+
+def allocateId(db, token, collection):
+    return allocateIds(db, token, collection, 1)[0]
+
+def allocateIds(db, token, collection, count):
+    def allocate(allocator):
+        # the first allocation for a collection builds the allocator from the existing records
+        if allocator == None:
+            allocator = buildIdAllocator(db.getAll(collection, token) or [])
+        freeIds = sorted(allocator.get("free", []))
+        # reuse the smallest released ids before growing the counter
+        reusedIds = freeIds[:count]
+        newIds = list(range(allocator["next"], allocator["next"] + count - len(reusedIds)))
+        return {"next": allocator["next"] + len(newIds), "free": freeIds[len(reusedIds):]}, reusedIds + newIds
+    if count == 0:
+        return []
+    return db.transact("ids/" + collection, token, allocate)
+
+def releaseId(db, token, collection, id):
+    releaseIds(db, token, collection, [id])
+
+def releaseIds(db, token, collection, ids):
+    def release(allocator):
+        # without a stored allocator the next allocation rebuilds it from the records anyway
+        if allocator == None:
+            return None, None
+        freeIds = set(allocator.get("free", []))
+        freeIds.update(id for id in ids if id < allocator["next"])
+        return {"next": allocator["next"], "free": sorted(freeIds)}, None
+    if ids:
+        db.transact("ids/" + collection, token, release)
+
+def getAllIngredients(db, token):
+    cached, ingredients = referenceCache.get(("ingredients",))
+    if cached:
+        return list(ingredients)
+
+    ingredients = db.getAll("ingredients", token)
+    if ingredients == None:
         raise Exception
-    return result[0].val()
+    ingredients = sorted(ingredients, key=lambda ingredient: ingredient["id"])
 
-def removeIngredient(db, token, ingredientId):
-    # if ingredient doesn't exist throw an exception
-    result = db.child("ingredients").order_by_child("id").equal_to(ingredientId).get(token)
-    if not result.val():
+    referenceCache.set(("ingredients",), ingredients)
+    return list(ingredients)
+
+def getNextIngredientId(db, token):
+    return allocateId(db, token, "ingredients")
+
+def getIngredient(db, token, ingredientId):
+    cached, ingredient = referenceCache.get(("ingredients", ingredientId))
+    if cached:
+        return ingredient
+
+    ingredient = db.getById("ingredients", token, ingredientId)
+    if ingredient == None:
         raise Exception
 
-    # get database table list index of the ingredient
-    index = result[0].item[0]
+    referenceCache.set(("ingredients", ingredientId), ingredient)
+    return ingredient
 
-    # attempt delete on existing ingredient
-    db.child("ingredients").child(index).remove(token)
+def removeIngredient(db, token, ingredientId):
+    # attempt delete on existing ingredient (if ingredient doesn't exist throw an exception)
+    db.remove("ingredients", token, ingredientId)
+    releaseId(db, token, "ingredients", ingredientId)
+    referenceCache.invalidate("ingredients")
+    searchIndex.removeIngredient(ingredientId)
+    collectionVersions.bump("ingredients")
     
     # if ingredient still exists then throw exception
-    try:
-        getIngredient(db, token, ingredientId)
+    if consistencyMode == "verify":
+        try:
+            getIngredient(db, token, ingredientId)
+        #if ingredient doesn't exist then successfully deleted
+        except:
+            return
         raise Exception
-    #if ingredient doesn't exist then successfully deleted
-    except:
-        return
 
 def addIngredient(db, token, name, image_url):
     id = getNextIngredientId(db, token)
     ingredient = {"id": id, "image_url": image_url, "name": name}
-    db.child("ingredients").push(ingredient)
+    try:
+        db.add("ingredients", token, ingredient)
+    except:
+        # the id goes back to the free-list so a failed write doesn't leave a gap
+        releaseId(db, token, "ingredients", id)
+        raise
+    referenceCache.invalidate("ingredients")
+    searchIndex.updateIngredient(ingredient)
+    collectionVersions.bump("ingredients")
 
     # if ingredient doesn't exist throw an exception
-    getIngredient(db, token, id)
+    if consistencyMode == "verify":
+        return getIngredient(db, token, id)
+    return ingredient
 
 def updateIngredient(db, token, ingredientId, name, image_url):
-    result = db.child("ingredients").order_by_child("id").equal_to(ingredientId).get(token)
-    if not result.val():
-        raise Exception
+    ingredient = db.update("ingredients", token, ingredientId, {"image_url": image_url, "name": name})
+    referenceCache.invalidate("ingredients")
+    searchIndex.updateIngredient(ingredient)
+    collectionVersions.bump("ingredients")
+
+    # if ingredient doesn't exist throw an exception
+    if consistencyMode == "verify":
+        return getIngredient(db, token, ingredientId)
+    return ingredient
 
-    db.child("ingredients").child(result[0].key()).update({"image_url": image_url, "name": name})
+def isIngredientBeingUsed(db, token, ingredientId):
+    return len(db.getReferencing("recipes", token, "ingredientId", ingredientId)) > 0
 
+def getRecipesUsingIngredient(db, token, ingredientId):
     # if ingredient doesn't exist throw an exception
     getIngredient(db, token, ingredientId)
 
-def isIngredientBeingUsed(db, token, ingredientId):
-    recipes = getAllRecipes(db, token)
-    for recipe in recipes:
-        ingredientIds = [ingredient["ingredientId"] for ingredient in recipe["ingredients"]]
-        if ingredientId in ingredientIds:
-            return True
-    return False
+    # only the recipes the reverse index lists are fetched, however far apart their ids are
+    recipeIds = db.getReferencing("recipes", token, "ingredientId", ingredientId)
+    if not recipeIds:
+        return []
+    return sorted(db.getByIds("recipes", token, recipeIds), key=lambda recipe: recipe["id"])
 
 def getAllRecipes(db, token):
-    result = db.child("recipes").get(token)
-    if result.val() == None:
+    recipes = db.getAll("recipes", token)
+    if recipes == None:
         raise Exception
-    recipes = result.val()
-    if isinstance(recipes, dict):
-        return sorted(recipes.values(), key=lambda recipe: recipe["id"])
-    else:
-        return sorted(recipes, key=lambda recipe: recipe["id"])
+    return sorted(recipes, key=lambda recipe: recipe["id"])
 
 def getNextRecipeId(db, token):
-    try:
-        recipes = getAllRecipes(db, token)
-        ids = [recipe["id"] for recipe in recipes]
-        return min(set(range(0, max(ids) + 2)) - set(ids))
-    except:
-        return 0
+    return allocateId(db, token, "recipes")
 
 def getRecipe(db, token, recipeId):
-    result = db.child("recipes").order_by_child("id").equal_to(recipeId).get(token)
-    if not result.val():
+    recipe = db.getById("recipes", token, recipeId)
+    if recipe == None:
         raise Exception
-    return result[0].val()
+    return recipe
 
-def removeRecipe(db, token, recipeId):
-    # if recipe doesn't exist throw an exception
-    result = db.child("recipes").order_by_child("id").equal_to(recipeId).get(token)
-    if not result.val():
-        raise Exception
+def getRecipesByIds(db, token, recipeIds):
+    if not recipeIds:
+        return {}
+
+    # one range query when the ids are dense, otherwise a query per id, so far apart ids don't download every recipe between them
+    recipes = {recipe["id"]: recipe for recipe in db.getByIds("recipes", token, sorted(set(recipeIds)))}
 
-    # get database table list index of the recipe
-    index = result[0].item[0]
+    # if any requested recipe doesn't exist throw an exception
+    if any(recipeId not in recipes for recipeId in recipeIds):
+        raise Exception
+    return recipes
 
-    # attempt delete on existing recipe
-    db.child("recipes").child(index).remove(token)
+def removeRecipe(db, token, recipeId):
+    # attempt delete on existing recipe (if recipe doesn't exist throw an exception)
+    db.remove("recipes", token, recipeId)
+    releaseId(db, token, "recipes", recipeId)
+    groceryViews.removeRecipe(recipeId)
+    searchIndex.removeRecipe(recipeId)
+    cookableIndex.removeRecipe(recipeId)
+    collectionVersions.bump("recipes")
     
     # if recipe still exists then throw exception
-    try:
-        getRecipe(db, token, recipeId)
+    if consistencyMode == "verify":
+        try:
+            getRecipe(db, token, recipeId)
+        #if recipe doesn't exist then successfully deleted
+        except:
+            return
         raise Exception
-    #if recipe doesn't exist then successfully deleted
-    except:
-        return
 
 def addRecipe(db, token, calories, image_url, ingredients, instructions, name, time):
     id = getNextRecipeId(db, token)
     recipe = {"calories": calories, "id": id, "image_url": image_url, "ingredients": ingredients, "instructions": instructions, "name": name, "time": time}
-    db.child("recipes").push(recipe)
+    try:
+        db.add("recipes", token, recipe)
+    except:
+        # the id goes back to the free-list so a failed write doesn't leave a gap
+        releaseId(db, token, "recipes", id)
+        raise
+    searchIndex.updateRecipe(recipe)
+    cookableIndex.updateRecipe(recipe)
+    collectionVersions.bump("recipes")
     
     # if recipe doesn't exist throw an exception
-    getRecipe(db, token, id)
+    if consistencyMode == "verify":
+        return getRecipe(db, token, id)
+    return recipe
 
 def updateRecipe(db, token, recipeId, calories, image_url, ingredients, instructions, name, time):
-    result = db.child("recipes").order_by_child("id").equal_to(recipeId).get(token)
-    if not result.val():
-        raise Exception
-
-    db.child("recipes").child(result[0].key()).update({"calories": calories, "image_url": image_url, "ingredients": ingredients, "instructions": instructions, "name": name, "time": time})
+    recipe = db.update("recipes", token, recipeId, {"calories": calories, "image_url": image_url, "ingredients": ingredients, "instructions": instructions, "name": name, "time": time})
+    groceryViews.updateRecipe(recipe)
+    searchIndex.updateRecipe(recipe)
+    cookableIndex.updateRecipe(recipe)
+    collectionVersions.bump("recipes")
 
     # if recipe doesn't exist throw an exception
-    getRecipe(db, token, recipeId)
+    if consistencyMode == "verify":
+        return getRecipe(db, token, recipeId)
+    return recipe
 
 def isRecipeBeingUsed(db, token, recipeId):
-    users = getAllUsers(db, token)
-    for user in users:
-        if recipeId in user["recipes"]:
-            return True
-    return False
+    return len(db.getReferencing("users", token, "recipeId", recipeId)) > 0
 
 def getAllUsers(db, token):
-    result = db.child("users").get(token)
-    if result.val() == None:
+    users = db.getAll("users", token)
+    if users == None:
         raise Exception
-    users = result.val()
-    if isinstance(users, dict):
-        return sorted(users.values(), key=lambda user: user["id"])
-    else:
-        return sorted(users, key=lambda user: user["id"])
+    return sorted(users, key=lambda user: user["id"])
+
+def getUsersByEmail(db, token, email):
+    # emails are looked up through the index instead of scanning every user
+    userIds = db.getReferencing("users", token, "email", email)
+    return [getUser(db, token, userId) for userId in userIds]
 
 def getNextUserId(db, token):
-    try:
-        users = getAllUsers(db, token)
-        ids = [user["id"] for user in users]
-        return min(set(range(0, max(ids) + 2)) - set(ids))
-    except:
-        return 0
+    return allocateId(db, token, "users")
 
 def getUser(db, token, userId):
-    result = db.child("users").order_by_child("id").equal_to(userId).get(token)
-    if not result.val():
+    user = db.getById("users", token, userId)
+    if user == None:
         raise Exception
-    return result[0].val()
+    return user
 
 def removeUser(db, token, userId):
-    # if user doesn't exist throw an exception
-    result = db.child("users").order_by_child("id").equal_to(userId).get(token)
-    if not result.val():
-        raise Exception
-
-    # get database table list index of the user
-    index = result[0].item[0]
-
-    # attempt delete on existing user
-    db.child("users").child(index).remove(token)
+    # attempt delete on existing user (if user doesn't exist throw an exception)
+    db.remove("users", token, userId)
+    releaseId(db, token, "users", userId)
+    groceryViews.removeUser(userId)
+    collectionVersions.bump("users")
     
     # if user still exists then throw exception
-    try:
-        getUser(db, token, userId)
+    if consistencyMode == "verify":
+        try:
+            getUser(db, token, userId)
+        #if user doesn't exist then successfully deleted
+        except:
+            return
         raise Exception
-    #if user doesn't exist then successfully deleted
-    except:
-        return
 
 def addUser(db, token, email, items, name, recipes):
     id = getNextUserId(db, token)
     user = {"email": email, "id": id, "items": items, "name": name, "recipes": recipes}
-    db.child("users").push(user)
+    try:
+        db.add("users", token, user)
+    except:
+        # the id goes back to the free-list so a failed write doesn't leave a gap
+        releaseId(db, token, "users", id)
+        raise
+    collectionVersions.bump("users")
 
     # if user doesn't exist throw an exception
-    getUser(db, token, id)
+    if consistencyMode == "verify":
+        return getUser(db, token, id)
+    return user
 
 def updateUser(db, token, userId, email, items, name, recipes):
-    result = db.child("users").order_by_child("id").equal_to(userId).get(token)
-    if not result.val():
-        raise Exception
-
-    db.child("users").child(result[0].key()).update({"email": email, "items": items, "name": name, "recipes": recipes})
+    user = db.update("users", token, userId, {"email": email, "items": items, "name": name, "recipes": recipes})
+    updateGroceryView(db, token, user)
+    collectionVersions.bump("users")
 
     # if user doesn't exist throw an exception
-    getUser(db, token, userId)
+    if consistencyMode == "verify":
+        return getUser(db, token, userId)
+    return user
 
 def getAllUnits(db, token):
-    result = db.child("units").get(token)
-    if result.val() == None:
+    cached, units = referenceCache.get(("units",))
+    if cached:
+        return list(units)
+
+    units = db.getAll("units", token)
+    if units == None:
         raise Exception
-    units = result.val()
-    if isinstance(units, dict):
-        return sorted(units.values(), key=lambda unit: unit["id"])
-    else:
-        return sorted(units, key=lambda unit: unit["id"])
+    units = sorted(units, key=lambda unit: unit["id"])
+
+    referenceCache.set(("units",), units)
+    return list(units)
 
 def getUnit(db, token, unitId):
-    result = db.child("units").order_by_child("id").equal_to(unitId).get(token)
-    if not result.val():
+    cached, unit = referenceCache.get(("units", unitId))
+    if cached:
+        return unit
+
+    unit = db.getById("units", token, unitId)
+    if unit == None:
         raise Exception
-    return result[0].val()
+
+    referenceCache.set(("units", unitId), unit)
+    return unit
+
+def iterRecords(db, token, collection, pageSize):
+    # records in id order read a page at a time, so the whole collection is never held in memory
+    records, after = getPage(db, token, collection, limit = pageSize)
+    # if the collection is empty throw an exception before anything is streamed
+    if not records:
+        raise Exception
+
+    def generate(records, after):
+        yield from records
+        while after != None:
+            records, after = getPage(db, token, collection, after, pageSize)
+            yield from records
+    return generate(records, after)
+
+def filterPage(records, after, limit, filters, fields):
+    records = [record for record in records if (after == None or record["id"] > after) and all(record.get(field) == value for field, value in filters.items())]
+    return [{field: record[field] for field in fields if field in record} if fields != None else record for record in records[:limit]]
+
+def getPage(db, token, collection, after = None, limit = None, filters = {}, fields = None):
+    # the cursor needs ids even when the caller doesn't ask for them
+    queryFields = None if fields == None else sorted(set(fields) | {"id"})
+    # fetch one extra record to know whether another page follows
+    queryLimit = limit + 1 if limit != None else None
+
+    # reference collections are paged from the cache, users by email from the email index, others are pushed down to the storage query
+    if collection in ["ingredients", "units"]:
+        try:
+            records = getAllIngredients(db, token) if collection == "ingredients" else getAllUnits(db, token)
+        except:
+            records = []
+        records = filterPage(records, after, queryLimit, filters, queryFields)
+    elif collection == "users" and "email" in filters:
+        records = filterPage(getUsersByEmail(db, token, filters["email"]), after, queryLimit, filters, queryFields)
+    else:
+        records = db.getPage(collection, token, after, queryLimit, filters, queryFields)
+
+    nextAfter = None
+    if limit != None and len(records) > limit:
+        records = records[:limit]
+        nextAfter = records[-1]["id"]
+    if fields != None and "id" not in fields:
+        records = [{field: value for field, value in record.items() if field != "id"} for record in records]
+    return records, nextAfter
+
+def applyBatch(db, token, collection, creates, updates, deletes):
+    # creates are records without ids, updates map ids to the fields to set and deletes are ids
+    ids = allocateIds(db, token, collection, len(creates))
+    created = [dict(sorted(dict(record, id = id).items())) for record, id in zip(creates, ids)]
+
+    # everything is written together, update and delete ids that don't exist are returned as missing
+    try:
+        updated, missing = db.batch(collection, token, created, updates, deletes)
+    except:
+        releaseIds(db, token, collection, ids)
+        raise
+    releaseIds(db, token, collection, [id for id in deletes if id not in missing])
+    if collection in ["ingredients", "units"]:
+        referenceCache.invalidate(collection)
+    if collection == "ingredients":
+        for record in created + list(updated.values()):
+            searchIndex.updateIngredient(record)
+        for id in deletes:
+            searchIndex.removeIngredient(id)
+    if collection == "recipes":
+        for record in updated.values():
+            groceryViews.updateRecipe(record)
+        for id in deletes:
+            groceryViews.removeRecipe(id)
+        for record in created + list(updated.values()):
+            searchIndex.updateRecipe(record)
+            cookableIndex.updateRecipe(record)
+        for id in [id for id in deletes if id not in missing]:
+            searchIndex.removeRecipe(id)
+            cookableIndex.removeRecipe(id)
+    if collection == "users":
+        for record in updated.values():
+            updateGroceryView(db, token, record)
+        for id in deletes:
+            groceryViews.removeUser(id)
+    collectionVersions.bump(collection)
+
+    # if any written record doesn't exist or any deleted record still exists throw an exception
+    if consistencyMode == "verify":
+        writtenIds = [record["id"] for record in created] + list(updated)
+        written = {record["id"]: record for record in db.getByIds(collection, token, writtenIds)} if writtenIds else {}
+        if any(id not in written for id in writtenIds):
+            raise Exception
+        deletedIds = [id for id in deletes if id not in missing]
+        if deletedIds and db.getExistingIds(collection, token, deletedIds):
+            raise Exception
+        created = [written[record["id"]] for record in created]
+        updated = {id: written[id] for id in updated}
+    return created, updated, missing
 
 def getUserGroceryList(db, token, userId):
-    groceryList = []
+    # users with a grocery view only need the cached ingredients and units
+    totals = groceryViews.get(userId)
+    if totals == None:
+        user = getUser(db, token, userId)
+        # prefetch every recipe the list needs in a single query
+        recipes = getRecipesByIds(db, token, user.get("recipes", []))
+        totals = groceryViews.build(user, recipes)
+    return formatGroceryList(totals, getReferenceRecords(db, token, "ingredients"), getReferenceRecords(db, token, "units"))
+
+def buildGroceryList(user, recipes, ingredients, units):
+    # merge quantities keyed on (ingredientId, unitId) in the order they are first seen
+    totals = {key: quantity for key, (quantity, count) in computeGroceryTotals(user, recipes).items()}
+    return formatGroceryList(totals, {ingredient["id"]: ingredient for ingredient in ingredients}, {unit["id"]: unit for unit in units})
+
+def formatGroceryList(totals, ingredients, units):
+    # ingredients and units are mapped by id (if any doesn't exist throw an exception)
+    return [{ "ingredient": ingredients[ingredientId], "unit": units[unitId], "quantity": quantity } for (ingredientId, unitId), quantity in totals.items()]
+
+def updateGroceryView(db, token, user):
+    # a user's view is adjusted by what changed in their items and recipes, fetching only recipes no view has listed yet
+    if not groceryViews.hasView(user["id"]):
+        return
+    try:
+        groceryViews.updateUser(user, getRecipesByIds(db, token, groceryViews.getUnlistedRecipeIds(user.get("recipes", []))))
+    except:
+        # the view is rebuilt on the next read
+        groceryViews.removeUser(user["id"])
+
+def checkGroceryViews(db, token):
+    # verify every grocery view against a full recompute from the database, repairing the ones that drifted (e.g. after writes made outside this process)
+    userIds = groceryViews.userIds()
+    mismatchedUserIds = []
+    for userId in userIds:
+        try:
+            user = getUser(db, token, userId)
+            recipes = getRecipesByIds(db, token, user.get("recipes", []))
+        except:
+            groceryViews.removeUser(userId)
+            mismatchedUserIds.append(userId)
+            continue
+        staleRecipeIds, mismatched = groceryViews.diff(user, recipes)
+        # stale recipe totals are corrected through every view listing them
+        for recipeId in staleRecipeIds:
+            groceryViews.updateRecipe(recipes[recipeId])
+        if groceryViews.diff(user, recipes)[1]:
+            groceryViews.build(user, recipes)
+        if staleRecipeIds or mismatched:
+            mismatchedUserIds.append(userId)
+    groceryViews.recordRepairs(len(mismatchedUserIds))
+    return {"checked": len(userIds), "mismatched": mismatchedUserIds}
+
+def applyExternalChanges(db, token, collection, ids):
+    # writes made outside this process (e.g. reported by the read replica) are applied to the caches, views and indexes like the writes above, ids no longer found were deleted
+    records = {record["id"]: record for record in db.getByIds(collection, token, ids)}
+    if collection in ["ingredients", "units"]:
+        referenceCache.invalidate(collection)
+    for id in ids:
+        record = records.get(id)
+        if collection == "ingredients":
+            if record != None:
+                searchIndex.updateIngredient(record)
+            else:
+                searchIndex.removeIngredient(id)
+        elif collection == "recipes":
+            if record != None:
+                groceryViews.updateRecipe(record)
+                searchIndex.updateRecipe(record)
+                cookableIndex.updateRecipe(record)
+            else:
+                groceryViews.removeRecipe(id)
+                searchIndex.removeRecipe(id)
+                cookableIndex.removeRecipe(id)
+        elif collection == "users":
+            if record != None:
+                updateGroceryView(db, token, record)
+            else:
+                groceryViews.removeUser(id)
+    collectionVersions.bump(collection)
+
+def getReferenceRecords(db, token, collection):
+    # records of the cached reference collections by id
+    cached, records = referenceCache.get((collection, "byId"))
+    if cached:
+        return records
+
+    records = getAllIngredients(db, token) if collection == "ingredients" else getAllUnits(db, token)
+    records = {record["id"]: record for record in records}
+
+    referenceCache.set((collection, "byId"), records)
+    return records
+
+def getReferenceIds(db, token, collection):
+    # id sets of the cached reference collections, so checking an id doesn't depend on the collection size
+    cached, ids = referenceCache.get((collection, "ids"))
+    if cached:
+        return ids
 
-    user = getUser(db, token, userId)
+    try:
+        records = getAllIngredients(db, token) if collection == "ingredients" else getAllUnits(db, token)
+    except:
+        records = []
+    ids = frozenset(record["id"] for record in records)
+
+    referenceCache.set((collection, "ids"), ids)
+    return ids
+
+def getMissingIds(db, token, references):
+    # ids referenced in a request body (collection: ids) that don't exist, looked up once per collection
+    missing = {}
+    for collection, ids in references.items():
+        if collection in ["ingredients", "units"]:
+            existing = getReferenceIds(db, token, collection)
+        else:
+            existing = db.getExistingIds(collection, token, sorted(set(ids)))
+        missing[collection] = set(ids) - existing
+    return missing
+
+# async variants of the read queries for backends with coroutine reads (see asyncstorage.py), running independent fetches concurrently
+async def getAllIngredientsAsync(db, token):
+    cached, ingredients = referenceCache.get(("ingredients",))
+    if cached:
+        return list(ingredients)
+
+    ingredients = await db.getAll("ingredients", token)
+    if ingredients == None:
+        raise Exception
+    ingredients = sorted(ingredients, key=lambda ingredient: ingredient["id"])
+
+    referenceCache.set(("ingredients",), ingredients)
+    return list(ingredients)
+
+async def getAllUnitsAsync(db, token):
+    cached, units = referenceCache.get(("units",))
+    if cached:
+        return list(units)
+
+    units = await db.getAll("units", token)
+    if units == None:
+        raise Exception
+    units = sorted(units, key=lambda unit: unit["id"])
 
-    itemQuantities = user["items"]
-    for itemQuantity in itemQuantities:
-        ingredient = getIngredient(db, token, itemQuantity["ingredientId"])
-        unit = getUnit(db, token, itemQuantity["unitId"])
-        quantity = itemQuantity["quantity"]
-        
-        itemAdded = False
-        for groceryItem in groceryList:
-            if groceryItem["ingredient"]["id"] == ingredient["id"] and groceryItem["unit"]["id"] == unit["id"]:
-                groceryItem["quantity"] += quantity
-                itemAdded = True
-                break
-
-        if not itemAdded:
-            newGroceryItem = { "ingredient": ingredient, "unit": unit, "quantity": quantity }
-            groceryList.append(newGroceryItem)
-
-    recipeIds = user["recipes"]
-    for recipeId in recipeIds:
-        recipe = getRecipe(db, token, recipeId)
-        ingredientQuantities = recipe["ingredients"]
-
-        for ingredientQuantity in ingredientQuantities:
-            ingredient = getIngredient(db, token, ingredientQuantity["ingredientId"])
-            unit = getUnit(db, token, ingredientQuantity["unitId"])
-            quantity = ingredientQuantity["quantity"]
-            
-            ingredientAdded = False
-            for groceryItem in groceryList:
-                if groceryItem["ingredient"]["id"] == ingredient["id"] and groceryItem["unit"]["id"] == unit["id"]:
-                    groceryItem["quantity"] += quantity
-                    ingredientAdded = True
-                    break
-
-            if not ingredientAdded:
-                newGroceryItem = { "ingredient": ingredient, "unit": unit, "quantity": quantity }
-                groceryList.append(newGroceryItem)
-
-    return groceryList 
+    referenceCache.set(("units",), units)
+    return list(units)
+
+async def getUserAsync(db, token, userId):
+    user = await db.getById("users", token, userId)
+    if user == None:
+        raise Exception
+    return user
+
+async def getRecipesByIdsAsync(db, token, recipeIds):
+    if not recipeIds:
+        return {}
+
+    # one range query when the ids are dense, otherwise a query per id, so far apart ids don't download every recipe between them
+    recipes = {recipe["id"]: recipe for recipe in await db.getByIds("recipes", token, sorted(set(recipeIds)))}
+
+    # if any requested recipe doesn't exist throw an exception
+    if any(recipeId not in recipes for recipeId in recipeIds):
+        raise Exception
+    return recipes
+
+async def getUserGroceryListAsync(db, token, userId):
+    totals = groceryViews.get(userId)
+    if totals != None:
+        ingredients, units = await asyncio.gather(getAllIngredientsAsync(db, token), getAllUnitsAsync(db, token))
+    else:
+        user = await getUserAsync(db, token, userId)
+        # the recipes, ingredients and units only depend on the user so they are fetched at the same time
+        recipes, ingredients, units = await asyncio.gather(getRecipesByIdsAsync(db, token, user.get("recipes", [])), getAllIngredientsAsync(db, token), getAllUnitsAsync(db, token))
+        totals = groceryViews.build(user, recipes)
+    return formatGroceryList(totals, {ingredient["id"]: ingredient for ingredient in ingredients}, {unit["id"]: unit for unit in units})
+
+async def getReferenceIdsAsync(db, token, collection):
+    cached, ids = referenceCache.get((collection, "ids"))
+    if cached:
+        return ids
+
+    try:
+        records = await (getAllIngredientsAsync(db, token) if collection == "ingredients" else getAllUnitsAsync(db, token))
+    except:
+        records = []
+    ids = frozenset(record["id"] for record in records)
+
+    referenceCache.set((collection, "ids"), ids)
+    return ids
+
+async def getMissingIdsAsync(db, token, references):
+    # every collection is checked at the same time
+    async def getMissing(collection, ids):
+        if collection in ["ingredients", "units"]:
+            existing = await getReferenceIdsAsync(db, token, collection)
+        else:
+            existing = await db.getExistingIds(collection, token, sorted(set(ids)))
+        return set(ids) - existing
+    missing = await asyncio.gather(*[getMissing(collection, ids) for collection, ids in references.items()])
+    return dict(zip(references, missing))
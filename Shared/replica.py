@@ -0,0 +1,316 @@
+import copy
+import http.client
+import importlib.util
+import json
+import logging
+import pathlib
+import threading
+import time
+import urllib.parse
+
+# the reference index and projection work the same as in the storage backends
+spec = importlib.util.spec_from_file_location('shared', str(pathlib.Path(__file__).parent.absolute()).replace("\\",'/') + '/storage.py')
+storage = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(storage)
+
+# in memory read replica of the Firebase collections, loaded once and kept current through the REST API's streaming (SSE) change feed
+# reads are answered from memory while the replica is synced and fresh, writes go to the wrapped backend and are applied locally too
+# changes arriving through the streams that weren't written through the replica are reported to onChange(collection, ids)
+class ReplicaBackend:
+    def __init__(self, backend, databaseUrl, getToken, collections = ["ingredients", "recipes", "units", "users"], maxStalenessSeconds = 75, resyncDelaySeconds = 1, onChange = None):
+        self.backend = backend
+        self.databaseUrl = databaseUrl.rstrip("/")
+        self.getToken = getToken
+        self.collections = collections
+        self.maxStalenessSeconds = maxStalenessSeconds
+        self.resyncDelaySeconds = resyncDelaySeconds
+        self.onChange = onChange
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.synced = {collection: threading.Event() for collection in collections}
+        # per collection: records by database key, the key of each id, reference index and time of the last stream event
+        self.records = {collection: {} for collection in collections}
+        self.keys = {collection: {} for collection in collections}
+        self.references = {collection: {} for collection in collections}
+        self.lastEvent = {collection: 0.0 for collection in collections}
+        # collections loaded at least once, and the records as they were before the event being applied by id
+        self.loaded = set()
+        self.touched = None
+        self.fallbackReads = 0
+        self.resyncs = 0
+        self.connections = {}
+        for collection in collections:
+            threading.Thread(target = self.follow, args = (collection,), daemon = True).start()
+
+    def waitUntilSynced(self, timeoutSeconds):
+        deadline = time.monotonic() + timeoutSeconds
+        return all(self.synced[collection].wait(max(0, deadline - time.monotonic())) for collection in self.collections)
+
+    def close(self):
+        self.stopped.set()
+        with self.lock:
+            connections = list(self.connections.values())
+        for connection in connections:
+            connection.close()
+
+    def stats(self):
+        now = time.monotonic()
+        with self.lock:
+            return {
+                "collections": {collection: {"synced": self.synced[collection].is_set(), "records": len(self.records[collection]), "stalenessSeconds": now - self.lastEvent[collection] if self.lastEvent[collection] else None} for collection in self.collections},
+                "fallbackReads": self.fallbackReads,
+                "resyncs": self.resyncs
+            }
+
+    #region change feed
+    def follow(self, collection):
+        # every (re)connect starts with the full collection, so a resync replaces whatever was missed while disconnected
+        while not self.stopped.is_set():
+            try:
+                connection, response = self.openStream(collection)
+                with self.lock:
+                    self.connections[collection] = connection
+                for event, data in readEvents(response):
+                    if event in ["put", "patch"]:
+                        self.applyEvent(collection, event, data["path"], data["data"])
+                    elif event == "keep-alive":
+                        with self.lock:
+                            self.lastEvent[collection] = time.monotonic()
+                    elif event in ["cancel", "auth_revoked"]:
+                        # reconnecting picks up the current token
+                        raise Exception(f"stream {event}")
+                raise Exception("stream closed")
+            except Exception as exception:
+                if self.stopped.is_set():
+                    return
+                logging.warning(f"Replica of {collection} lost its change stream ({exception}), resyncing")
+                with self.lock:
+                    self.synced[collection].clear()
+                    self.resyncs += 1
+                self.stopped.wait(self.resyncDelaySeconds)
+
+    def openStream(self, collection):
+        parameters = {"auth": self.getToken()} if self.getToken() else {}
+        url = f"{self.databaseUrl}/{collection}.json" + ("?" + urllib.parse.urlencode(parameters) if parameters else "")
+        # streams are redirected to the server holding the data, and a silent connection fails after the staleness bound
+        for redirect in range(5):
+            parts = urllib.parse.urlsplit(url)
+            connectionClass = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+            connection = connectionClass(parts.netloc, timeout = self.maxStalenessSeconds)
+            connection.request("GET", parts.path + ("?" + parts.query if parts.query else ""), headers = {"Accept": "text/event-stream"})
+            response = connection.getresponse()
+            if response.status in [301, 302, 303, 307, 308]:
+                url = urllib.parse.urljoin(url, response.getheader("Location"))
+                connection.close()
+                continue
+            if response.status != 200:
+                connection.close()
+                raise Exception(f"status {response.status}")
+            return connection, response
+        raise Exception("too many redirects")
+
+    def applyEvent(self, collection, event, path, data):
+        parts = [part for part in path.split("/") if part]
+        with self.lock:
+            self.touched = {}
+            if not parts and event == "put":
+                # the whole collection, list backed collections arrive as arrays with empty slots for deleted records
+                self.touched = self.getRecordsById(collection)
+                self.records[collection], self.keys[collection], self.references[collection] = {}, {}, {}
+                entries = enumerate(data) if isinstance(data, list) else (data or {}).items()
+                for key, record in entries:
+                    if record != None:
+                        self.setRecord(collection, str(key), record)
+                self.synced[collection].set()
+            elif event == "put":
+                self.setPath(collection, parts, data)
+            else:
+                # patch keys are paths relative to the event path
+                for childPath, value in data.items():
+                    self.setPath(collection, parts + [part for part in childPath.split("/") if part], value)
+            self.lastEvent[collection] = time.monotonic()
+            # events confirming writes already applied through the replica leave the records as they were (one arriving before its write
+            # returns is reported, which repeats the same update), and the initial load isn't a change
+            records, keys = self.records[collection], self.keys[collection]
+            changedIds = sorted(id for id, record in self.touched.items() if (records[keys[id]] if id in keys else None) != record) if collection in self.loaded else []
+            self.loaded.add(collection)
+            self.touched = None
+        if changedIds and self.onChange != None:
+            try:
+                self.onChange(collection, changedIds)
+            except:
+                logging.exception(f"Replica of {collection} failed to report changes to {changedIds}")
+
+    def setPath(self, collection, parts, value):
+        key = parts[0]
+        if len(parts) == 1:
+            self.setRecord(collection, key, value)
+            return
+        # nested changes are applied to a copy so records already handed to readers never change
+        record = copy.deepcopy(self.records[collection].get(key, {}))
+        node = record
+        for part in parts[1:-1]:
+            if isinstance(node, list):
+                node = node[int(part)]
+            else:
+                node = node.setdefault(part, {})
+        if isinstance(node, list):
+            node[int(parts[-1])] = value
+        elif value == None:
+            node.pop(parts[-1], None)
+        else:
+            node[parts[-1]] = value
+        self.setRecord(collection, key, record)
+
+    def setRecord(self, collection, key, record):
+        # keeps the id lookup and reference index in step with the records (a record of None removes the key)
+        oldRecord = self.records[collection].pop(key, None)
+        if self.touched != None:
+            # only stream events track what they change
+            if oldRecord != None and "id" in oldRecord:
+                self.touched.setdefault(oldRecord["id"], oldRecord)
+            if record != None and "id" in record:
+                otherKey = self.keys[collection].get(record["id"])
+                self.touched.setdefault(record["id"], self.records[collection].get(otherKey) if otherKey != None else None)
+        if oldRecord != None and "id" in oldRecord:
+            self.keys[collection].pop(oldRecord["id"], None)
+            self.indexRecord(collection, oldRecord, remove = True)
+        if record == None or "id" not in record:
+            if record != None:
+                self.records[collection][key] = record
+            return
+        # a record written through the replica is stored under a placeholder key until its change event brings the database key
+        otherKey = self.keys[collection].get(record["id"])
+        if otherKey != None and otherKey != key:
+            self.setRecord(collection, otherKey, None)
+        self.records[collection][key] = record
+        self.keys[collection][record["id"]] = key
+        self.indexRecord(collection, record)
+
+    def indexRecord(self, collection, record, remove = False):
+        index = self.references[collection]
+        for reference in storage.getReferences(collection, record):
+            ids = index.setdefault(reference, set())
+            if remove:
+                ids.discard(record["id"])
+            else:
+                ids.add(record["id"])
+    #endregion
+
+    #region reads
+    def isFresh(self, collection):
+        # callers hold the lock
+        fresh = collection in self.synced and self.synced[collection].is_set() and time.monotonic() - self.lastEvent[collection] <= self.maxStalenessSeconds
+        if not fresh:
+            self.fallbackReads += 1
+        return fresh
+
+    def getRecordsById(self, collection):
+        # callers hold the lock
+        return {id: self.records[collection][key] for id, key in self.keys[collection].items()}
+
+    def getAll(self, collection, token):
+        with self.lock:
+            if self.isFresh(collection):
+                return list(self.records[collection].values()) or None
+        return self.backend.getAll(collection, token)
+
+    def getById(self, collection, token, id):
+        with self.lock:
+            if self.isFresh(collection):
+                key = self.keys[collection].get(id)
+                return self.records[collection][key] if key != None else None
+        return self.backend.getById(collection, token, id)
+
+    def getByIdRange(self, collection, token, startId, endId):
+        with self.lock:
+            if self.isFresh(collection):
+                records = self.getRecordsById(collection)
+                return [records[id] for id in sorted(records) if startId <= id <= endId]
+        return self.backend.getByIdRange(collection, token, startId, endId)
+
+    def getExistingIds(self, collection, token, ids):
+        with self.lock:
+            if self.isFresh(collection):
+                return set(id for id in ids if id in self.keys[collection])
+        return self.backend.getExistingIds(collection, token, ids)
+
+    def getByIds(self, collection, token, ids):
+        with self.lock:
+            if self.isFresh(collection):
+                return [self.records[collection][self.keys[collection][id]] for id in ids if id in self.keys[collection]]
+        return self.backend.getByIds(collection, token, ids)
+
+    def getPage(self, collection, token, after, limit, filters, fields):
+        with self.lock:
+            if self.isFresh(collection):
+                records = self.getRecordsById(collection)
+                records = [records[id] for id in sorted(records) if (after == None or id > after) and all(records[id].get(field) == value for field, value in filters.items())]
+                return [storage.project(record, fields) for record in records[:limit]]
+        return self.backend.getPage(collection, token, after, limit, filters, fields)
+
+    def getReferencing(self, collection, token, field, value):
+        with self.lock:
+            if self.isFresh(collection):
+                return sorted(self.references[collection].get((field, storage.indexKey(value)), set()))
+        return self.backend.getReferencing(collection, token, field, value)
+    #endregion
+
+    #region writes
+    def indexReferences(self, token):
+        self.backend.indexReferences(token)
+
+    def add(self, collection, token, record):
+        self.backend.add(collection, token, record)
+        self.applyWrites(collection, [record], [])
+
+    def update(self, collection, token, id, fields):
+        record = self.backend.update(collection, token, id, fields)
+        self.applyWrites(collection, [record], [])
+        return record
+
+    def remove(self, collection, token, id):
+        self.backend.remove(collection, token, id)
+        self.applyWrites(collection, [], [id])
+
+    def batch(self, collection, token, creates, updates, deletes):
+        updatedRecords, missing = self.backend.batch(collection, token, creates, updates, deletes)
+        self.applyWrites(collection, creates + list(updatedRecords.values()), [id for id in deletes if id not in missing])
+        return updatedRecords, missing
+
+    def applyWrites(self, collection, records, deletedIds):
+        # successful writes are applied straight away so reads that follow them see them, the change events confirm them later
+        if collection not in self.records:
+            return
+        with self.lock:
+            for record in records:
+                # stored the way the database keeps it, which drops empty values
+                record = {field: value for field, value in record.items() if value not in [None, [], {}]}
+                self.setRecord(collection, self.keys[collection].get(record["id"], f"~{record['id']}"), record)
+            for id in deletedIds:
+                if id in self.keys[collection]:
+                    self.setRecord(collection, self.keys[collection][id], None)
+
+    def getNode(self, path, token):
+        return self.backend.getNode(path, token)
+
+    def transact(self, path, token, update):
+        return self.backend.transact(path, token, update)
+    #endregion
+
+def readEvents(response):
+    # server-sent events: "event:" and "data:" lines, each event ended by a blank line
+    event, data = None, []
+    while True:
+        line = response.readline()
+        if not line:
+            return
+        line = line.decode("utf-8").rstrip("\r\n")
+        if line == "":
+            if event != None:
+                yield event, json.loads("\n".join(data)) if data else None
+            event, data = None, []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
@@ -0,0 +1,89 @@
+import gzip
+import json
+import zlib
+from flask import make_response, request
+
+# response encoders and compression for the API, each backed by an optional faster library when installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+def encodeJson(data):
+    if orjson != None:
+        return orjson.dumps(data, option = orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, separators = (",", ":")).encode("utf-8")
+
+def outputJson(data, code, headers = None):
+    # always end the body with a new line like flask_restful does
+    response = make_response(encodeJson(data) + b"\n", code)
+    response.headers.extend(headers or {})
+    response.mimetype = "application/json"
+    return response
+
+def outputMsgpack(data, code, headers = None):
+    response = make_response(msgpack.packb(data), code)
+    response.headers.extend(headers or {})
+    response.mimetype = "application/msgpack"
+    return response
+
+def wantsMsgpack():
+    return msgpack != None and request.accept_mimetypes.best_match(["application/json", "application/msgpack"]) == "application/msgpack"
+
+def registerRepresentations(api):
+    # json stays the default, MessagePack is only used when the client asks for it
+    api.representations = {"application/json": outputJson}
+    if msgpack != None:
+        api.representations["application/msgpack"] = outputMsgpack
+
+def getEncodings():
+    return (["br"] if brotli != None else []) + ["gzip"]
+
+def compressBody(data, encoding):
+    if encoding == "br":
+        # a low quality keeps brotli fast enough for dynamic responses
+        return brotli.compress(data, quality = 5)
+    return gzip.compress(data, compresslevel = 6)
+
+def compressStream(chunks, encoding):
+    compressor = brotli.Compressor(quality = 5) if encoding == "br" else zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        chunk = compressor.process(chunk) if encoding == "br" else compressor.compress(chunk)
+        if chunk:
+            yield chunk
+    yield compressor.finish() if encoding == "br" else compressor.flush()
+
+def compressResponse(response, minBytes):
+    # compress bodies of at least minBytes (streamed bodies always) with the best encoding the client accepts
+    if response.status_code in [204, 304] or response.direct_passthrough or "Content-Encoding" in response.headers:
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = request.accept_encodings.best_match(getEncodings())
+    if encoding == None:
+        return response
+
+    if response.is_streamed:
+        response.response = compressStream(response.response, encoding)
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < minBytes:
+            return response
+        response.set_data(compressBody(data, encoding))
+    response.headers["Content-Encoding"] = encoding
+
+    # the compressed body is no longer byte for byte the entity the validator was issued for
+    etag, weak = response.get_etag()
+    if etag != None and not weak:
+        response.set_etag(etag, weak = True)
+    return response
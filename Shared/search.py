@@ -0,0 +1,188 @@
+import bisect
+import heapq
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter
+
+# in process inverted index over recipe names, instructions and ingredient names, kept current by the recipe and ingredient writes
+
+# matches in a name count more than matches in the ingredients, and those more than matches in the instructions
+FIELD_WEIGHTS = {"name": 3.0, "ingredients": 2.0, "instructions": 1.0}
+# a query word also matches longer words starting with it, scored lower than the word itself
+PREFIX_WEIGHT = 0.5
+MIN_PREFIX_LENGTH = 2
+# prefixes matching more terms than this only expand to the terms in the most recipes
+MAX_PREFIX_TERMS = 50
+STOP_WORDS = {"a", "an", "and", "at", "by", "for", "in", "into", "is", "it", "of", "on", "or", "the", "to", "with"}
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+def tokenize(text, stopWords = STOP_WORDS):
+    # lower case words without accents, e.g. "Crème Brûlée" -> ["creme", "brulee"]
+    text = text.lower()
+    if not text.isascii():
+        text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+    return [word for word in WORD_PATTERN.findall(text) if word not in stopWords]
+
+class RecipeSearchIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.built = False
+        # recipe records by id, the weighted term frequencies of each recipe, and term: {recipeId: weighted term frequency}
+        self.recipes = {}
+        self.recipeTerms = {}
+        self.postings = {}
+        # every indexed term in order for prefix lookups
+        self.terms = []
+        # ingredient name terms by id and the recipes using each ingredient, so renaming an ingredient reindexes only those recipes
+        self.ingredientTerms = {}
+        self.ingredientRecipes = {}
+        self.searches = 0
+        self.updates = 0
+        self.rebuilds = 0
+
+    def isBuilt(self):
+        with self.lock:
+            return self.built
+
+    def build(self, recipes, ingredients):
+        with self.lock:
+            self.recipes, self.recipeTerms, self.postings, self.terms = {}, {}, {}, []
+            self.ingredientTerms = {ingredient["id"]: tokenize(ingredient.get("name", "")) for ingredient in ingredients}
+            self.ingredientRecipes = {}
+            for recipe in recipes:
+                self.indexRecipe(recipe, sortTerms = False)
+            self.terms = sorted(self.postings)
+            self.built = True
+            self.rebuilds += 1
+
+    def updateRecipe(self, recipe):
+        # adds or replaces a recipe, writes made before the index is built are picked up when it is
+        with self.lock:
+            if not self.built:
+                return
+            self.unindexRecipe(recipe["id"])
+            self.indexRecipe(recipe)
+            self.updates += 1
+
+    def removeRecipe(self, recipeId):
+        with self.lock:
+            if not self.built:
+                return
+            self.unindexRecipe(recipeId)
+            self.updates += 1
+
+    def updateIngredient(self, ingredient):
+        with self.lock:
+            if not self.built:
+                return
+            terms = tokenize(ingredient.get("name", ""))
+            if self.ingredientTerms.get(ingredient["id"]) == terms:
+                return
+            self.ingredientTerms[ingredient["id"]] = terms
+            for recipeId in sorted(self.ingredientRecipes.get(ingredient["id"], set())):
+                recipe = self.recipes[recipeId]
+                self.unindexRecipe(recipeId)
+                self.indexRecipe(recipe)
+            self.updates += 1
+
+    def removeIngredient(self, ingredientId):
+        # ingredients in use can't be deleted so no recipe needs reindexing
+        with self.lock:
+            self.ingredientTerms.pop(ingredientId, None)
+
+    def indexRecipe(self, recipe, sortTerms = True):
+        # callers hold the lock, a full build sorts the terms once at the end instead
+        ingredientIds = set(quantity["ingredientId"] for quantity in recipe.get("ingredients", []))
+        fields = {
+            "name": tokenize(recipe.get("name", "")),
+            "ingredients": [term for ingredientId in ingredientIds for term in self.ingredientTerms.get(ingredientId, [])],
+            "instructions": tokenize(" ".join(recipe.get("instructions", [])))
+        }
+        # repeated words add less and less (1 + log of the count)
+        weights = {}
+        for field, terms in fields.items():
+            for term, count in Counter(terms).items():
+                weights[term] = weights.get(term, 0.0) + FIELD_WEIGHTS[field] * (1 + math.log(count))
+        for term, weight in weights.items():
+            if term not in self.postings:
+                self.postings[term] = {}
+                if sortTerms:
+                    bisect.insort(self.terms, term)
+            self.postings[term][recipe["id"]] = weight
+        for ingredientId in ingredientIds:
+            self.ingredientRecipes.setdefault(ingredientId, set()).add(recipe["id"])
+        self.recipes[recipe["id"]] = recipe
+        self.recipeTerms[recipe["id"]] = weights
+
+    def unindexRecipe(self, recipeId):
+        # callers hold the lock
+        recipe = self.recipes.pop(recipeId, None)
+        if recipe == None:
+            return
+        for term in self.recipeTerms.pop(recipeId):
+            postings = self.postings[term]
+            postings.pop(recipeId, None)
+            if not postings:
+                del self.postings[term]
+                del self.terms[bisect.bisect_left(self.terms, term)]
+        for quantity in recipe.get("ingredients", []):
+            recipeIds = self.ingredientRecipes.get(quantity["ingredientId"], set())
+            recipeIds.discard(recipeId)
+            if not recipeIds:
+                self.ingredientRecipes.pop(quantity["ingredientId"], None)
+
+    def expand(self, word):
+        # callers hold the lock, the indexed terms a query word matches with how much each counts
+        if len(word) < MIN_PREFIX_LENGTH:
+            return [(word, 1.0)] if word in self.postings else []
+        start = bisect.bisect_left(self.terms, word)
+        end = bisect.bisect_left(self.terms, word + "\x7f")
+        terms = self.terms[start:end]
+        if len(terms) > MAX_PREFIX_TERMS:
+            terms = set(heapq.nlargest(MAX_PREFIX_TERMS, terms, key = lambda term: len(self.postings[term]))) | ({word} if word in self.postings else set())
+        return [(term, 1.0 if term == word else PREFIX_WEIGHT) for term in terms]
+
+    def search(self, query, limit):
+        # recipes matching every query word, best first (ties by id), scored by the words' weighted frequency times their rarity
+        # a last word not followed by anything may still be being typed (e.g. "to" on the way to "tomato"), so stop words are only dropped from the complete words
+        words = tokenize(query, stopWords = set())
+        complete = words[:-1] if query[-1:].isalnum() else words
+        words = list(dict.fromkeys([word for word in complete if word not in STOP_WORDS] + words[len(complete):]))
+        with self.lock:
+            self.searches += 1
+            expansions = [self.expand(word) for word in words]
+            # unless it starts an indexed word, in which case it is dropped like the others
+            if words and words[-1] in STOP_WORDS and not expansions[-1]:
+                expansions.pop()
+            if not expansions:
+                return []
+            # the most selective words go first so the others only score the recipes still matching
+            expansions.sort(key = lambda terms: sum(len(self.postings[term]) for term, termWeight in terms))
+            scores = None
+            for terms in expansions:
+                wordScores = {}
+                for term, termWeight in terms:
+                    postings = self.postings[term]
+                    factor = math.log(1 + len(self.recipes) / len(postings)) * termWeight
+                    # walk whichever of the term's recipes and the recipes still matching is smaller
+                    if scores == None:
+                        matches = postings.items()
+                    elif len(postings) <= len(scores):
+                        matches = [(recipeId, weight) for recipeId, weight in postings.items() if recipeId in scores]
+                    else:
+                        matches = [(recipeId, postings[recipeId]) for recipeId in scores if recipeId in postings]
+                    for recipeId, weight in matches:
+                        score = factor * weight
+                        if score > wordScores.get(recipeId, 0.0):
+                            wordScores[recipeId] = score
+                scores = wordScores if scores == None else {recipeId: score + wordScores[recipeId] for recipeId, score in scores.items() if recipeId in wordScores}
+                if not scores:
+                    return []
+            best = heapq.nsmallest(limit, scores.items(), key = lambda entry: (-entry[1], entry[0]))
+            return [self.recipes[recipeId] for recipeId, score in best]
+
+    def stats(self):
+        with self.lock:
+            return {"built": self.built, "recipes": len(self.recipes), "terms": len(self.terms), "searches": self.searches, "updates": self.updates, "rebuilds": self.rebuilds}
@@ -0,0 +1,383 @@
+import base64
+import json
+import sqlite3
+import threading
+
+# foreign keys of each collection as (field, extractor) used to index references
+FOREIGN_KEYS = {
+    "recipes": [
+        ("ingredientId", lambda recipe: [ingredient["ingredientId"] for ingredient in recipe.get("ingredients", [])]),
+        ("unitId", lambda recipe: [ingredient["unitId"] for ingredient in recipe.get("ingredients", [])])
+    ],
+    "users": [
+        ("recipeId", lambda user: user.get("recipes", [])),
+        ("ingredientId", lambda user: [item["ingredientId"] for item in user.get("items", [])]),
+        ("unitId", lambda user: [item["unitId"] for item in user.get("items", [])])
+    ]
+}
+
+# lookup keys are indexed the same way so records can be found by value without scanning the collection
+LOOKUP_KEYS = {
+    "users": [
+        ("email", lambda user: [user["email"]] if user.get("email") else [])
+    ]
+}
+
+# filtered Firebase pages are read in id order at least this many records at a time, since only id is indexed in the database rules
+FILTER_PAGE_SIZE = 100
+
+def getIndexedFields(collection):
+    return FOREIGN_KEYS.get(collection, []) + LOOKUP_KEYS.get(collection, [])
+
+def indexKey(value):
+    # string values are encoded since Firebase keys can't contain characters like "." or "/"
+    if isinstance(value, str):
+        return base64.urlsafe_b64encode(value.encode("utf-8")).decode("ascii").rstrip("=")
+    return value
+
+def getReferences(collection, record):
+    references = set()
+    for field, extract in getIndexedFields(collection):
+        for value in extract(record):
+            references.add((field, indexKey(value)))
+    return references
+
+def project(record, fields):
+    if fields == None:
+        return record
+    return {field: record[field] for field in fields if field in record}
+
+def getReferenceUpdates(collection, id, oldRecord, newRecord):
+    # multi-location update paths that move a record's entries in the references/<collection>/<field>/<value>/<id> index
+    oldReferences = getReferences(collection, oldRecord) if oldRecord != None else set()
+    newReferences = getReferences(collection, newRecord) if newRecord != None else set()
+    updates = {}
+    for field, value in oldReferences - newReferences:
+        updates[f"references/{collection}/{field}/{value}/{id}"] = None
+    for field, value in newReferences - oldReferences:
+        updates[f"references/{collection}/{field}/{value}/{id}"] = True
+    return updates
+
+# storage backend for the Firebase Realtime Database through pyrebase
+class FirebaseBackend:
+    def __init__(self, firebase):
+        self.firebase = firebase
+
+    def child(self, *path):
+        # pyrebase database objects keep the query being built as state, so each query gets its own
+        return self.firebase.database().child(*path)
+
+    def getAll(self, collection, token):
+        result = self.child(collection).get(token)
+        records = result.val()
+        if records == None:
+            return None
+        if isinstance(records, dict):
+            return list(records.values())
+        # list backed collections leave empty slots behind deleted records
+        return [record for record in records if record != None]
+
+    def getById(self, collection, token, id):
+        result = self.child(collection).order_by_child("id").equal_to(id).get(token)
+        if not result.val():
+            return None
+        return result[0].val()
+
+    def getByIdRange(self, collection, token, startId, endId):
+        result = self.child(collection).order_by_child("id").start_at(startId).end_at(endId).get(token)
+        return [record.val() for record in result.each() or []]
+
+    def getExistingIds(self, collection, token, ids):
+        return set(self.getEntries(collection, token, ids))
+
+    def getByIds(self, collection, token, ids):
+        return [record for key, record in self.getEntries(collection, token, ids).values()]
+
+    def getPage(self, collection, token, after, limit, filters, fields):
+        # the database rules only index id, so pages are read in id order and filters applied after the transfer,
+        # reading further pages (at least FILTER_PAGE_SIZE records at a time when filtering) until enough records match or the collection ends
+        records = []
+        pageSize = max(limit, FILTER_PAGE_SIZE) if limit != None and filters else limit
+        while True:
+            query = self.child(collection).order_by_child("id")
+            if after != None:
+                query = query.start_at(after + 1)
+            if pageSize != None:
+                query = query.limit_to_first(pageSize)
+            page = [record.val() for record in query.get(token).each() or []]
+            records += [record for record in page if all(record.get(field) == value for field, value in filters.items())]
+            if pageSize == None or len(records) >= limit or len(page) < pageSize:
+                break
+            after = page[-1]["id"]
+        if limit != None:
+            records = records[:limit]
+        # the REST API has no field selection so projection happens after the transfer
+        return [project(record, fields) for record in records]
+
+    def getReferencing(self, collection, token, field, value):
+        ids = self.child("references", collection, field, indexKey(value)).shallow().get(token).val()
+        return sorted(int(id) for id in ids or [])
+
+    def indexReferences(self, token):
+        # build the index entries of collections with fields that were indexed after the database was created
+        updates = {}
+        for collection in set(FOREIGN_KEYS) | set(LOOKUP_KEYS):
+            indexedFields = self.child("references", collection).shallow().get(token).val() or {}
+            if all(field in indexedFields for field, extract in getIndexedFields(collection)):
+                continue
+            for record in self.getAll(collection, token) or []:
+                updates.update(getReferenceUpdates(collection, record["id"], None, record))
+        if updates:
+            self.firebase.database().update(updates, token)
+
+    def getEntry(self, collection, token, id):
+        result = self.child(collection).order_by_child("id").equal_to(id).get(token)
+        if not result.val():
+            raise Exception
+        return result[0].key(), result[0].val()
+
+    def getEntries(self, collection, token, ids):
+        # (key, record) of each existing id: one range query when the ids are dense, otherwise an indexed query per id
+        if not ids:
+            return {}
+        entries = {}
+        if max(ids) - min(ids) < 2 * len(ids):
+            result = self.child(collection).order_by_child("id").start_at(min(ids)).end_at(max(ids)).get(token)
+            entries = {record.val()["id"]: (record.key(), record.val()) for record in result.each() or []}
+        else:
+            for id in set(ids):
+                result = self.child(collection).order_by_child("id").equal_to(id).get(token)
+                if result.val():
+                    entries[id] = (result[0].key(), result[0].val())
+        return {id: entries[id] for id in ids if id in entries}
+
+    # writes update the record and its reference index entries together in one multi-location update
+    def add(self, collection, token, record):
+        database = self.firebase.database()
+        updates = {collection + "/" + database.generate_key(): record}
+        updates.update(getReferenceUpdates(collection, record["id"], None, record))
+        database.update(updates, token)
+
+    def update(self, collection, token, id, fields):
+        # if record doesn't exist throw an exception
+        key, record = self.getEntry(collection, token, id)
+        updates = {collection + "/" + key + "/" + field: value for field, value in fields.items()}
+        updatedRecord = dict(record, **fields)
+        updates.update(getReferenceUpdates(collection, id, record, updatedRecord))
+        self.firebase.database().update(updates, token)
+        return updatedRecord
+
+    def remove(self, collection, token, id):
+        # if record doesn't exist throw an exception
+        key, record = self.getEntry(collection, token, id)
+        updates = {collection + "/" + key: None}
+        updates.update(getReferenceUpdates(collection, id, record, None))
+        self.firebase.database().update(updates, token)
+
+    def batch(self, collection, token, creates, updates, deletes):
+        # every create, update and delete is applied in one atomic multi-location update
+        # returns the updated records by id and the update and delete ids that don't exist
+        database = self.firebase.database()
+        entries = self.getEntries(collection, token, list(updates) + list(deletes))
+        paths = {}
+        for record in creates:
+            paths[collection + "/" + database.generate_key()] = record
+            paths.update(getReferenceUpdates(collection, record["id"], None, record))
+        updatedRecords = {}
+        for id, fields in updates.items():
+            if id in entries:
+                key, record = entries[id]
+                updatedRecords[id] = dict(record, **fields)
+                paths.update({collection + "/" + key + "/" + field: value for field, value in fields.items()})
+                paths.update(getReferenceUpdates(collection, id, record, updatedRecords[id]))
+        for id in deletes:
+            if id in entries:
+                key, record = entries[id]
+                paths[collection + "/" + key] = None
+                paths.update(getReferenceUpdates(collection, id, record, None))
+        if paths:
+            database.update(paths, token)
+        return updatedRecords, set(list(updates) + list(deletes)) - set(entries)
+
+    def getNode(self, path, token):
+        return self.child(path).get(token).val()
+
+    def transact(self, path, token, update, retries = 25):
+        # optimistic transaction: read the node with its ETag and only write it back if it is unchanged
+        database = self.firebase.database()
+        for attempt in range(retries):
+            headers = database.build_headers(token)
+            headers['X-Firebase-ETag'] = 'true'
+            response = database.requests.get(database.check_token(database.database_url, path, token), headers = headers)
+            response.raise_for_status()
+            value, result = update(response.json())
+
+            headers = database.build_headers(token)
+            headers['if-match'] = response.headers['ETag']
+            response = database.requests.put(database.check_token(database.database_url, path, token), headers = headers, data = json.dumps(value).encode("utf-8"))
+            # a precondition failure means another writer changed the node first so try again
+            if response.status_code != 412:
+                response.raise_for_status()
+                return result
+        raise Exception
+
+# embedded storage backend on SQLite (use ":memory:" for a purely in-memory database)
+class SqliteBackend:
+    def __init__(self, path = ":memory:"):
+        self.connection = sqlite3.connect(path, check_same_thread = False)
+        # reentrant so transaction updates can read records through the backend
+        self.lock = threading.RLock()
+        with self.lock, self.connection:
+            # records are indexed by (collection, id) and foreign key references by (collection, field, value)
+            self.connection.execute("CREATE TABLE IF NOT EXISTS records (collection TEXT NOT NULL, id INTEGER NOT NULL, data TEXT NOT NULL, PRIMARY KEY (collection, id)) WITHOUT ROWID")
+            # values are ids or encoded lookup keys (see indexKey), refs tables created with an INTEGER value column are dropped and rebuilt by indexReferences
+            if any(row[1] == "value" and row[2] == "INTEGER" for row in self.connection.execute("PRAGMA table_info(refs)")):
+                self.connection.execute("DROP TABLE refs")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS refs (collection TEXT NOT NULL, field TEXT NOT NULL, value TEXT NOT NULL, id INTEGER NOT NULL, PRIMARY KEY (collection, field, value, id)) WITHOUT ROWID")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS refsByRecord ON refs (collection, id)")
+            # standalone JSON values such as id allocators are kept by path
+            self.connection.execute("CREATE TABLE IF NOT EXISTS nodes (path TEXT PRIMARY KEY, data TEXT NOT NULL) WITHOUT ROWID")
+
+    def isEmpty(self):
+        with self.lock:
+            return self.connection.execute("SELECT 1 FROM records LIMIT 1").fetchone() == None
+
+    def importData(self, data):
+        # load a Firebase JSON export of the form {collection: list or dict of records}
+        for collection, records in data.items():
+            if isinstance(records, dict):
+                records = records.values()
+            for record in records:
+                if record != None:
+                    self.add(collection, None, record)
+
+    def getAll(self, collection, token):
+        with self.lock:
+            rows = self.connection.execute("SELECT data FROM records WHERE collection = ? ORDER BY id", (collection,)).fetchall()
+        if not rows:
+            return None
+        return [json.loads(row[0]) for row in rows]
+
+    def getById(self, collection, token, id):
+        with self.lock:
+            row = self.connection.execute("SELECT data FROM records WHERE collection = ? AND id = ?", (collection, id)).fetchone()
+        if row == None:
+            return None
+        return json.loads(row[0])
+
+    def getByIdRange(self, collection, token, startId, endId):
+        with self.lock:
+            rows = self.connection.execute("SELECT data FROM records WHERE collection = ? AND id BETWEEN ? AND ? ORDER BY id", (collection, startId, endId)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def getExistingIds(self, collection, token, ids):
+        with self.lock:
+            rows = self.connection.execute("SELECT id FROM records WHERE collection = ? AND id IN (" + ", ".join("?" for id in ids) + ")", [collection] + list(ids)).fetchall()
+        return set(row[0] for row in rows)
+
+    def getByIds(self, collection, token, ids):
+        with self.lock:
+            rows = self.connection.execute("SELECT data FROM records WHERE collection = ? AND id IN (" + ", ".join("?" for id in ids) + ") ORDER BY id", [collection] + list(ids)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def indexReferences(self, token):
+        # the refs table is maintained on every write, so only fields indexed after the database was created need building
+        with self.lock, self.connection:
+            for collection in set(FOREIGN_KEYS) | set(LOOKUP_KEYS):
+                indexedFields = set(row[0] for row in self.connection.execute("SELECT DISTINCT field FROM refs WHERE collection = ?", (collection,)))
+                if all(field in indexedFields for field, extract in getIndexedFields(collection)):
+                    continue
+                for row in self.connection.execute("SELECT data FROM records WHERE collection = ?", (collection,)).fetchall():
+                    self.writeReferences(collection, json.loads(row[0]))
+
+    def getPage(self, collection, token, after, limit, filters, fields):
+        # filters, cursor, limit and projection all run inside the query
+        columns = "data" if fields == None else "json_object(" + ", ".join("?, json_extract(data, ?)" for field in fields) + ")"
+        parameters = [] if fields == None else [parameter for field in fields for parameter in (field, "$." + field)]
+        sql = "SELECT " + columns + " FROM records WHERE collection = ?"
+        parameters.append(collection)
+        if after != None:
+            sql += " AND id > ?"
+            parameters.append(after)
+        for field, value in filters.items():
+            sql += " AND json_extract(data, ?) = ?"
+            parameters.extend(["$." + field, value])
+        sql += " ORDER BY id"
+        if limit != None:
+            sql += " LIMIT ?"
+            parameters.append(limit)
+        with self.lock:
+            rows = self.connection.execute(sql, parameters).fetchall()
+        # projected fields missing from a record come back as null
+        return [{field: value for field, value in json.loads(row[0]).items() if fields == None or value != None} for row in rows]
+
+    def getReferencing(self, collection, token, field, value):
+        with self.lock:
+            rows = self.connection.execute("SELECT id FROM refs WHERE collection = ? AND field = ? AND value = ? ORDER BY id", (collection, field, indexKey(value))).fetchall()
+        return [row[0] for row in rows]
+
+    def writeRecord(self, collection, record):
+        self.connection.execute("INSERT OR REPLACE INTO records (collection, id, data) VALUES (?, ?, ?)", (collection, record["id"], json.dumps(record)))
+        self.writeReferences(collection, record)
+
+    def writeReferences(self, collection, record):
+        self.connection.execute("DELETE FROM refs WHERE collection = ? AND id = ?", (collection, record["id"]))
+        self.connection.executemany("INSERT INTO refs (collection, field, value, id) VALUES (?, ?, ?, ?)", [(collection, field, value, record["id"]) for field, value in getReferences(collection, record)])
+
+    def add(self, collection, token, record):
+        with self.lock, self.connection:
+            self.writeRecord(collection, record)
+
+    def update(self, collection, token, id, fields):
+        with self.lock, self.connection:
+            row = self.connection.execute("SELECT data FROM records WHERE collection = ? AND id = ?", (collection, id)).fetchone()
+            # if record doesn't exist throw an exception
+            if row == None:
+                raise Exception
+            record = json.loads(row[0])
+            record.update(fields)
+            self.writeRecord(collection, record)
+            return record
+
+    def remove(self, collection, token, id):
+        with self.lock, self.connection:
+            # if record doesn't exist throw an exception
+            if self.connection.execute("DELETE FROM records WHERE collection = ? AND id = ?", (collection, id)).rowcount == 0:
+                raise Exception
+            self.connection.execute("DELETE FROM refs WHERE collection = ? AND id = ?", (collection, id))
+
+    def batch(self, collection, token, creates, updates, deletes):
+        with self.lock, self.connection:
+            for record in creates:
+                self.writeRecord(collection, record)
+            updatedRecords = {}
+            missing = set()
+            for id, fields in updates.items():
+                row = self.connection.execute("SELECT data FROM records WHERE collection = ? AND id = ?", (collection, id)).fetchone()
+                if row == None:
+                    missing.add(id)
+                    continue
+                updatedRecords[id] = dict(json.loads(row[0]), **fields)
+                self.writeRecord(collection, updatedRecords[id])
+            for id in deletes:
+                if self.connection.execute("DELETE FROM records WHERE collection = ? AND id = ?", (collection, id)).rowcount == 0:
+                    missing.add(id)
+                self.connection.execute("DELETE FROM refs WHERE collection = ? AND id = ?", (collection, id))
+            return updatedRecords, missing
+
+    def getNode(self, path, token):
+        with self.lock:
+            row = self.connection.execute("SELECT data FROM nodes WHERE path = ?", (path,)).fetchone()
+        if row == None:
+            return None
+        return json.loads(row[0])
+
+    def transact(self, path, token, update):
+        with self.lock, self.connection:
+            row = self.connection.execute("SELECT data FROM nodes WHERE path = ?", (path,)).fetchone()
+            value, result = update(json.loads(row[0]) if row != None else None)
+            if value == None:
+                self.connection.execute("DELETE FROM nodes WHERE path = ?", (path,))
+            else:
+                self.connection.execute("INSERT OR REPLACE INTO nodes (path, data) VALUES (?, ?)", (path, json.dumps(value)))
+            return result
@@ -0,0 +1,67 @@
+import hmac
+import json
+import logging
+import threading
+import requests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from apscheduler.schedulers.background import BackgroundScheduler
+
+# holds the Firebase service account token for every worker so the account is signed into and refreshed once
+class TokenBroker:
+    def __init__(self, auth, email, password, refreshMinutes = 30):
+        self.auth = auth
+        self.lock = threading.Lock()
+        # left unauthenticated when no account is configured, e.g. for local emulators
+        self.user = auth.sign_in_with_email_and_password(email, password) if email else {'idToken': None}
+        self.sched = BackgroundScheduler(daemon=True)
+        if email:
+            self.sched.add_job(self.refreshToken, 'interval', minutes = refreshMinutes)
+        self.sched.start()
+
+    def refreshToken(self):
+        with self.lock:
+            refreshToken = self.user['refreshToken']
+        user = self.auth.refresh(refreshToken)
+        with self.lock:
+            self.user = user
+        logging.info("Token broker refreshed the service account token")
+
+    def token(self):
+        with self.lock:
+            return self.user['idToken']
+
+class TokenBrokerHandler(BaseHTTPRequestHandler):
+    broker = None
+    secret = ""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        # workers prove they were started by the launcher with the secret it handed them
+        if self.path != "/token" or not hmac.compare_digest(self.headers.get("X-Token-Broker-Secret", ""), self.secret):
+            self.send_response(403)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = json.dumps({"idToken": self.broker.token()}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def startTokenBroker(broker, secret, port = 0):
+    # only reachable from the local machine
+    handler = type("Handler", (TokenBrokerHandler,), {"broker": broker, "secret": secret})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    return server
+
+def fetchToken(brokerUrl, secret):
+    # returns the current token in the same shape as a pyrebase sign in
+    response = requests.get(brokerUrl + "/token", headers = {"X-Token-Broker-Secret": secret}, timeout = 10)
+    response.raise_for_status()
+    return {'idToken': response.json()['idToken']}
@@ -0,0 +1,100 @@
+import copy
+
+# declarative request body validation: schemas are declared once and compiled into validator functions
+
+# rule keys:
+#   type      expected python type (checked exactly, so bools aren't accepted as ints)
+#   required  the field must be present and not null
+#   nonEmpty  the value must not be empty (e.g. "" or [])
+#   default   value used when an optional field is missing
+#   items     rule applied to every element of a list
+#   fields    schema applied to a dict
+#   exists    collection the value must be the id of, checked afterwards in one lookup per collection
+TYPE_NAMES = {dict: "dict", int: "int", list: "list", str: "str"}
+
+def compileRule(rule):
+    expectedType = rule["type"]
+    typeName = TYPE_NAMES[expectedType]
+    nonEmpty = rule.get("nonEmpty", False)
+    exists = rule.get("exists")
+    validateItem = compileRule(rule["items"]) if "items" in rule else None
+    validateFields = compileFields(rule["fields"]) if "fields" in rule else None
+
+    def validate(value, path, errors, references):
+        if type(value) != expectedType:
+            errors.append({"field": path, "error": typeName})
+            return
+        if nonEmpty and not value:
+            errors.append({"field": path, "error": "not empty"})
+            return
+        if validateItem != None:
+            for index, item in enumerate(value):
+                validateItem(item, f"{path}[{index}]", errors, references)
+        if validateFields != None:
+            validateFields(value, path, errors, references)
+        if exists != None:
+            references.setdefault(exists, []).append((path, value))
+    return validate
+
+def compileFields(schema):
+    fields = [(field, rule.get("required", False), compileRule(rule)) for field, rule in schema.items()]
+
+    def validate(value, path, errors, references):
+        for field, required, validateField in fields:
+            fieldPath = f"{path}.{field}" if path else field
+            fieldValue = value.get(field)
+            if fieldValue == None:
+                if required:
+                    errors.append({"field": fieldPath, "error": "required"})
+                continue
+            validateField(fieldValue, fieldPath, errors, references)
+    return validate
+
+def compileSchema(schema):
+    validateFields = compileFields(schema)
+    defaults = {field: rule["default"] for field, rule in schema.items() if "default" in rule}
+
+    def validate(body):
+        # returns the body's schema fields with defaults filled in, a list of errors and the ids to check per collection
+        errors = []
+        references = {}
+        if type(body) != dict:
+            return None, [{"field": "", "error": "dict"}], references
+        validateFields(body, "", errors, references)
+        values = {field: body[field] if body.get(field) != None else copy.copy(defaults.get(field)) for field in schema}
+        return values, errors, references
+    return validate
+
+def formatErrors(errors):
+    return "Please fix the following values: " + ", ".join(f"{error['field']} ({error['error']})" if error['field'] else f"body ({error['error']})" for error in errors)
+
+QUANTITY_SCHEMA = {
+    "ingredientId": {"type": int, "required": True, "exists": "ingredients"},
+    "unitId": {"type": int, "required": True, "exists": "units"},
+    "quantity": {"type": int, "required": True}
+}
+
+INGREDIENT_SCHEMA = {
+    "name": {"type": str, "required": True, "nonEmpty": True},
+    "image_url": {"type": str, "default": ""}
+}
+
+RECIPE_SCHEMA = {
+    "ingredients": {"type": list, "required": True, "nonEmpty": True, "items": {"type": dict, "fields": QUANTITY_SCHEMA}},
+    "instructions": {"type": list, "required": True, "items": {"type": str}},
+    "name": {"type": str, "required": True, "nonEmpty": True},
+    "calories": {"type": int, "default": -1},
+    "image_url": {"type": str, "default": ""},
+    "time": {"type": int, "default": -1}
+}
+
+USER_SCHEMA = {
+    "email": {"type": str, "required": True, "nonEmpty": True},
+    "items": {"type": list, "default": [], "items": {"type": dict, "fields": QUANTITY_SCHEMA}},
+    "name": {"type": str, "required": True, "nonEmpty": True},
+    "recipes": {"type": list, "default": [], "items": {"type": int, "exists": "recipes"}}
+}
+
+validateIngredient = compileSchema(INGREDIENT_SCHEMA)
+validateRecipe = compileSchema(RECIPE_SCHEMA)
+validateUser = compileSchema(USER_SCHEMA)
@@ -0,0 +1,65 @@
+import argparse
+import configparser
+import importlib.util
+import os
+import pathlib
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+parentDir = str(pathlib.Path(__file__).parent.parent.absolute()).replace("\\",'/')
+
+# the benchmark's dataset, Firebase stand-in and API loader
+spec = importlib.util.spec_from_file_location('benchmark', parentDir + '/Benchmarks/benchmark.py')
+benchmark = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(benchmark)
+
+class ReadReplicaStartupTest(unittest.TestCase):
+    def test_change_during_startup_is_applied(self):
+        args = argparse.Namespace(backend = "firebase", ingredients = 10, units = 3, recipes = 10, users = 3, ingredients_per_recipe = 3, recipes_per_user = 2, items_per_user = 1, seed = 0, upstream_latency_ms = 0)
+        data = benchmark.buildDataset(args)
+        server = benchmark.fakefirebase.startServer(data)
+        self.addCleanup(server.shutdown)
+
+        # a recipe changes right after the recipes stream has loaded while the users stream is still loading, so the change event arrives while the API is starting
+        listen = server.database.listen
+        def delayedListen(path):
+            events, initial = listen(path)
+            if path.strip("/") == "recipes":
+                threading.Timer(0.1, self.renameRecipe, args = (server, 3, "Renamed during startup")).start()
+            elif path.strip("/") == "users":
+                time.sleep(1)
+            return events, initial
+        server.database.listen = delayedListen
+
+        directory = tempfile.mkdtemp()
+        apiConfig = configparser.ConfigParser()
+        apiConfig.optionxform = str
+        apiConfig.read(parentDir + '/RecipesPlusPlusApi/api.ini')
+        apiConfig['properties']['readReplica'] = 'true'
+        with open(directory + '/api.ini', 'w') as configFile:
+            apiConfig.write(configFile)
+        environment = {"RECIPESPLUSPLUS_SHARED_CONFIG": benchmark.writeSharedConfig(args, server, data, directory), "RECIPESPLUSPLUS_API_CONFIG": directory + '/api.ini'}
+
+        self.addCleanup(os.chdir, os.getcwd())
+        with mock.patch.dict(os.environ, environment):
+            api = benchmark.loadApi()
+        self.addCleanup(api.readReplica.close)
+
+        # the change reached the replica and was applied like a write made through the API
+        self.assertEqual(api.readReplica.getById("recipes", None, 3)["name"], "Renamed during startup")
+        stamp, lastModified = api.queries.getVersionStamp(["recipes"])
+        self.assertTrue(stamp.endswith("-recipes.1"), stamp)
+        client = api.app.test_client()
+        response = client.get('/RecipesPlusPlus/recipes/search?q=renamed')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([recipe["id"] for recipe in response.get_json()], [3])
+
+    def renameRecipe(self, server, recipeId, name):
+        with server.database.lock:
+            server.database.update("/recipes", {f"{recipeId}/name": name})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import configparser
+import json
+import os
+import pathlib
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+import urllib.error
+import urllib.request
+
+parentDir = str(pathlib.Path(__file__).parent.parent.absolute()).replace("\\",'/')
+API_URL = "http://127.0.0.1:5001/RecipesPlusPlus"
+
+def request(method, path, body = None):
+    data = json.dumps(body).encode() if body != None else None
+    try:
+        with urllib.request.urlopen(urllib.request.Request(API_URL + path, data = data, method = method), timeout = 5) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as error:
+        return error.code, json.loads(error.read() or b"null")
+
+class LaunchTest(unittest.TestCase):
+    def test_launches_sqlite_backend_without_firebase(self):
+        # the shipped shared configuration (no Firebase project or service account) switched to the sqlite backend
+        sharedConfig = configparser.ConfigParser()
+        sharedConfig.optionxform = str
+        sharedConfig.read(parentDir + '/Shared/shared.ini')
+        sharedConfig['properties']['storageBackend'] = 'sqlite'
+        directory = tempfile.mkdtemp()
+        with open(directory + '/shared.ini', 'w') as configFile:
+            sharedConfig.write(configFile)
+
+        launcher = subprocess.Popen([sys.executable, parentDir + '/serve.py'], cwd = parentDir, env = dict(os.environ, RECIPESPLUSPLUS_SHARED_CONFIG = directory + '/shared.ini'))
+        def stop():
+            if launcher.poll() == None:
+                launcher.kill()
+                launcher.wait()
+        self.addCleanup(stop)
+
+        # the API worker is up once it answers, the empty database has no ingredients yet
+        deadline = time.monotonic() + 60
+        while True:
+            self.assertIsNone(launcher.poll(), "launcher exited before serving")
+            try:
+                status, body = request("GET", "/ingredients/")
+                break
+            except OSError:
+                self.assertLess(time.monotonic(), deadline, "API didn't start serving")
+                time.sleep(0.5)
+        self.assertEqual(status, 400)
+
+        status, ingredient = request("POST", "/ingredients/", {"name": "Salt"})
+        self.assertEqual(status, 200)
+        self.assertEqual(request("GET", "/ingredients/"), (200, [ingredient]))
+
+        launcher.send_signal(signal.SIGTERM)
+        self.assertEqual(launcher.wait(30), 0)
+
+if __name__ == "__main__":
+    unittest.main()
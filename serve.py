@@ -0,0 +1,112 @@
+#region IMPORTS
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import pathlib
+import secrets
+import signal
+import subprocess
+import sys
+import time
+import pyrebase
+#endregion
+
+# production launcher: one token broker shared by the API and web app, each served by a multi-threaded WSGI server
+
+# get parent directory and dependencies
+parentDir = str(pathlib.Path(__file__).parent.absolute())
+parentDir = parentDir.replace("\\",'/')
+
+spec = importlib.util.spec_from_file_location('shared', parentDir + '/Shared/functions.py')
+functions = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(functions)
+
+# service name: (module path, port, shared configuration key for the number of worker threads)
+SERVICES = {
+    "api": ("RecipesPlusPlusApi/api.py", 5001, "apiThreads"),
+    "webapp": ("RecipesPlusPlusWebApp/app.py", 5000, "webAppThreads")
+}
+
+def parseArguments():
+    parser = argparse.ArgumentParser(description = "Serve the RecipesPlusPlus API and web app with a shared service account token broker.")
+    parser.add_argument("service", nargs = "?", choices = list(SERVICES), help = "serve a single service (used by the launcher for its workers)")
+    parser.add_argument("--services", default = "", help = "comma separated services to launch (default: all, or only the API when no Firebase project is configured)")
+    return parser.parse_args()
+
+def serveService(name, sharedConfig):
+    from waitress import serve
+
+    modulePath, port, threadsKey = SERVICES[name]
+    # services read their configuration relative to the repository root and the web app imports its views by name
+    os.chdir(parentDir)
+    sys.path.insert(0, parentDir + '/' + os.path.dirname(modulePath))
+    spec = importlib.util.spec_from_file_location(pathlib.Path(modulePath).stem, parentDir + '/' + modulePath)
+    service = importlib.util.module_from_spec(spec)
+    # Flask finds the templates and static files next to the registered module
+    sys.modules[spec.name] = service
+    spec.loader.exec_module(service)
+
+    # the API keeps its cache, version stamps and collection locks in process, so it scales with threads rather than processes
+    serve(service.app, host = '0.0.0.0', port = port, threads = sharedConfig.getint('properties', threadsKey, fallback = 8))
+
+def hasFirebaseProject(sharedConfig):
+    return sharedConfig['properties'].get('firebaseConfigJson', '') != ''
+
+def hasServiceAccount(sharedConfig):
+    # the sqlite backend and Firebase setups without a service account (e.g. local emulators) run unauthenticated, like api.py does
+    return sharedConfig['properties'].get('storageBackend', 'firebase') != 'sqlite' and hasFirebaseProject(sharedConfig) and sharedConfig['properties'].get('firebaseAuthEmail', '') != ''
+
+def defaultServices(sharedConfig):
+    # the web app signs its users in through Firebase Authentication, so without a Firebase project only the API is served
+    if hasFirebaseProject(sharedConfig):
+        return list(SERVICES)
+    logging.warning("No Firebase project is configured, serving the API without the web app")
+    return ["api"]
+
+def launch(services, sharedConfig):
+    spec = importlib.util.spec_from_file_location('shared', parentDir + '/Shared/tokenbroker.py')
+    tokenbroker = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(tokenbroker)
+
+    # sign into the service account once and hand the token to every worker
+    server = None
+    environment = dict(os.environ)
+    if hasServiceAccount(sharedConfig):
+        auth = pyrebase.initialize_app(json.loads(sharedConfig['properties']['firebaseConfigJson'])).auth()
+        broker = tokenbroker.TokenBroker(auth, sharedConfig['properties']['firebaseAuthEmail'], sharedConfig['properties'].get('firebaseAuthPassword', ''))
+        secret = secrets.token_urlsafe(32)
+        server = tokenbroker.startTokenBroker(broker, secret)
+        environment.update(RECIPESPLUSPLUS_TOKEN_BROKER_URL = server.url, RECIPESPLUSPLUS_TOKEN_BROKER_SECRET = secret)
+    workers = [subprocess.Popen([sys.executable, parentDir + '/serve.py', name], cwd = parentDir, env = environment) for name in services]
+
+    stopping = False
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    # if any worker exits the whole launch is taken down so it can be restarted as a unit
+    while not stopping and all(worker.poll() == None for worker in workers):
+        time.sleep(1)
+    for worker in workers:
+        if worker.poll() == None:
+            worker.terminate()
+    exitCodes = [worker.wait() for worker in workers]
+    if server != None:
+        server.shutdown()
+    return 0 if stopping else max(abs(code) for code in exitCodes)
+
+def main():
+    args = parseArguments()
+    sharedConfig = functions.buildSharedConfig(parentDir)
+    if args.service:
+        serveService(args.service, sharedConfig)
+        return 0
+    logging.basicConfig(level = logging.INFO, format = "%(levelname)s %(asctime)s - %(message)s")
+    return launch([name.strip() for name in args.services.split(",")] if args.services else defaultServices(sharedConfig), sharedConfig)
+
+if __name__ == "__main__":
+    sys.exit(main())
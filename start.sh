@@ -2,5 +2,5 @@
 
 #cd <INSERT-YOUR-PATH-HERE>/RecipesPlusPlus
 
-python 'RecipesPlusPlusApi/api.py' &
-python 'RecipesPlusPlusWebApp/app.py' &
+# serves the API and web app with multi-threaded workers sharing one service account token (see serve.py)
+python 'serve.py' &
\ No newline at end of file
@@ -1,4 +1,4 @@
 #!/bin/sh
 
-PID=$(ps aux | grep "python RecipesPlusPlus" | grep -v grep | awk '{print $2}')
+PID=$(ps aux | grep -e "python RecipesPlusPlus" -e "serve.py" | grep -v grep | awk '{print $2}')
 kill -9 $PID